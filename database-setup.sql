@@ -134,6 +134,9 @@ ALTER TABLE wallpapers ADD COLUMN IF NOT EXISTS download_count INTEGER DEFAULT 0
 ALTER TABLE wallpapers ADD COLUMN IF NOT EXISTS average_rating DECIMAL(3,2) DEFAULT 0;
 ALTER TABLE wallpapers ADD COLUMN IF NOT EXISTS featured BOOLEAN DEFAULT false;
 ALTER TABLE wallpapers ADD COLUMN IF NOT EXISTS device_type TEXT DEFAULT 'desktop'; -- desktop, mobile, tablet, all
+ALTER TABLE wallpapers ADD COLUMN IF NOT EXISTS derivatives JSONB; -- pre-rendered sizes: {"webp": {"800": "https://..."}}
+ALTER TABLE wallpapers ADD COLUMN IF NOT EXISTS content_hash TEXT; -- SHA-256 of the original, upsert key for the publisher
+ALTER TABLE wallpapers ADD COLUMN IF NOT EXISTS perceptual_hash TEXT; -- 64-bit pHash as 16 hex digits, for near-duplicate checks
 
 -- Create indexes for new fields
 CREATE INDEX IF NOT EXISTS idx_wallpapers_resolution ON wallpapers(resolution);
@@ -141,6 +144,7 @@ CREATE INDEX IF NOT EXISTS idx_wallpapers_device_type ON wallpapers(device_type)
 CREATE INDEX IF NOT EXISTS idx_wallpapers_featured ON wallpapers(featured);
 CREATE INDEX IF NOT EXISTS idx_wallpapers_download_count ON wallpapers(download_count DESC);
 CREATE INDEX IF NOT EXISTS idx_wallpapers_average_rating ON wallpapers(average_rating DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_wallpapers_content_hash ON wallpapers(content_hash);
 
 -- Database functions for analytics
 CREATE OR REPLACE FUNCTION increment_download_count(wallpaper_id UUID)
@@ -86,6 +86,7 @@ def main():
         "python-dotenv==1.0.1", 
         "boto3==1.35.39",
         "Pillow==10.4.0",
+        "numpy==1.26.4",
         "google-generativeai==0.8.3",
         "requests==2.32.3"
     ]
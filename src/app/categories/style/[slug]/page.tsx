@@ -1,7 +1,7 @@
-import Image from "next/image";
 import Link from "next/link";
 import { notFound } from "next/navigation";
 import { supabase, type Wallpaper } from "@/lib/supabase";
+import WallpaperImage from "@/components/WallpaperImage";
 import { ArrowLeft, Palette, Lightbulb, Sparkles } from "lucide-react";
 
 const styleCategories = {
@@ -204,9 +204,8 @@ export default async function StyleCategoryPage({ params }: PageProps) {
                 className="group block bg-white dark:bg-gray-800 rounded-lg shadow-md hover:shadow-lg transition-shadow duration-200"
               >
                 <div className="aspect-[3/4] relative overflow-hidden rounded-t-lg">
-                  <Image
-                    src={wallpaper.image_url}
-                    alt={wallpaper.title}
+                  <WallpaperImage
+                    wallpaper={wallpaper}
                     fill
                     className="object-cover group-hover:scale-105 transition-transform duration-200"
                   />
@@ -1,6 +1,6 @@
-import Image from "next/image";
 import Link from "next/link";
 import { supabase, type Wallpaper } from "@/lib/supabase";
+import WallpaperImage from "@/components/WallpaperImage";
 import { Star, Calendar, TrendingUp, Heart } from "lucide-react";
 
 export const metadata = {
@@ -146,9 +146,8 @@ export default async function CollectionsPage() {
                   className="group block bg-white dark:bg-gray-800 rounded-lg shadow-md hover:shadow-lg transition-shadow duration-200"
                 >
                   <div className="aspect-[3/4] relative overflow-hidden rounded-t-lg">
-                    <Image
-                      src={wallpaper.image_url}
-                      alt={wallpaper.title}
+                    <WallpaperImage
+                      wallpaper={wallpaper}
                       fill
                       className="object-cover group-hover:scale-105 transition-transform duration-200"
                     />
@@ -195,9 +194,8 @@ export default async function CollectionsPage() {
                   className="group block bg-white dark:bg-gray-800 rounded-lg shadow-md hover:shadow-lg transition-shadow duration-200"
                 >
                   <div className="aspect-[3/4] relative overflow-hidden rounded-t-lg">
-                    <Image
-                      src={wallpaper.image_url}
-                      alt={wallpaper.title}
+                    <WallpaperImage
+                      wallpaper={wallpaper}
                       fill
                       className="object-cover group-hover:scale-105 transition-transform duration-200"
                     />
@@ -1,7 +1,7 @@
-import Image from "next/image";
 import Link from "next/link";
 import { notFound } from "next/navigation";
 import { supabase, type Wallpaper } from "@/lib/supabase";
+import WallpaperImage from "@/components/WallpaperImage";
 import { Download, ArrowLeft, Calendar, Tag, Eye, Heart, Share2 } from "lucide-react";
 import { SEOService } from "@/lib/seo";
 import Navigation from "@/components/Navigation";
@@ -209,9 +209,8 @@ export default async function WallpaperPage({ params }: PageProps) {
           {/* Image */}
           <div className="lg:col-span-2">
             <div className="relative aspect-[4/3] bg-gray-200 dark:bg-gray-700 rounded-lg overflow-hidden shadow-lg">
-              <Image
-                src={wallpaper.image_url}
-                alt={wallpaper.title}
+              <WallpaperImage
+                wallpaper={wallpaper}
                 fill
                 className="object-cover"
                 sizes="(max-width: 1024px) 100vw, 66vw"
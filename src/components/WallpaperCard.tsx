@@ -17,6 +17,7 @@ import {
 import { Wallpaper } from '@/lib/supabase';
 import { Analytics } from '@/lib/analytics';
 import { CDNService } from '@/lib/cdn-config';
+import { ImageOptimizer } from '@/lib/image-optimization';
 import DownloadButton from './DownloadButton';
 import SocialProof from './SocialProof';
 import FavoriteButton from './FavoriteButton';
@@ -116,6 +117,7 @@ export default function WallpaperCard({
         <div className="relative aspect-portrait overflow-hidden rounded-t">
           <Image
             src={wallpaper.image_url}
+            loader={ImageOptimizer.derivativeLoader(wallpaper.derivatives)}
             alt={wallpaper.title}
             fill
             className="object-cover group-hover:scale-110 transition-transform duration-500 lazy-loading"
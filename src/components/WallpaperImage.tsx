@@ -0,0 +1,25 @@
+'use client';
+
+import Image, { type ImageProps } from 'next/image';
+import { ImageOptimizer } from '@/lib/image-optimization';
+import type { Wallpaper } from '@/lib/supabase';
+
+type WallpaperImageProps = Omit<ImageProps, 'src' | 'alt' | 'loader'> & {
+  wallpaper: Pick<Wallpaper, 'image_url' | 'title' | 'derivatives'>;
+  alt?: string;
+};
+
+// Serves the renditions the publisher stored with the row; rows published
+// without a derivative manifest fall back to the Next image optimizer
+export default function WallpaperImage({ wallpaper, alt, ...props }: WallpaperImageProps) {
+  const loader = ImageOptimizer.derivativeLoader(wallpaper.derivatives);
+
+  return (
+    <Image
+      {...props}
+      src={wallpaper.image_url}
+      alt={alt ?? wallpaper.title}
+      loader={loader}
+    />
+  );
+}
@@ -1,13 +1,58 @@
+import type { ImageLoader } from 'next/image';
 import { config } from './config';
 
+// Renditions stored by the publisher: { format: { width: url } }
+export type DerivativeManifest = Record<string, Record<string, string>>;
+
+// Formats every browser decodes, in the order a single-format srcset prefers them
+const UNIVERSAL_FORMATS = ['webp', 'jpeg'];
+
 // Image optimization utilities
 export class ImageOptimizer {
-  // Generate responsive image URLs with different sizes and formats
+  // Stored renditions of one format as [width, url] pairs, narrowest first
+  static derivativeWidths(derivatives: DerivativeManifest | null | undefined, format: string): [number, string][] {
+    const renditions = derivatives?.[format];
+    if (!renditions) return [];
+
+    return Object.entries(renditions)
+      .map(([width, url]): [number, string] => [parseInt(width, 10), url])
+      .filter(([width]) => width > 0)
+      .sort(([a], [b]) => a - b);
+  }
+
+  // Format to serve from a manifest when only one can be listed
+  static derivativeFormat(derivatives: DerivativeManifest | null | undefined, format?: string): string | null {
+    if (!derivatives) return null;
+
+    const candidates = [...(format ? [format] : []), ...UNIVERSAL_FORMATS, ...Object.keys(derivatives)];
+    return candidates.find(candidate => this.derivativeWidths(derivatives, candidate).length > 0) ?? null;
+  }
+
+  // Smallest stored rendition at least `width` wide, else the widest one
+  static derivativeUrl(derivatives: DerivativeManifest | null | undefined, width: number, format?: string): string | null {
+    const chosen = this.derivativeFormat(derivatives, format);
+    if (!chosen) return null;
+
+    const renditions = this.derivativeWidths(derivatives, chosen);
+    const match = renditions.find(([stored]) => stored >= width) ?? renditions[renditions.length - 1];
+    return match[1];
+  }
+
+  // next/image loader that picks stored renditions; undefined leaves rows
+  // without a manifest on the default optimizer
+  static derivativeLoader(derivatives: DerivativeManifest | null | undefined, format?: string): ImageLoader | undefined {
+    if (!this.derivativeFormat(derivatives, format)) return undefined;
+
+    return ({ src, width }) => this.derivativeUrl(derivatives, width, format) ?? src;
+  }
+
+  // Generate responsive image URLs with different sizes and formats, taking
+  // stored renditions from the manifest and transcoding only what it lacks
   static generateResponsiveUrls(baseUrl: string, options: {
     sizes?: number[];
     formats?: string[];
     quality?: number;
-  } = {}) {
+  } = {}, derivatives?: DerivativeManifest | null) {
     const {
       sizes = [400, 800, 1200, 1920],
       formats = ['avif', 'webp', 'jpeg'],
@@ -18,6 +63,14 @@ export class ImageOptimizer {
 
     formats.forEach(format => {
       urls[format] = {};
+      const stored = this.derivativeWidths(derivatives, format);
+      if (stored.length > 0) {
+        stored.forEach(([width, url]) => {
+          urls[format][width] = url;
+        });
+        return;
+      }
+
       sizes.forEach(size => {
         urls[format][size] = this.buildOptimizedUrl(baseUrl, {
           width: size,
@@ -58,18 +111,24 @@ export class ImageOptimizer {
     return `${baseUrl}?${params.toString()}`;
   }
 
-  // Generate srcset string for responsive images
+  // Generate srcset string for responsive images, from the stored
+  // renditions when the manifest has the format
   static generateSrcSet(baseUrl: string, options: {
     sizes?: number[];
     format?: string;
     quality?: number;
-  } = {}) {
+  } = {}, derivatives?: DerivativeManifest | null) {
     const {
       sizes = [400, 800, 1200, 1920],
       format = 'webp',
       quality = 85
     } = options;
 
+    const stored = this.derivativeWidths(derivatives, format);
+    if (stored.length > 0) {
+      return stored.map(([width, url]) => `${url} ${width}w`).join(', ');
+    }
+
     return sizes
       .map(size => {
         const url = this.buildOptimizedUrl(baseUrl, { width: size, format, quality });
@@ -277,6 +336,7 @@ export function createProgressiveImage(src: string, options: {
   className?: string;
   priority?: boolean;
   quality?: number;
+  derivatives?: DerivativeManifest | null;
 } = { alt: '' }) {
   const {
     alt,
@@ -284,12 +344,14 @@ export function createProgressiveImage(src: string, options: {
     height,
     className = '',
     priority = false,
-    quality = 85
+    quality = 85,
+    derivatives
   } = options;
 
   // Generate different sizes and formats
   const sizes = ImageOptimizer.generateSizes();
-  const srcSet = ImageOptimizer.generateSrcSet(src, { quality });
+  const format = ImageOptimizer.derivativeFormat(derivatives) ?? undefined;
+  const srcSet = ImageOptimizer.generateSrcSet(src, { quality, format }, derivatives);
   const placeholder = ImageOptimizer.generateBlurPlaceholder(width, height);
 
   return {
@@ -21,4 +21,7 @@ export interface Wallpaper {
   average_rating?: number
   featured?: boolean
   device_type?: string
+  derivatives?: Record<string, Record<string, string>> | null
+  content_hash?: string | null
+  perceptual_hash?: string | null
 }
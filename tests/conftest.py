@@ -0,0 +1,50 @@
+"""
+Shared fixtures for the Wallpaper Publisher tests
+R2 and Supabase are the in-process fakes from wallpaper_fakes, reached
+through the real boto3 and supabase-py clients
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# The publisher modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from wallpaper_fakes import FakePostgrest, FakeS3Server  # noqa: E402
+
+BUCKET = 'bench'
+
+
+@pytest.fixture
+def s3():
+    with FakeS3Server() as server:
+        yield server
+
+
+@pytest.fixture
+def postgrest():
+    with FakePostgrest() as server:
+        yield server
+
+
+@pytest.fixture
+def r2_factory(s3):
+    """Builds boto3 clients for the fake bucket, which exists from the start"""
+    import boto3
+    from botocore.config import Config
+
+    def create():
+        return boto3.client('s3', endpoint_url=s3.url, aws_access_key_id='test', aws_secret_access_key='test',
+                            region_name='auto', config=Config(s3={'addressing_style': 'path'}))
+
+    create().create_bucket(Bucket=BUCKET)
+    return create
+
+
+@pytest.fixture
+def supabase_factory(postgrest):
+    from supabase import create_client
+
+    return lambda: create_client(postgrest.url, 'test-key')
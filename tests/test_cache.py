@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+import wallpaper_cache
+from wallpaper_cache import MetadataCache, metadata_cache_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(wallpaper_cache.time, 'time', clock)
+    return clock
+
+
+def entry_size(metadata):
+    return len(json.dumps(metadata, ensure_ascii=False).encode('utf-8'))
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = MetadataCache(tmp_path / 'metadata_cache.sqlite3', ttl_seconds=60)
+    cache.put('fresh', {'title': 'Aurora'})
+
+    clock.now += 59
+    assert cache.get('fresh') == {'title': 'Aurora'}
+    clock.now += 2
+    assert cache.get('fresh') is None
+    cache.close()
+
+
+def test_reads_do_not_extend_the_ttl(tmp_path, clock):
+    cache = MetadataCache(tmp_path / 'metadata_cache.sqlite3', ttl_seconds=60)
+    cache.put('key', {'title': 'Aurora'})
+    for _ in range(3):
+        clock.now += 30
+        cache.get('key')
+    assert cache.get('key') is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_beyond_the_byte_cap(tmp_path, clock):
+    metadata = {'title': 'x' * 100}
+    cache = MetadataCache(tmp_path / 'metadata_cache.sqlite3', max_bytes=3 * entry_size(metadata))
+    for key in ('a', 'b', 'c'):
+        cache.put(key, metadata)
+        clock.now += 1
+    # Reading a makes b the least recently used
+    assert cache.get('a') == metadata
+    clock.now += 1
+
+    cache.put('d', metadata)
+
+    assert cache.get('b') is None
+    assert all(cache.get(key) == metadata for key in ('a', 'c', 'd'))
+    cache.close()
+
+
+def test_cache_survives_reopening(tmp_path, clock):
+    path = tmp_path / 'metadata_cache.sqlite3'
+    cache = MetadataCache(path)
+    cache.put('key', {'tags': ['mountains', 'lake']})
+    cache.close()
+
+    reopened = MetadataCache(path)
+    assert reopened.get('key') == {'tags': ['mountains', 'lake']}
+    reopened.invalidate('key')
+    assert reopened.get('key') is None
+    reopened.close()
+
+
+def test_cache_key_changes_with_prompt_and_model():
+    keys = {metadata_cache_key('a' * 64, prompt, model) for prompt in ('p1', 'p2') for model in ('m1', 'm2')}
+    assert len(keys) == 4
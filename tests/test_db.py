@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from wallpaper_db import RowWriteError, WallpaperWriter, upsert_rows
+from wallpaper_fakes import FakePostgrest
+
+
+class RecordingPostgrest(FakePostgrest):
+    """Keeps every upsert request's rows and rejects any request holding a poisoned row"""
+
+    def __init__(self, poisoned=()):
+        super().__init__()
+        self.poisoned = set(poisoned)
+        self.batches = []
+        self._batches_lock = threading.Lock()
+
+    def insert(self, table, rows, conflict):
+        with self._batches_lock:
+            self.batches.append([dict(row) for row in rows])
+        if any(row.get('content_hash') in self.poisoned for row in rows):
+            # The handler drops the connection, which the client reports as a failed request
+            raise ValueError("rejected")
+        return super().insert(table, rows, conflict)
+
+
+def row(number, **extra):
+    return dict({'content_hash': f"{number:064x}", 'title': f"Wallpaper {number}"}, **extra)
+
+
+@pytest.fixture
+def recording():
+    servers = []
+
+    def start(poisoned=()):
+        server = RecordingPostgrest(poisoned).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def client_for(server):
+    from supabase import create_client
+
+    return create_client(server.url, 'test-key')
+
+
+def test_upsert_rows_sends_one_request_per_key_set(recording):
+    server = recording()
+    rows = [row(1), row(2, featured=True), row(3), row(4, featured=False, device_type='mobile')]
+
+    records = upsert_rows(client_for(server), rows)
+
+    assert sorted(record['content_hash'] for record in records) == sorted(r['content_hash'] for r in rows)
+    assert len(server.batches) == 3
+    for batch in server.batches:
+        assert len({tuple(sorted(sent)) for sent in batch}) == 1
+    assert sorted(len(batch) for batch in server.batches) == [1, 1, 2]
+
+
+def test_writer_isolates_rejected_rows_by_bisection(recording):
+    poisoned = {f"{3:064x}", f"{6:064x}"}
+    server = recording(poisoned)
+    writer = WallpaperWriter(client_for(server), batch_size=8, flush_interval=60)
+
+    futures = {number: writer.submit(row(number)) for number in range(8)}
+    writer.close()
+
+    for number, future in futures.items():
+        if f"{number:064x}" in poisoned:
+            with pytest.raises(RowWriteError):
+                future.result()
+        else:
+            assert future.result()['content_hash'] == f"{number:064x}"
+    assert sorted(failed.row['content_hash'] for failed in writer.failed_rows) == sorted(poisoned)
+    # 8 -> 4 + 4 -> 2 + 2 per half -> 1 + 1 for each half holding a poisoned row
+    assert futures[3].retries == 4
+    assert futures[0].retries == 2
+    assert len(server.rows('wallpapers')) == 6
+
+
+def test_writer_answers_duplicate_submissions_from_one_row(recording):
+    server = recording()
+    writer = WallpaperWriter(client_for(server), batch_size=4, flush_interval=60)
+
+    first, second = writer.submit(row(1)), writer.submit(row(1))
+    writer.close()
+
+    assert first.result()['id'] == second.result()['id']
+    assert sum(len(batch) for batch in server.batches) == 1
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from wallpaper_imaging import dominant_colors, open_reduced
+from wallpaper_scan import EXIF_ORIENTATION
+
+
+def banded(*bands):
+    """A 96 pixel wide image of horizontal colour bands, (rgb, rows) each; small enough not to be resampled"""
+    pixels = np.concatenate([np.tile(np.array(rgb, dtype=np.uint8), (rows, 96, 1)) for rgb, rows in bands])
+    return Image.fromarray(pixels)
+
+
+def noisy(seed):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 255, (90, 160, 3), dtype=np.uint8))
+
+
+def test_palette_is_ordered_by_coverage():
+    image = banded(((0, 0, 255), 10), ((255, 0, 0), 24), ((0, 160, 0), 14))
+    assert dominant_colors(image) == ['#ff0000', '#00a000', '#0000ff']
+
+
+@pytest.mark.parametrize('iterations', [1, 2, 8])
+def test_palette_is_deterministic(iterations):
+    image = noisy(11)
+    first = dominant_colors(image, iterations=iterations)
+    assert all(dominant_colors(image.copy(), iterations=iterations) == first for _ in range(3))
+
+
+def test_capped_run_orders_by_the_final_clusters():
+    # One iteration cannot converge on noise; the reported order must still match the final centres
+    image = noisy(0)
+    palette = dominant_colors(image, iterations=1)
+    pixels = np.asarray(image.resize((96, 54), Image.Resampling.BOX), dtype=np.float32).reshape(-1, 3)
+    centres = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] for color in palette], dtype=np.float32)
+    sizes = np.bincount(((pixels[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).argmin(axis=1),
+                        minlength=len(centres))
+    assert list(sizes) == sorted(sizes, reverse=True)
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG'])
+def test_open_reduced_bounds_the_displayed_size_of_rotated_images(tmp_path, fmt):
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    path = tmp_path / f"rotated.{fmt.lower()}"
+    Image.new('RGB', (4000, 3000), 'navy').save(path, fmt, exif=exif.tobytes())
+
+    image = open_reduced(path, (300, 200))
+
+    assert image.size == (150, 200)
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from wallpaper_journal import STAGES, JobJournal
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return tmp_path / 'state' / 'journal.sqlite3'
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'wallpaper.jpg'
+    path.write_bytes(b'jpeg bytes')
+    return path
+
+
+def test_stages_advance_in_order_and_never_move_back(journal_path, image):
+    journal = JobJournal(journal_path)
+    assert journal.begin(image).stage == 'pending'
+
+    journal.advance(image, 'hashed', sha256='a' * 64)
+    journal.advance(image, 'uploaded', object_key='a.jpg', public_url='https://cdn.example/a.jpg')
+    # A slower worker reporting an earlier stage only updates its fields
+    journal.advance(image, 'analysed', metadata={'title': 'Dunes'}, color_palette=['#c2b280'])
+
+    entry = journal.get(image)
+    assert entry.stage == 'uploaded'
+    assert entry.reached('analysed') and not entry.reached('inserted')
+    assert entry.metadata == {'title': 'Dunes'}
+    assert entry.color_palette == ['#c2b280']
+    assert entry.public_url == 'https://cdn.example/a.jpg'
+    journal.close()
+
+
+def test_resume_keeps_progress_and_restarts_changed_files(journal_path, image, tmp_path):
+    other = tmp_path / 'other.jpg'
+    other.write_bytes(b'other bytes')
+    journal = JobJournal(journal_path)
+    journal.begin(image)
+    journal.advance(image, 'uploaded', sha256='a' * 64, object_key='a.jpg')
+    journal.begin(other)
+    journal.advance(other, 'inserted', sha256='b' * 64, wallpaper_id='7')
+    journal.record_error(image, 'Gemini quota exhausted')
+    journal.close()
+
+    resumed = JobJournal(journal_path)
+    unfinished = list(resumed.unfinished())
+    assert [entry.path for entry in unfinished] == [str(image)]
+    assert unfinished[0].stage == 'uploaded'
+    assert unfinished[0].error == 'Gemini quota exhausted'
+    assert resumed.begin(image).object_key == 'a.jpg'
+    assert resumed.counts() == dict({stage: 0 for stage in STAGES}, uploaded=1, inserted=1)
+
+    image.write_bytes(b'edited jpeg bytes')
+    restarted = resumed.begin(image)
+    assert restarted.stage == 'pending' and restarted.sha256 is None
+    resumed.close()
+
+
+def test_advance_rejects_unknown_fields(journal_path, image):
+    journal = JobJournal(journal_path)
+    journal.begin(image)
+    with pytest.raises(ValueError):
+        journal.advance(image, 'hashed', checksum='a' * 64)
+    journal.close()
+
+
+def test_forget_upload_moves_every_copy_back_to_hashed(journal_path, image, tmp_path):
+    copy = tmp_path / 'copy.jpg'
+    copy.write_bytes(image.read_bytes())
+    os.utime(copy, ns=(1, 1))
+    journal = JobJournal(journal_path)
+    for path, stage in ((image, 'inserted'), (copy, 'uploaded')):
+        journal.begin(path)
+        journal.advance(path, stage, sha256='a' * 64, object_key='a.jpg', public_url='https://cdn.example/a.jpg',
+                        derivatives={'webp': {'400': 'https://cdn.example/a/w400.webp'}}, wallpaper_id='7',
+                        metadata={'title': 'Dunes'})
+
+    journal.forget_upload('a' * 64)
+
+    for entry in journal.find('a' * 64):
+        assert entry.stage == 'hashed'
+        assert (entry.object_key, entry.public_url, entry.derivatives, entry.wallpaper_id) == (None,) * 4
+        # What was learnt before the upload is kept for the next run
+        assert entry.metadata == {'title': 'Dunes'}
+    journal.close()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import wallpaper_publisher as wp
+from conftest import BUCKET
+from wallpaper_bench import BENCH_ENV
+from wallpaper_fakes import FakeGeminiModel
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch, s3):
+    """A folder of wallpapers and a .env.local pointing the publisher at the fakes"""
+    monkeypatch.chdir(tmp_path)
+    env = BENCH_ENV.replace('R2_PUBLIC_URL=https://bench.r2.dev', f"R2_PUBLIC_URL={s3.url}/{BUCKET}")
+    (tmp_path / '.env.local').write_text(env)
+    # Set here as well, so load_dotenv leaves them alone and they are undone after the test
+    for line in env.splitlines():
+        name, _, value = line.partition('=')
+        monkeypatch.setenv(name, value)
+    monkeypatch.setenv('WALLPAPER_PUBLISHER_STATE_DIR', str(tmp_path / 'state'))
+
+    folder = tmp_path / 'wallpapers'
+    folder.mkdir()
+    rng = np.random.default_rng(3)
+    for number in range(2):
+        pattern = Image.fromarray(rng.integers(0, 255, (9, 16, 3), dtype=np.uint8))
+        pattern.resize((1000, 560)).save(folder / f"wallpaper{number}.jpg", 'JPEG')
+    return folder
+
+
+def test_sync_restores_deleted_objects_with_their_derivatives(workspace, s3, postgrest, r2_factory,
+                                                              supabase_factory, capsys):
+    services = wp.Services(supabase=supabase_factory, r2=r2_factory,
+                           gemini_model=lambda key: FakeGeminiModel(0.0))
+    argv = ['--sync', str(workspace), '--gemini-key', 'test', '--gemini-rpm', '100000',
+            '--near-duplicates', 'skip', '--no-prewarm']
+
+    assert wp.main(argv, services) == 0
+    published = {key for _, key in s3.objects}
+    assert len(postgrest.rows('wallpapers')) == 2
+    assert any('/' in key for key in published)
+
+    r2 = r2_factory()
+    for key in published:
+        r2.delete_object(Bucket=BUCKET, Key=key)
+    capsys.readouterr()
+
+    assert wp.main(argv, services) == 0
+
+    # The originals' own earlier uploads are not near-duplicates of them, so nothing is skipped
+    assert 'Near-duplicates' not in capsys.readouterr().out
+    assert {key for _, key in s3.objects} == published
+    rows = postgrest.rows('wallpapers')
+    assert len(rows) == 2
+    prefix = f"{s3.url}/{BUCKET}/"
+    for row in rows:
+        urls = [url for widths in row['derivatives'].values() for url in widths.values()]
+        assert urls and all(url[len(prefix):] in published for url in urls)
@@ -0,0 +1,105 @@
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from wallpaper_similarity import HASH_BITS, MERGE_THRESHOLD, SimilarityIndex, perceptual_hash
+
+
+def brute_force(entries, value, max_distance):
+    found = set()
+    for entry_hash, wallpaper_id, url in entries:
+        distance = bin(entry_hash ^ value).count('1')
+        if distance <= max_distance:
+            found.add((wallpaper_id, url, distance))
+    return found
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(HASH_BITS), count):
+        value ^= 1 << bit
+    return value
+
+
+@pytest.fixture
+def corpus():
+    rng = random.Random(7)
+    bases = [rng.getrandbits(HASH_BITS) for _ in range(300)]
+    entries = []
+    for number in range(3000):
+        # Clusters of near variants around a few hundred artworks, plus unrelated hashes
+        value = flip_bits(rng.choice(bases), rng.randint(0, 12), rng) if number % 3 else rng.getrandbits(HASH_BITS)
+        entries.append((value, str(number), f"https://cdn.example/{number}.jpg"))
+    queries = [flip_bits(rng.choice(bases), rng.randint(0, 10), rng) for _ in range(200)]
+    queries += [rng.getrandbits(HASH_BITS) for _ in range(50)]
+    return entries, queries
+
+
+@pytest.mark.parametrize('max_distance', [0, 3, 8, 12])
+def test_matches_agree_with_a_brute_force_scan(corpus, max_distance):
+    entries, queries = corpus
+    index = SimilarityIndex.from_entries(entries)
+
+    for query in queries:
+        matches = index.matches(query, max_distance)
+        assert {(m.wallpaper_id, m.image_url, m.distance) for m in matches} == brute_force(entries, query,
+                                                                                           max_distance)
+        assert [m.distance for m in matches] == sorted(m.distance for m in matches)
+
+
+def test_entries_added_after_building_are_found_before_and_after_merging(corpus):
+    entries, queries = corpus
+    index = SimilarityIndex.from_entries(entries[:1000])
+    for entry in entries[1000:1000 + MERGE_THRESHOLD - 1]:
+        index.add(*entry)
+    assert index._recent
+    for query in queries[:50]:
+        found = {(m.wallpaper_id, m.distance) for m in index.matches(query, 8)}
+        expected = {(wallpaper_id, distance)
+                    for wallpaper_id, _, distance in brute_force(entries[:1000 + MERGE_THRESHOLD - 1], query, 8)}
+        assert found == expected
+
+    for entry in entries[1000 + MERGE_THRESHOLD - 1:]:
+        index.add(*entry)
+    assert len(index) == len(entries)
+    for query in queries[:50]:
+        assert {(m.wallpaper_id, m.distance) for m in index.matches(query, 8)} == \
+            {(wallpaper_id, distance) for wallpaper_id, _, distance in brute_force(entries, query, 8)}
+
+
+def test_save_and_load_round_trip(tmp_path, corpus):
+    entries, queries = corpus
+    path = tmp_path / 'similarity_index.npz'
+    SimilarityIndex.from_entries(entries).save(path)
+
+    loaded = SimilarityIndex.load(path)
+
+    assert len(loaded) == len(entries)
+    for query in queries[:20]:
+        assert {(m.wallpaper_id, m.distance) for m in loaded.matches(query)} == \
+            {(wallpaper_id, distance) for wallpaper_id, _, distance in brute_force(entries, query, 8)}
+
+
+def test_nearest_skips_the_entry_of_the_same_content():
+    sha256 = 'ab' * 32
+    index = SimilarityIndex.from_entries([
+        (0b1111, '1', f"https://cdn.example/{sha256}.jpg"),
+        (0b0111, '2', f"https://cdn.example/{'cd' * 32}.jpg"),
+    ])
+
+    assert index.nearest(0b1111).wallpaper_id == '1'
+    assert index.nearest(0b1111, content_hash=sha256).wallpaper_id == '2'
+    assert index.nearest(0b1111, max_distance=0, content_hash=sha256) is None
+
+
+def test_perceptual_hash_survives_resizing_and_recompression(tmp_path):
+    rng = np.random.default_rng(5)
+    artwork = Image.fromarray(rng.integers(0, 255, (9, 16, 3), dtype=np.uint8)).resize((1600, 900),
+                                                                                       Image.Resampling.BICUBIC)
+    smaller = artwork.resize((800, 450), Image.Resampling.LANCZOS)
+    smaller.save(tmp_path / 'smaller.jpg', 'JPEG', quality=70)
+
+    with Image.open(tmp_path / 'smaller.jpg') as recompressed:
+        distance = bin(perceptual_hash(artwork) ^ perceptual_hash(recompressed)).count('1')
+    assert distance <= 4
@@ -0,0 +1,76 @@
+import hashlib
+
+import pytest
+from PIL import Image
+
+from conftest import BUCKET
+from wallpaper_index import ContentIndex, content_key
+from wallpaper_sync import plan_sync
+
+PUBLIC_URL = 'https://cdn.example/bench'
+
+
+def write_image(path, color):
+    Image.new('RGB', (32, 18), color).save(path, 'PNG')
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+@pytest.fixture
+def content_index(tmp_path):
+    index = ContentIndex(tmp_path / 'state' / 'content_index.sqlite3')
+    yield index
+    index.close()
+
+
+def test_plan_sync_classifies_folder_bucket_and_rows(tmp_path, content_index, r2_factory, supabase_factory,
+                                                     postgrest):
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    in_sync = write_image(folder / 'in_sync.png', 'red')
+    stored_only = write_image(folder / 'stored_only.png', 'green')
+    new = write_image(folder / 'new.png', 'blue')
+    (folder / 'in_sync_copy.png').write_bytes((folder / 'in_sync.png').read_bytes())
+    (folder / 'notes.txt').write_text('not an image')
+    remote_only = hashlib.sha256(b'remote').hexdigest()
+
+    r2 = r2_factory()
+    for sha256 in (in_sync, stored_only, remote_only):
+        r2.put_object(Bucket=BUCKET, Key=content_key(sha256, '.png'), Body=b'x')
+        # Derivatives sit under the content prefix and are not originals
+        r2.put_object(Bucket=BUCKET, Key=f"{sha256}/w400.webp", Body=b'x')
+    r2.put_object(Bucket=BUCKET, Key='legacy-upload.png', Body=b'x')
+    postgrest.insert('wallpapers', [
+        {'image_url': f"{PUBLIC_URL}/{content_key(in_sync, '.png')}", 'content_hash': in_sync},
+        {'image_url': f"{PUBLIC_URL}/{content_key('f' * 64, '.png')}", 'content_hash': 'f' * 64},
+    ], None)
+
+    plan = plan_sync(folder, ['.png'], content_index, r2, BUCKET, supabase_factory(), PUBLIC_URL, workers=4)
+
+    assert (plan.files, plan.hashed, plan.objects, plan.rows) == (4, 4, 4, 2)
+    assert plan.in_sync == 1
+    assert [local.sha256 for local in plan.upload] == [new]
+    assert [(local.sha256, obj.key) for local, obj in plan.insert] == [(stored_only, content_key(stored_only, '.png'))]
+    assert [local.path for local in plan.copies] == [str(folder / 'in_sync_copy.png')]
+    assert plan.bucket_only == [content_key(remote_only, '.png')]
+    assert plan.unmatched == ['legacy-upload.png']
+    assert [row['content_hash'] for row in plan.missing_objects] == ['f' * 64]
+    assert plan.delta == 2
+
+
+def test_plan_sync_reuses_cached_hashes_and_matches_legacy_keys(tmp_path, content_index, r2_factory,
+                                                                supabase_factory, postgrest):
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    legacy = write_image(folder / 'legacy.png', 'white')
+    r2 = r2_factory()
+    r2.put_object(Bucket=BUCKET, Key='legacy-upload.png', Body=b'x')
+    content_index.record_upload(legacy, 'legacy-upload.png', f"{PUBLIC_URL}/legacy-upload.png")
+    postgrest.insert('wallpapers', [{'image_url': f"{PUBLIC_URL}/legacy-upload.png"}], None)
+
+    first = plan_sync(folder, ['.png'], content_index, r2, BUCKET, supabase_factory(), PUBLIC_URL, workers=2)
+    second = plan_sync(folder, ['.png'], content_index, r2, BUCKET, supabase_factory(), PUBLIC_URL, workers=2)
+
+    assert (first.hashed, second.hashed) == (1, 0)
+    for plan in (first, second):
+        assert plan.in_sync == 1
+        assert (plan.upload, plan.insert, plan.unmatched, plan.missing_objects) == ([], [], [], [])
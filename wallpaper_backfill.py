@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Catalogue backfill for the Wallpaper Publisher
+Fills resolution, device_type, file_size and color_palette on wallpapers rows
+published before those columns were written, reading only the leading bytes
+of each R2 original and the smallest derivative for colours
+"""
+
+import io
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from PIL import Image
+
+from wallpaper_imaging import PALETTE_SAMPLE_DIMENSION, dominant_colors
+from wallpaper_scan import TRANSPOSED_ORIENTATIONS, device_type_for, read_orientation
+from wallpaper_similarity import smallest_image_url
+
+# The column default every row inserted without a measured resolution has
+DEFAULT_RESOLUTION = '1920x1080'
+# Columns read from each row; every batched update sends the same set, so none is reset to NULL
+BACKFILL_COLUMNS = ('resolution', 'device_type', 'file_size', 'color_palette')
+ROW_COLUMNS = 'id,title,category,image_url,derivatives,' + ','.join(BACKFILL_COLUMNS)
+
+# The first ranged read covers the header of nearly every JPEG, PNG and WebP;
+# headers behind large EXIF or ICC blocks get doubled reads up to the maximum
+HEADER_BYTES = 32 * 1024
+MAX_HEADER_BYTES = 1024 * 1024
+
+DEFAULT_BACKFILL_WORKERS = 16
+
+
+@dataclass
+class ObjectHeader:
+    """Size and displayed dimensions of a stored original"""
+    size: int
+    width: int
+    height: int
+    bytes_read: int
+
+    @property
+    def resolution(self) -> str:
+        return f"{self.width}x{self.height}"
+
+
+@dataclass
+class BackfillResult:
+    """The columns measured for one row, or why it could not be measured"""
+    row: Dict
+    columns: Dict = field(default_factory=dict)
+    bytes_read: int = 0
+    palette_bytes: int = 0
+    object_size: int = 0
+    error: Optional[str] = None
+
+    @property
+    def changed(self) -> bool:
+        return any(self.row.get(name) != value for name, value in self.columns.items())
+
+
+class BackfillStats:
+    """Running totals printed at the end of a backfill"""
+
+    def __init__(self):
+        self.rows = 0
+        self.complete = 0
+        self.external = 0
+        self.measured = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.without_palette = 0
+        self.bytes_read = 0
+        self.palette_bytes = 0
+        self.object_bytes = 0
+        self.started = time.perf_counter()
+
+    def add(self, result: BackfillResult):
+        self.measured += 1
+        self.bytes_read += result.bytes_read
+        self.palette_bytes += result.palette_bytes
+        self.object_bytes += result.object_size
+        if result.error:
+            self.failed += 1
+        elif result.changed:
+            self.updated += 1
+        else:
+            self.unchanged += 1
+        if not result.error and result.row.get('color_palette') is None and 'color_palette' not in result.columns:
+            self.without_palette += 1
+
+    def format_summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        share = self.bytes_read / self.object_bytes if self.object_bytes else 0.0
+        return "\n".join([
+            f"Checked {self.rows} rows in {elapsed:.1f}s: {self.complete} already complete, "
+            f"{self.external} hosted outside the bucket, {self.measured} measured ({self.measured / elapsed:.0f} rows/s)",
+            f"  Updated {self.updated}, {self.unchanged} already correct, {self.failed} failed",
+            f"  Read {self.bytes_read / (1024 * 1024):.1f} MB of headers from "
+            f"{self.object_bytes / (1024 * 1024):.1f} MB of originals ({share:.2%}), "
+            f"and {self.palette_bytes / (1024 * 1024):.1f} MB of images for colour palettes",
+        ])
+
+
+def object_key_for_url(url: str, public_url_base: str) -> Optional[str]:
+    """The R2 key behind a public URL, or None for images hosted elsewhere"""
+    prefix = public_url_base.rstrip('/') + '/'
+    return url[len(prefix):] if url and url.startswith(prefix) else None
+
+
+def _palette_source(row: Dict, palettes_from_originals: bool) -> Optional[str]:
+    """URL to take a row's colours from; None when only the whole original would do and that is not allowed"""
+    url = smallest_image_url(row)
+    return url if url != row['image_url'] or palettes_from_originals else None
+
+
+def needs_backfill(row: Dict, palettes_from_originals: bool = False) -> bool:
+    """True for rows still carrying a column default that can be measured
+
+    A genuine 1920x1080 row cannot be told apart from the default, so it is
+    checked again on every run; that costs one small ranged read.
+    """
+    if row.get('file_size') is None or row.get('resolution') in (None, DEFAULT_RESOLUTION):
+        return True
+    return row.get('color_palette') is None and _palette_source(row, palettes_from_originals) is not None
+
+
+def _total_size(response: Dict) -> int:
+    """Object size from the Content-Range of a ranged GET ('bytes 0-65535/7340032')"""
+    content_range = response.get('ContentRange')
+    if content_range:
+        return int(content_range.rsplit('/', 1)[1])
+    return response['ContentLength']
+
+
+def read_object_header(r2_client, bucket_name: str, key: str) -> ObjectHeader:
+    """Measure an object from ranged reads of its leading bytes
+
+    The Content-Range of the first read carries the object size, so no
+    separate HEAD request is needed. Image.open only parses the header, and
+    fails on a prefix that ends inside it, in which case twice as many bytes
+    are read, up to MAX_HEADER_BYTES.
+    """
+    data = b''
+    length = HEADER_BYTES
+    while True:
+        response = r2_client.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={len(data)}-{length - 1}")
+        size = _total_size(response)
+        data += response['Body'].read()
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+                orientation = read_orientation(image)
+            break
+        except Exception:
+            if len(data) >= size or length >= MAX_HEADER_BYTES:
+                raise
+            length *= 2
+
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return ObjectHeader(size, width, height, len(data))
+
+
+def read_palette(r2_client, bucket_name: str, key: str) -> Tuple[List[str], int]:
+    """Dominant colours of a stored image and the bytes downloaded for them"""
+    data = r2_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('RGB', (PALETTE_SAMPLE_DIMENSION, PALETTE_SAMPLE_DIMENSION))
+        return dominant_colors(image), len(data)
+
+
+def backfill_row(r2_client, bucket_name: str, public_url_base: str, row: Dict,
+                 palettes_from_originals: bool = False) -> BackfillResult:
+    """Measure the missing columns of one row; problems are recorded on the result rather than raised"""
+    result = BackfillResult(row)
+    key = object_key_for_url(row.get('image_url'), public_url_base)
+    if key is None:
+        result.error = "image is not stored in the R2 bucket"
+        return result
+    try:
+        header = read_object_header(r2_client, bucket_name, key)
+        result.bytes_read, result.object_size = header.bytes_read, header.size
+        result.columns.update(resolution=header.resolution, file_size=header.size,
+                              device_type=device_type_for(header.width, header.height))
+
+        if row.get('color_palette') is None:
+            # Without a derivative the whole original would have to be downloaded
+            palette_url = _palette_source(row, palettes_from_originals)
+            palette_key = palette_url and object_key_for_url(palette_url, public_url_base)
+            if palette_key:
+                palette, bytes_read = read_palette(r2_client, bucket_name, palette_key)
+                result.columns['color_palette'] = palette
+                result.palette_bytes = bytes_read
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def update_row(row: Dict, result: BackfillResult) -> Dict:
+    """The upsert row for a measured result, keyed on id
+
+    PostgREST inserts the NOT NULL columns before resolving the conflict, so
+    they are sent unchanged alongside every backfill column.
+    """
+    update = {name: row[name] for name in ('id', 'title', 'category', 'image_url')}
+    update.update({name: row.get(name) for name in BACKFILL_COLUMNS})
+    update.update(result.columns)
+    return update
+
+
+def backfill(rows: Iterable[Dict], r2_client, bucket_name: str, public_url_base: str,
+             workers: int = DEFAULT_BACKFILL_WORKERS, palettes_from_originals: bool = False,
+             stats: Optional[BackfillStats] = None) -> Iterator[BackfillResult]:
+    """Measure every row that needs it on a thread pool and yield results as they complete
+
+    Rows are streamed from the paginated listing and at most a few reads
+    per worker are queued, so the whole table is never held in memory.
+    """
+    stats = stats or BackfillStats()
+    max_pending = workers * 4
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backfill') as executor:
+        pending: Set[Future] = set()
+        for row in rows:
+            stats.rows += 1
+            if not needs_backfill(row, palettes_from_originals):
+                stats.complete += 1
+                continue
+            if object_key_for_url(row.get('image_url'), public_url_base) is None:
+                stats.external += 1
+                continue
+            pending.add(executor.submit(backfill_row, r2_client, bucket_name, public_url_base, row,
+                                        palettes_from_originals))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stats.add(future.result())
+                    yield future.result()
+        for future in pending:
+            stats.add(future.result())
+            yield future.result()
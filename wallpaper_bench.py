@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Wallpaper Publisher
+`startup` measures cold start in fresh interpreters and fails when it exceeds
+the budget, so slow imports creeping back onto the startup path are caught.
+`batch` publishes a synthetic corpus through the real pipeline against the
+local stand-ins in wallpaper_fakes and reports throughput and peak memory
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then reported as unknown
+    resource = None
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# Cold-start budgets, overridable from the environment
+IMPORT_BUDGET_SECONDS = float(os.getenv('WALLPAPER_IMPORT_BUDGET', '0.3'))
+STARTUP_BUDGET_SECONDS = float(os.getenv('WALLPAPER_STARTUP_BUDGET', '1.0'))
+
+# Placeholder configuration: the window must not need live services to appear
+BENCH_ENV = """NEXT_PUBLIC_SUPABASE_URL=https://bench.supabase.co
+NEXT_PUBLIC_SUPABASE_ANON_KEY=bench-anon-key
+R2_ACCOUNT_ID=bench
+R2_ACCESS_KEY_ID=bench
+R2_SECRET_ACCESS_KEY=bench
+R2_BUCKET_NAME=bench
+R2_PUBLIC_URL=https://bench.r2.dev
+"""
+
+
+# Synthetic corpus: common wallpaper resolutions and the formats the publisher accepts
+CORPUS_SIZES = ((1280, 720), (1920, 1080), (2560, 1440), (3840, 2160), (1080, 1920), (5120, 2880))
+CORPUS_FORMATS = (
+    # (Pillow format, extension, save options, relative weight)
+    ('JPEG', '.jpg', {'quality': 90}, 6),
+    ('PNG', '.png', {'compress_level': 6}, 3),
+    ('TIFF', '.tiff', {'compression': 'tiff_deflate'}, 1),
+)
+
+MB = 1024 * 1024
+
+
+def _bench_workspace() -> tempfile.TemporaryDirectory:
+    """Temporary working directory holding a placeholder .env.local"""
+    workspace = tempfile.TemporaryDirectory(prefix='wallpaper-bench-')
+    Path(workspace.name, '.env.local').write_text(BENCH_ENV)
+    return workspace
+
+
+def _child_env(workspace: str) -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(REPO_DIR), env.get('PYTHONPATH')]))
+    env['WALLPAPER_PUBLISHER_STATE_DIR'] = str(Path(workspace, 'state'))
+    env['PYTHONWARNINGS'] = 'ignore'
+    return env
+
+
+def measure_import(workspace: str) -> float:
+    """Seconds for a fresh interpreter to import the publisher module"""
+    code = ("import time; start = time.perf_counter(); import wallpaper_publisher; "
+            "print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, '-c', code], cwd=workspace, env=_child_env(workspace),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_window(workspace: str, timeout: float = 30.0) -> float:
+    """Seconds from the child's first line of code until its window is idle and responsive"""
+    result = subprocess.run([sys.executable, str(REPO_DIR / 'wallpaper_publisher.py'), '--startup-check'],
+                            cwd=workspace, env=_child_env(workspace), capture_output=True,
+                            text=True, timeout=timeout)
+    for line in result.stdout.splitlines():
+        if line.startswith('{'):
+            return float(json.loads(line)['startup_seconds'])
+    raise RuntimeError(f"Startup check did not report (exit {result.returncode}): {result.stderr.strip()[-500:]}")
+
+
+def synthetic_image(width: int, height: int, rng: random.Random):
+    """Gradient, banding and grain, so encoders and decoders do realistic amounts of work"""
+    import numpy as np
+    from PIL import Image
+
+    start, end = (np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32) for _ in range(2))
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :, None]
+    blend = (x * 0.7 + y * 0.3)
+    pixels = start + (end - start) * blend
+    pixels += 24 * np.sin((x * rng.uniform(4, 16) + y * rng.uniform(2, 8)) * np.pi)
+    noise = np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 6, (height, width, 1)).astype(np.float32)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8), 'RGB')
+
+
+def generate_corpus(directory: Path, count: int, seed: int = 0) -> List[Path]:
+    """Write count synthetic wallpapers of mixed sizes and formats, reusing files already there"""
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    weights = [weight for *_, weight in CORPUS_FORMATS]
+    paths = []
+    for number in range(count):
+        width, height = rng.choice(CORPUS_SIZES)
+        image_format, extension, options, _ = rng.choices(CORPUS_FORMATS, weights)[0]
+        image_seed = rng.randrange(2 ** 32)
+        path = directory / f"synthetic_{number:04d}_{width}x{height}{extension}"
+        if not path.exists():
+            synthetic_image(width, height, random.Random(image_seed)).save(path, image_format, **options)
+        paths.append(path)
+    return paths
+
+
+def peak_rss() -> Dict[str, Optional[float]]:
+    """Peak resident set size in MB of this process and of its largest finished child"""
+    if resource is None:
+        return {'self': None, 'children': None}
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / MB,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / MB,
+    }
+
+
+def run_batch_benchmark(args: argparse.Namespace, publisher_args: List[str]) -> int:
+    """Publish a synthetic corpus against local stand-ins and report throughput"""
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from supabase import create_client
+
+    from wallpaper_fakes import FakeGeminiModel, FakePostgrest, FakeS3Server
+
+    corpus_dir = args.corpus or Path(tempfile.mkdtemp(prefix='wallpaper-corpus-'))
+    print(f"Preparing {args.images} synthetic images in {corpus_dir}...")
+    # Generated in a child process so its memory does not count towards the publisher's peak RSS
+    subprocess.run([sys.executable, str(Path(__file__).resolve()), 'corpus', str(corpus_dir),
+                    '--images', str(args.images), '--seed', str(args.seed)], check=True)
+    corpus = generate_corpus(corpus_dir, args.images, args.seed)
+    corpus_bytes = sum(path.stat().st_size for path in corpus)
+    formats = Counter(path.suffix.lstrip('.').upper() for path in corpus)
+
+    s3 = FakeS3Server(latency=args.r2_latency, bandwidth_mb_s=args.r2_bandwidth, keep_data=False).start()
+    postgrest = FakePostgrest(latency=args.db_latency).start()
+    gemini_models: List[FakeGeminiModel] = []
+
+    def gemini_model(api_key: str) -> FakeGeminiModel:
+        model = FakeGeminiModel(args.gemini_latency, args.gemini_jitter, args.gemini_error_rate, seed=args.seed)
+        gemini_models.append(model)
+        return model
+
+    def r2_client():
+        return boto3.client('s3', endpoint_url=s3.url, aws_access_key_id='bench', aws_secret_access_key='bench',
+                            region_name='auto', config=BotoConfig(s3={'addressing_style': 'path'},
+                                                                  max_pool_connections=32))
+
+    workspace = _bench_workspace()
+    previous_cwd = os.getcwd()
+    os.environ['WALLPAPER_PUBLISHER_STATE_DIR'] = str(Path(workspace.name, 'state'))
+    try:
+        os.chdir(workspace.name)
+        import wallpaper_publisher
+        services = wallpaper_publisher.Services(
+            supabase=lambda: create_client(postgrest.url, 'bench-anon-key'),
+            r2=r2_client,
+            gemini_model=gemini_model,
+        )
+        started = time.perf_counter()
+        exit_code = wallpaper_publisher.main(
+            ['--batch', str(corpus_dir), '--gemini-key', 'bench', '--gemini-rpm', str(args.gemini_rpm)]
+            + publisher_args, services)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.chdir(previous_cwd)
+        workspace.cleanup()
+        s3.stop()
+        postgrest.stop()
+
+    memory = peak_rss()
+    results = {
+        'images': len(corpus),
+        'corpus_mb': corpus_bytes / MB,
+        'formats': dict(formats),
+        'seconds': elapsed,
+        'images_per_second': len(corpus) / elapsed,
+        'mb_per_second': corpus_bytes / MB / elapsed,
+        'peak_rss_mb': memory['self'],
+        'peak_child_rss_mb': memory['children'],
+        'rows': len(postgrest.rows('wallpapers')),
+        'objects': len(s3.objects),
+        'r2_requests': s3.requests,
+        'db_requests': postgrest.requests,
+        'gemini_calls': sum(model.calls for model in gemini_models),
+        'exit_code': exit_code,
+    }
+
+    print()
+    print(f"Batch benchmark: {results['images']} images, {results['corpus_mb']:.1f} MB "
+          f"({', '.join(f'{name} {count}' for name, count in sorted(formats.items()))})")
+    print(f"  Gemini latency {args.gemini_latency:.2f}s +/- {args.gemini_jitter:.2f}s, "
+          f"R2 latency {args.r2_latency * 1000:.0f} ms, DB latency {args.db_latency * 1000:.0f} ms")
+    print(f"  Wall time    {elapsed:.2f} s")
+    print(f"  Throughput   {results['images_per_second']:.2f} images/s, {results['mb_per_second']:.1f} MB/s")
+    if memory['self'] is not None:
+        print(f"  Peak RSS     {memory['self']:.0f} MB publisher, {memory['children']:.0f} MB largest child process")
+    print(f"  Requests     R2 {s3.requests}, PostgREST {postgrest.requests}, Gemini {results['gemini_calls']}")
+    print(f"  Stored       {results['rows']} rows, {results['objects']} objects")
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+        print(f"  Results saved to {args.save}")
+    if args.baseline:
+        return _compare_with_baseline(results, json.loads(args.baseline.read_text()), args.tolerance)
+    return exit_code
+
+
+def run_corpus(args: argparse.Namespace) -> int:
+    """Write a synthetic corpus without benchmarking it"""
+    paths = generate_corpus(args.directory, args.images, args.seed)
+    total = sum(path.stat().st_size for path in paths)
+    print(f"{len(paths)} images, {total / MB:.1f} MB in {args.directory}")
+    return 0
+
+
+def _compare_with_baseline(results: Dict, baseline: Dict, tolerance: float) -> int:
+    """Fail when throughput drops or peak memory grows by more than the tolerance"""
+    regressions = []
+    for key, label in (('images_per_second', 'images/s'), ('mb_per_second', 'MB/s')):
+        if results[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{label} {results[key]:.2f} vs baseline {baseline[key]:.2f}")
+    if results.get('peak_rss_mb') and baseline.get('peak_rss_mb') and \
+            results['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        regressions.append(f"peak RSS {results['peak_rss_mb']:.0f} MB vs baseline {baseline['peak_rss_mb']:.0f} MB")
+
+    if regressions:
+        print(f"  REGRESSION (tolerance {tolerance:.0%}): " + "; ".join(regressions))
+        return 1
+    print(f"  Within {tolerance:.0%} of the baseline")
+    return 0
+
+
+def _check(label: str, samples: List[float], budget: float) -> bool:
+    median = statistics.median(samples)
+    within = median <= budget
+    print(f"  {label:<8} median {median * 1000:7.1f} ms  min {min(samples) * 1000:7.1f} ms  "
+          f"max {max(samples) * 1000:7.1f} ms  budget {budget * 1000:.0f} ms  "
+          f"{'OK' if within else 'OVER BUDGET'}")
+    return within
+
+
+def run_startup(args: argparse.Namespace) -> int:
+    """Measure cold start and compare it with the budgets"""
+    with _bench_workspace() as workspace:
+        print(f"Startup benchmark ({args.runs} runs)")
+        ok = _check('import', [measure_import(workspace) for _ in range(args.runs)], args.import_budget)
+
+        if os.name != 'nt' and not os.getenv('DISPLAY') and sys.platform != 'darwin':
+            print("  window   skipped (no DISPLAY; run under xvfb-run to include it)")
+        else:
+            ok = _check('window', [measure_window(workspace) for _ in range(args.runs)],
+                        args.startup_budget) and ok
+
+    return 0 if ok else 1
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Wallpaper Publisher benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    startup = commands.add_parser('startup', help="cold-start time against the startup budget")
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_SECONDS,
+                         help="seconds allowed to import the module")
+    startup.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_SECONDS,
+                         help="seconds allowed until the window is responsive")
+    startup.set_defaults(func=run_startup)
+
+    corpus = commands.add_parser('corpus', help="write a synthetic image corpus of mixed sizes and formats")
+    corpus.add_argument('directory', type=Path)
+    corpus.add_argument('--images', type=int, default=24)
+    corpus.add_argument('--seed', type=int, default=0)
+    corpus.set_defaults(func=run_corpus)
+
+    batch = commands.add_parser(
+        'batch', help="publish a synthetic corpus against local R2, Supabase and Gemini stand-ins",
+        epilog="Unrecognised options are passed to the publisher, e.g. --upload-workers 8 --no-derivatives")
+    batch.add_argument('--images', type=int, default=24, help="number of synthetic images")
+    batch.add_argument('--corpus', type=Path, default=None,
+                       help="directory for the corpus; existing files are reused between runs")
+    batch.add_argument('--seed', type=int, default=0)
+    batch.add_argument('--gemini-latency', type=float, default=0.5, help="seconds per fake Gemini call")
+    batch.add_argument('--gemini-jitter', type=float, default=0.1)
+    batch.add_argument('--gemini-error-rate', type=float, default=0.0, help="fraction of calls answered with 429")
+    batch.add_argument('--gemini-rpm', type=float, default=6000, help="quota given to the publisher's client")
+    batch.add_argument('--r2-latency', type=float, default=0.0, help="seconds added to every R2 request")
+    batch.add_argument('--r2-bandwidth', type=float, default=None, help="MB/s cap on R2 transfers")
+    batch.add_argument('--db-latency', type=float, default=0.0, help="seconds added to every PostgREST request")
+    batch.add_argument('--save', type=Path, default=None, help="write the results as JSON")
+    batch.add_argument('--baseline', type=Path, default=None, help="results JSON to compare against")
+    batch.add_argument('--tolerance', type=float, default=0.1, help="allowed regression against the baseline")
+    batch.set_defaults(func=run_batch_benchmark)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args, extra = build_arg_parser().parse_known_args(argv)
+    if args.func is run_batch_benchmark:
+        return run_batch_benchmark(args, extra)
+    if extra:
+        build_arg_parser().error(f"unrecognized arguments: {' '.join(extra)}")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+On-disk caches for the Wallpaper Publisher
+MetadataCache stores Gemini results keyed by image content, prompt and model,
+so retries and re-runs do not pay for the same analysis twice; ThumbnailCache
+keeps preview thumbnails so re-selecting a file does not decode it again
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+DEFAULT_METADATA_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_METADATA_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_THUMBNAIL_CACHE_ENTRIES = 2000
+
+
+def metadata_cache_key(content_hash: str, prompt: str, model_name: str) -> str:
+    """Cache key covering everything that determines the model's answer"""
+    digest = hashlib.sha256()
+    for part in (model_name, prompt, content_hash):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class MetadataCache:
+    """SQLite-backed LRU cache of AI metadata with a byte cap and a TTL"""
+
+    def __init__(self, db_path: Path, max_bytes: int = DEFAULT_METADATA_CACHE_BYTES,
+                 ttl_seconds: float = DEFAULT_METADATA_CACHE_TTL):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_metadata_accessed_at ON metadata(accessed_at);
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return cached metadata, or None when missing or older than the TTL"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM metadata WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE metadata SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def put(self, key: str, metadata: Dict):
+        """Store metadata and evict least recently used entries beyond the byte cap"""
+        value = json.dumps(metadata, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO metadata (key, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode('utf-8')), now, now)
+                )
+                self._conn.execute("DELETE FROM metadata WHERE created_at < ?", (now - self.ttl_seconds,))
+                self._evict()
+
+    def _evict(self):
+        """Drop the oldest-accessed rows until the cache fits in max_bytes"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM metadata").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM metadata ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM metadata WHERE key = ?", victims)
+
+    def invalidate(self, key: str):
+        """Forget one entry so the next request regenerates it"""
+        with self._lock:
+            self._conn.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+class ThumbnailCache:
+    """Directory of preview thumbnails keyed by source path, mtime, size and box
+
+    Editing or replacing a file changes its mtime or size, so stale entries are
+    never returned; they simply age out once the entry cap is reached.
+    """
+
+    def __init__(self, directory: Path, max_entries: int = DEFAULT_THUMBNAIL_CACHE_ENTRIES):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _entry_path(self, source, box: Tuple[int, int]) -> Optional[Path]:
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(source)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{box[0]}x{box[1]}"
+        return self.directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.png"
+
+    def get(self, source, box: Tuple[int, int]) -> Optional[Image.Image]:
+        """Cached thumbnail for a file, or None if it is missing or the file changed"""
+        entry = self._entry_path(source, box)
+        if entry is None or not entry.exists():
+            return None
+        try:
+            with Image.open(entry) as cached:
+                cached.load()
+                image = cached.copy()
+        except OSError:
+            entry.unlink(missing_ok=True)
+            return None
+        # Touch so eviction treats this entry as recently used
+        os.utime(entry)
+        return image
+
+    def put(self, source, box: Tuple[int, int], image: Image.Image):
+        """Store a thumbnail, evicting the least recently used entries beyond the cap"""
+        entry = self._entry_path(source, box)
+        if entry is None:
+            return
+        # Unique temporary name: the prefetcher and the preview may write the same entry
+        temporary = entry.with_name(f"{entry.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        image.save(temporary, 'PNG')
+        # Atomic rename so a concurrent reader never sees a half-written file
+        os.replace(temporary, entry)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = list(self.directory.glob('*.png'))
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=lambda path: path.stat().st_mtime)
+            for stale in entries[:len(entries) - self.max_entries]:
+                stale.unlink(missing_ok=True)
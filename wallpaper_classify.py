@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Local category classifier for the Wallpaper Publisher
+A k-nearest-neighbour model over colour and edge histograms, trained from the
+wallpapers already published and categorised, picks the category and base tags
+for most images instantly, so only uncertain ones need a Gemini round trip
+"""
+
+import json
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from wallpaper_imaging import open_reduced
+from wallpaper_similarity import DEFAULT_FETCH_WORKERS, fetch_image, smallest_image_url
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Images are described from a copy at most this large
+FEATURE_DIMENSION = 128
+# HSV colour histogram: hue x saturation x value for coloured pixels, value only for greys
+HUE_BINS = 12
+SATURATION_BINS = 2
+VALUE_BINS = 3
+GREY_BINS = 4
+# Pixels less saturated than this have no meaningful hue
+GREY_SATURATION = 0.15
+# Edge histograms: gradient direction weighted by strength, and how much of the image is edges
+ORIENTATION_BINS = 8
+EDGE_STRENGTHS = (8.0, 24.0, 64.0)
+
+DEFAULT_NEIGHBOURS = 7
+# Share of the neighbours' vote the winning category needs before Gemini is skipped
+DEFAULT_CONFIDENCE = 0.8
+# Below this many training images every prediction is escalated
+MIN_TRAINING_IMAGES = 30
+MAX_BASE_TAGS = 5
+# Evaluation compares every image with every other, this many rows at a time
+EVALUATION_CHUNK = 1024
+
+# File-name words that say nothing about the picture
+_NOISE_WORDS = {'img', 'dsc', 'dscn', 'pxl', 'image', 'photo', 'wallpaper', 'screenshot', 'final', 'copy', 'edit'}
+
+
+def image_features(image: Image.Image) -> 'np.ndarray':
+    """Colour and edge histograms of an image as one float32 vector
+
+    Each histogram is normalised to sum to one and square-rooted, so the
+    dot product of two vectors is their summed Bhattacharyya coefficients
+    and every histogram counts equally however many bins it has.
+    """
+    # Imported on first use to keep it off the GUI's startup path
+    import numpy as np
+
+    sample = image.convert('RGB')
+    if max(sample.size) > FEATURE_DIMENSION:
+        sample = sample.copy()
+        sample.thumbnail((FEATURE_DIMENSION, FEATURE_DIMENSION), Image.Resampling.BOX)
+    hsv = np.asarray(sample.convert('HSV'), dtype=np.float32).reshape(-1, 3) / 255.0
+    hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+
+    coloured = saturation >= GREY_SATURATION
+    hue_bin = np.minimum((hue * HUE_BINS).astype(np.int32), HUE_BINS - 1)
+    saturation_bin = np.minimum(((saturation - GREY_SATURATION) / (1 - GREY_SATURATION)
+                                 * SATURATION_BINS).astype(np.int32), SATURATION_BINS - 1)
+    value_bin = np.minimum((value * VALUE_BINS).astype(np.int32), VALUE_BINS - 1)
+    colour_bins = (hue_bin * SATURATION_BINS + saturation_bin) * VALUE_BINS + value_bin
+    grey_bins = HUE_BINS * SATURATION_BINS * VALUE_BINS + np.minimum((value * GREY_BINS).astype(np.int32),
+                                                                      GREY_BINS - 1)
+    colours = np.bincount(np.where(coloured, colour_bins, grey_bins),
+                          minlength=HUE_BINS * SATURATION_BINS * VALUE_BINS + GREY_BINS)
+
+    luma = np.asarray(sample.convert('L'), dtype=np.float32)
+    dx = luma[1:-1, 2:] - luma[1:-1, :-2]
+    dy = luma[2:, 1:-1] - luma[:-2, 1:-1]
+    magnitude = np.hypot(dx, dy).ravel()
+    # Direction modulo 180 degrees: an edge and its opposite look the same
+    angle = np.mod(np.arctan2(dy, dx).ravel(), np.pi)
+    orientation_bin = np.minimum((angle / np.pi * ORIENTATION_BINS).astype(np.int32), ORIENTATION_BINS - 1)
+    # Gradients below the weakest edge strength are mostly compression noise, which flat PNGs lack
+    edges = magnitude >= EDGE_STRENGTHS[0]
+    orientations = np.bincount(orientation_bin[edges], weights=magnitude[edges], minlength=ORIENTATION_BINS)
+    strengths = np.bincount(np.searchsorted(EDGE_STRENGTHS, magnitude), minlength=len(EDGE_STRENGTHS) + 1)
+
+    parts = []
+    for histogram in (colours, orientations, strengths):
+        histogram = histogram.astype(np.float32)
+        total = histogram.sum()
+        parts.append(np.sqrt(histogram / total) if total else histogram)
+    return np.concatenate(parts)
+
+
+def file_features(path) -> 'np.ndarray':
+    image = open_reduced(path, (FEATURE_DIMENSION, FEATURE_DIMENSION))
+    try:
+        return image_features(image)
+    finally:
+        image.close()
+
+
+@dataclass
+class Prediction:
+    """The category the neighbours voted for, and how strongly"""
+    category: Optional[str]
+    confidence: float
+    tags: List[str] = field(default_factory=list)
+
+    def confident(self, threshold: float) -> bool:
+        return self.category is not None and self.confidence >= threshold
+
+    def describe(self) -> str:
+        return f"{self.category} ({self.confidence:.0%} of the neighbours' vote)"
+
+
+@dataclass
+class TrainingStats:
+    """Counters reported by train_from_rows"""
+    rows: int = 0
+    reused: int = 0
+    fetched: int = 0
+    skipped: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+
+class CategoryModel:
+    """k-nearest-neighbour classifier over image_features vectors
+
+    Each neighbour votes for its category with its similarity, and the
+    winning share of the vote is the confidence. Base tags are the tags that
+    the winning neighbours share.
+    """
+
+    def __init__(self, features: 'np.ndarray', categories: List[str], tags: List[List[str]],
+                 ids: List[str], urls: List[str], neighbours: int = DEFAULT_NEIGHBOURS):
+        self.features = features
+        self.categories = categories
+        self.tags = tags
+        self.ids = ids
+        self.urls = urls
+        self.neighbours = neighbours
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def predict(self, features: 'np.ndarray') -> Prediction:
+        import numpy as np
+
+        if len(self) < MIN_TRAINING_IMAGES:
+            return Prediction(None, 0.0)
+        similarities = self.features @ features
+        count = min(self.neighbours, len(self))
+        nearest = np.argpartition(-similarities, count - 1)[:count]
+        return self._vote(nearest, similarities[nearest])
+
+    def predict_image(self, image: Image.Image) -> Prediction:
+        return self.predict(image_features(image))
+
+    def _vote(self, nearest: 'np.ndarray', similarities: 'np.ndarray') -> Prediction:
+        votes: Dict[str, float] = {}
+        weights = [max(float(similarity), 0.0) for similarity in similarities]
+        for position, weight in zip(nearest, weights):
+            category = self.categories[position]
+            votes[category] = votes.get(category, 0.0) + weight
+        total = sum(votes.values())
+        if not total:
+            return Prediction(None, 0.0)
+        category = max(votes, key=votes.get)
+
+        # Tags carried by at least two of the neighbours that agreed on the category
+        counts = Counter(tag for position in nearest if self.categories[position] == category
+                         for tag in set(self.tags[position]))
+        tags = [tag for tag, count in counts.most_common(MAX_BASE_TAGS) if count >= 2]
+        return Prediction(category, votes[category] / total, tags)
+
+    def evaluate(self, threshold: float = DEFAULT_CONFIDENCE) -> Tuple[float, float]:
+        """Leave-one-out (coverage, accuracy): the share of images that would skip Gemini, and how many of
+        those get the category they were published with"""
+        import numpy as np
+
+        if len(self) < MIN_TRAINING_IMAGES:
+            return 0.0, 0.0
+        count = min(self.neighbours, len(self) - 1)
+        confident = correct = 0
+        for start in range(0, len(self), EVALUATION_CHUNK):
+            similarities = self.features[start:start + EVALUATION_CHUNK] @ self.features.T
+            rows = np.arange(len(similarities))
+            # An image must not vote for itself
+            similarities[rows, rows + start] = -np.inf
+            nearest = np.argpartition(-similarities, count - 1, axis=1)[:, :count]
+            for row, positions in enumerate(nearest):
+                prediction = self._vote(positions, similarities[row, positions])
+                if prediction.confident(threshold):
+                    confident += 1
+                    correct += prediction.category == self.categories[start + row]
+        return confident / len(self), (correct / confident if confident else 0.0)
+
+    def entries(self) -> Dict[str, Tuple[str, 'np.ndarray']]:
+        """wallpaper_id -> (image_url, features) for reuse by the next training run"""
+        return {wallpaper_id: (url, self.features[position])
+                for position, (wallpaper_id, url) in enumerate(zip(self.ids, self.urls))}
+
+    def save(self, path: Path):
+        import numpy as np
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{path.name}.tmp.npz")
+        np.savez_compressed(temporary, features=self.features, categories=np.array(self.categories, dtype=str),
+                            tags=np.array([json.dumps(tags) for tags in self.tags], dtype=str),
+                            ids=np.array(self.ids, dtype=str), urls=np.array(self.urls, dtype=str))
+        temporary.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, neighbours: int = DEFAULT_NEIGHBOURS) -> Optional['CategoryModel']:
+        """Read a model written by save, or None if none has been trained"""
+        import numpy as np
+
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            return cls(data['features'], data['categories'].tolist(),
+                       [json.loads(tags) for tags in data['tags'].tolist()],
+                       data['ids'].tolist(), data['urls'].tolist(), neighbours)
+
+
+def train_from_rows(rows: Iterable[Dict], categories: Iterable[str], previous: Optional[CategoryModel] = None,
+                    fetch_workers: int = DEFAULT_FETCH_WORKERS,
+                    neighbours: int = DEFAULT_NEIGHBOURS) -> Tuple[CategoryModel, TrainingStats]:
+    """Build a model from wallpapers rows (id, image_url, category, tags, derivatives)
+
+    Rows already in previous with the same image_url keep their features;
+    the rest are described from their smallest derivative, fetched on a
+    thread pool. Rows outside the known categories are left out.
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    stats = TrainingStats()
+    categories = set(categories)
+    known = previous.entries() if previous else {}
+    kept: List[Tuple[Dict, 'np.ndarray']] = []
+    missing = []
+    for row in rows:
+        stats.rows += 1
+        if row.get('category') not in categories:
+            stats.skipped += 1
+            continue
+        reusable = known.get(str(row['id']))
+        if reusable and reusable[0] == row['image_url']:
+            kept.append((row, reusable[1]))
+            stats.reused += 1
+        else:
+            missing.append(row)
+
+    def describe(row: Dict) -> Tuple[Dict, Optional['np.ndarray']]:
+        try:
+            return row, image_features(fetch_image(smallest_image_url(row), FEATURE_DIMENSION))
+        except Exception as e:
+            print(f"  ! {row['image_url']}: {e}")
+            return row, None
+
+    with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix='features') as executor:
+        for row, features in executor.map(describe, missing):
+            if features is None:
+                stats.failed += 1
+            else:
+                kept.append((row, features))
+                stats.fetched += 1
+
+    width = len(kept[0][1]) if kept else 0
+    model = CategoryModel(
+        np.stack([features for _, features in kept]) if kept else np.zeros((0, width), dtype=np.float32),
+        [row['category'] for row, _ in kept],
+        [[str(tag) for tag in row.get('tags') or []] for row, _ in kept],
+        [str(row['id']) for row, _ in kept],
+        [row['image_url'] for row, _ in kept],
+        neighbours
+    )
+    stats.seconds = time.perf_counter() - started
+    return model, stats
+
+
+def metadata_from_prediction(prediction: Prediction, file_name: str) -> Dict:
+    """Metadata in the shape Gemini returns, from a local prediction and the file name
+
+    The title comes from the words in the file name when there are any;
+    the description is a plain sentence built from the category and tags.
+    """
+    words = [word for word in re.findall(r'[A-Za-z]{3,}', Path(file_name).stem)
+             if word.lower() not in _NOISE_WORDS]
+    subject = prediction.tags[0].title() if prediction.tags else ''
+    title = ' '.join(word.capitalize() for word in words) if words else \
+        f"{subject} {prediction.category.title()} Wallpaper".strip()
+    tags = prediction.tags or [prediction.category]
+    description = f"{prediction.category.title()} wallpaper featuring {', '.join(tags)}."
+    return {'title': title[:60], 'description': description[:160], 'category': prediction.category, 'tags': tags}
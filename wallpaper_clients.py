@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Shared, pooled service clients for the Wallpaper Publisher
+One client per service for the whole run, with keep-alive pools sized for the
+upload and database workers, a warm-up that opens connections before work
+starts, and connection counts so handshakes under load can be spotted
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from wallpaper_transfer import env_int, upload_concurrency
+
+# R2: room for four uploads' multipart parts (or derivative sets) in flight at once
+DEFAULT_R2_UPLOAD_WORKERS = 4
+R2_CONNECT_TIMEOUT = 10
+R2_READ_TIMEOUT = 60
+R2_MAX_ATTEMPTS = 5
+
+# Supabase and public image downloads go through httpx keep-alive pools
+DEFAULT_HTTP_POOL_CONNECTIONS = 16
+HTTP_KEEPALIVE_SECONDS = 90
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_TIMEOUT = 30
+
+_gemini_lock = threading.Lock()
+_gemini_key: Optional[str] = None
+_http_lock = threading.Lock()
+_http_client = None
+
+
+def r2_pool_connections() -> int:
+    """Connections kept open to R2 (R2_MAX_POOL_CONNECTIONS)
+
+    Every part of every concurrent multipart upload holds a connection, and
+    botocore closes any connection returned to a full pool, so a pool smaller
+    than the peak concurrency means a new TLS handshake on most requests.
+    """
+    return env_int('R2_MAX_POOL_CONNECTIONS', DEFAULT_R2_UPLOAD_WORKERS * max(upload_concurrency(), 8))
+
+
+def http_pool_connections() -> int:
+    """Connections kept open per HTTP host (HTTP_MAX_POOL_CONNECTIONS)"""
+    return env_int('HTTP_MAX_POOL_CONNECTIONS', DEFAULT_HTTP_POOL_CONNECTIONS)
+
+
+def r2_client_config():
+    """botocore settings for the R2 client: explicit pool size, timeouts, TCP keep-alive and standard retries"""
+    from botocore.config import Config as BotoConfig
+
+    return BotoConfig(
+        max_pool_connections=r2_pool_connections(),
+        connect_timeout=R2_CONNECT_TIMEOUT,
+        read_timeout=R2_READ_TIMEOUT,
+        tcp_keepalive=True,
+        retries={'total_max_attempts': R2_MAX_ATTEMPTS, 'mode': 'standard'},
+    )
+
+
+class ConnectionTracer:
+    """Counts connections, TLS handshakes and requests on an httpx client through httpcore's trace hook"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[str, float] = {}
+        self.requests = 0
+        self.connections = 0
+        self.handshakes = 0
+        self.connect_seconds = 0.0
+
+    def attach(self, request):
+        """httpx request event hook: trace this request's connection setup"""
+        with self._lock:
+            self.requests += 1
+        request.extensions['trace'] = self._trace
+
+    def _trace(self, event: str, info: Dict):
+        # Events are named like connection.connect_tcp.started / .complete
+        step, _, phase = event.rpartition('.')
+        if step not in ('connection.connect_tcp', 'connection.start_tls'):
+            return
+        key = f"{threading.get_ident()}:{step}"
+        with self._lock:
+            if phase == 'started':
+                self._started[key] = time.perf_counter()
+            elif phase == 'complete':
+                self.connect_seconds += time.perf_counter() - self._started.pop(key, time.perf_counter())
+                if step == 'connection.connect_tcp':
+                    self.connections += 1
+                else:
+                    self.handshakes += 1
+
+
+def create_http_client(tracer: Optional[ConnectionTracer] = None, **options):
+    """An httpx client with a tuned keep-alive pool"""
+    import httpx
+
+    connections = http_pool_connections()
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections,
+                            keepalive_expiry=HTTP_KEEPALIVE_SECONDS),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        event_hooks={'request': [tracer.attach]} if tracer else None,
+        **options,
+    )
+
+
+_http_tracer = ConnectionTracer()
+
+
+def http_client():
+    """Process-wide pooled client for downloading published images"""
+    global _http_client
+    with _http_lock:
+        if _http_client is None:
+            _http_client = create_http_client(_http_tracer, follow_redirects=True)
+        return _http_client
+
+
+def supabase_client_options():
+    """ClientOptions routing PostgREST through a pooled httpx client
+
+    Older supabase releases cannot take an httpx client and keep the default
+    options; ServiceClients counts connections on either session.
+    """
+    from supabase import ClientOptions
+
+    if 'httpx_client' not in getattr(ClientOptions, '__dataclass_fields__', {}):
+        return ClientOptions()
+    return ClientOptions(httpx_client=create_http_client())
+
+
+def configure_gemini(api_key: str):
+    """Point the Gemini SDK at api_key, reconfiguring only when the key changes
+
+    genai.configure replaces the SDK's client, and with it the open channel,
+    so it is called once per key rather than once per model.
+    """
+    global _gemini_key
+    import google.generativeai as genai
+
+    with _gemini_lock:
+        if _gemini_key != api_key:
+            genai.configure(api_key=api_key)
+            _gemini_key = api_key
+
+
+def _count(number: int, noun: str) -> str:
+    return f"{number} {noun}" if number == 1 else f"{number} {noun}s"
+
+
+@dataclass
+class PoolStats:
+    """Connection reuse on one service's pool"""
+    service: str
+    requests: int
+    connections: int
+    idle: Optional[int] = None
+    handshakes: Optional[int] = None
+    connect_seconds: Optional[float] = None
+
+    def describe(self) -> str:
+        reuse = self.requests / self.connections if self.connections else 0.0
+        text = (f"{self.service}: {_count(self.connections, 'connection')} opened for "
+                f"{_count(self.requests, 'request')} ({reuse:.1f} per connection")
+        if self.idle is not None:
+            text += f", {self.idle} idle"
+        text += ")"
+        if self.connect_seconds is not None:
+            text += f", {self.handshakes} TLS handshakes, {self.connect_seconds:.2f}s connecting"
+        return text
+
+
+@dataclass
+class WarmupReport:
+    """What prewarm opened and how long each service took"""
+    seconds: Dict[str, float] = field(default_factory=dict)
+    connections: Dict[str, int] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    def format_summary(self) -> str:
+        parts = [f"{name} {self.connections.get(name, 1)}x in {seconds:.2f}s"
+                 for name, seconds in self.seconds.items() if name not in self.errors]
+        lines = [f"Warmed connections: {', '.join(parts) or 'none'}"]
+        lines += [f"  ! Could not warm {name}: {error}" for name, error in self.errors.items()]
+        return "\n".join(lines)
+
+
+def _urllib3_pools(r2_client) -> List[Any]:
+    """botocore's urllib3 connection pools, one per host"""
+    manager = getattr(getattr(getattr(r2_client, '_endpoint', None), 'http_session', None), '_manager', None)
+    pools = getattr(manager, 'pools', None)
+    if pools is None:
+        return []
+    return [pools[key] for key in list(pools.keys())]
+
+
+def _urllib3_stats(service: str, r2_client) -> Optional[PoolStats]:
+    pools = _urllib3_pools(r2_client)
+    if not pools:
+        return None
+    # Empty slots in urllib3's queue are None placeholders
+    idle = sum(connection is not None for pool in pools for connection in list(pool.pool.queue))
+    return PoolStats(service, sum(pool.num_requests for pool in pools), sum(pool.num_connections for pool in pools),
+                     idle=idle)
+
+
+def _tracer_stats(service: str, tracer: ConnectionTracer) -> Optional[PoolStats]:
+    if not tracer.requests:
+        return None
+    return PoolStats(service, tracer.requests, tracer.connections, handshakes=tracer.handshakes,
+                     connect_seconds=tracer.connect_seconds)
+
+
+class ServiceClients:
+    """One shared client per service, built on first use from a Services' factories
+
+    Every command and background job asks this object for its clients, so a
+    run opens one R2 pool, one Supabase pool and one Gemini channel however
+    many stages use them.
+    """
+
+    def __init__(self, services):
+        self.services = services
+        self.supabase_tracer = ConnectionTracer()
+        self._lock = threading.RLock()
+        self._supabase = None
+        self._r2 = None
+        self._gemini_model = None
+        self._gemini_model_key: Optional[str] = None
+
+    def supabase(self):
+        with self._lock:
+            if self._supabase is None:
+                self._supabase = self.services.supabase()
+                self._trace_supabase(self._supabase)
+            return self._supabase
+
+    def r2(self):
+        with self._lock:
+            if self._r2 is None:
+                self._r2 = self.services.r2()
+            return self._r2
+
+    def gemini_model(self, api_key: str):
+        """The metadata model for api_key; building one for a new key replaces the previous"""
+        with self._lock:
+            if self._gemini_model is None or self._gemini_model_key != api_key:
+                self._gemini_model = self.services.gemini_model(api_key)
+                self._gemini_model_key = api_key
+            return self._gemini_model
+
+    def _trace_supabase(self, client):
+        """Count connections on the PostgREST session, unless it already reports to the tracer"""
+        session = getattr(getattr(client, 'postgrest', None), 'session', None)
+        hooks = getattr(session, 'event_hooks', None)
+        if hooks is None:
+            return
+        if self.supabase_tracer.attach not in hooks.get('request', []):
+            session.event_hooks = {**hooks, 'request': list(hooks.get('request', [])) + [self.supabase_tracer.attach]}
+
+    def prewarm(self, bucket_name: Optional[str] = None, r2_connections: int = 0, supabase_connections: int = 0,
+                gemini_api_key: Optional[str] = None) -> WarmupReport:
+        """Open connections to every service concurrently before work starts
+
+        Each R2 and Supabase connection is opened by its own concurrent
+        request, so the pools hold that many live connections afterwards.
+        Gemini opens its channel with a token count, which is not billed.
+        Failures are reported rather than raised; the work that follows
+        reports them properly if they persist.
+        """
+        report = WarmupReport()
+        calls = {}
+        if r2_connections and bucket_name:
+            calls['R2'] = (r2_connections, lambda: self.r2().list_objects_v2(Bucket=bucket_name, MaxKeys=1))
+        if supabase_connections:
+            calls['Supabase'] = (supabase_connections,
+                                 lambda: self.supabase().table('wallpapers').select('id').limit(1).execute())
+        if gemini_api_key:
+            model = self.gemini_model(gemini_api_key)
+            if hasattr(model, 'count_tokens'):
+                calls['Gemini'] = (1, lambda: model.count_tokens('ping'))
+        if not calls:
+            return report
+
+        def warm(name: str, call):
+            started = time.perf_counter()
+            try:
+                call()
+            except Exception as e:
+                report.errors[name] = str(e)
+            return name, time.perf_counter() - started
+
+        width = sum(count for count, _ in calls.values())
+        with ThreadPoolExecutor(max_workers=width, thread_name_prefix='prewarm') as executor:
+            futures = [executor.submit(warm, name, call) for name, (count, call) in calls.items()
+                       for _ in range(count)]
+            for future in futures:
+                name, seconds = future.result()
+                report.seconds[name] = max(report.seconds.get(name, 0.0), seconds)
+        report.connections = {name: count for name, (count, _) in calls.items()}
+        return report
+
+    def pool_stats(self) -> List[PoolStats]:
+        """Connection reuse on every pool opened so far"""
+        stats = [
+            _urllib3_stats('R2', self._r2) if self._r2 is not None else None,
+            _tracer_stats('Supabase', self.supabase_tracer),
+            _tracer_stats('Public images', _http_tracer),
+        ]
+        return [entry for entry in stats if entry is not None]
+
+    def format_pool_stats(self) -> str:
+        stats = self.pool_stats()
+        return "\n".join(["Connection pools:"] + [f"  {entry.describe()}" for entry in stats]) if stats else ""
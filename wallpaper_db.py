@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Buffered, idempotent Supabase writes for the Wallpaper Publisher
+Rows are grouped into multi-row upserts on a natural key, so bulk ingests pay
+one round trip per batch and retried rows never become duplicates
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+CONFLICT_COLUMN = 'content_hash'
+
+
+@dataclass
+class FailedRow:
+    """A row Supabase rejected, with the error from its smallest failing batch"""
+    row: Dict
+    error: str
+
+
+class RowWriteError(Exception):
+    """Raised from a row's future when it could not be written"""
+
+
+def upsert_rows(supabase_client, rows: List[Dict], conflict_column: str = CONFLICT_COLUMN) -> List[Dict]:
+    """Upsert rows into wallpapers on the natural key and return the stored records
+
+    A multi-row upsert names the union of its rows' keys as its columns, and
+    PostgREST writes NULL for any of them a row leaves out, over the column
+    default or the value already stored. Rows are therefore sent in one
+    request per distinct key set, so every row carries every named column.
+    """
+    groups: Dict[Tuple[str, ...], List[Dict]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    records = []
+    for group in groups.values():
+        result = supabase_client.table('wallpapers').upsert(group, on_conflict=conflict_column).execute()
+        if not result.data:
+            raise RowWriteError("Failed to insert into database")
+        records.extend(result.data)
+    return records
+
+
+class WallpaperWriter:
+    """Collects wallpaper rows and flushes them as batched upserts
+
+    A batch is sent when batch_size rows are waiting or the oldest waiting row
+    is flush_interval seconds old. If a batch is rejected it is split in half
+    and retried until the offending rows are isolated, so one bad row only
+    fails itself. Each submit() returns a Future for the stored record; its
+    `retries` attribute counts the failed batches the row was part of.
+    """
+
+    def __init__(self, supabase_client, batch_size: int = 50, flush_interval: float = 1.0,
+                 workers: int = 2, conflict_column: str = CONFLICT_COLUMN):
+        self.supabase_client = supabase_client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conflict_column = conflict_column
+        self.failed_rows: List[FailedRow] = []
+        self.batches_sent = 0
+        self._pending: Dict[str, Tuple[Dict, List[Future]]] = {}
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._flush_requested = False
+        self._stats_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-flush')
+        self._flusher = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._flusher.start()
+
+    def submit(self, row: Dict) -> Future:
+        """Queue a row for the next batch"""
+        key = row.get(self.conflict_column)
+        if not key:
+            raise ValueError(f"Row is missing its {self.conflict_column}")
+
+        future: Future = Future()
+        future.retries = 0
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("WallpaperWriter is closed")
+            if key in self._pending:
+                # The same content twice in one batch would make Postgres reject the upsert
+                self._pending[key][1].append(future)
+            else:
+                self._pending[key] = (row, [future])
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._condition.notify()
+        return future
+
+    def write(self, row: Dict) -> Dict:
+        """Queue a row and wait until its batch has been stored"""
+        return self.submit(row).result()
+
+    def flush(self):
+        """Send whatever is pending without waiting for the batch to fill"""
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify()
+
+    def close(self):
+        """Flush remaining rows and wait for every batch to finish"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._flusher.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    ready = len(self._pending) >= self.batch_size
+                    due = self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+                    if self._pending and (ready or due or self._closed or self._flush_requested):
+                        break
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(0.0, self.flush_interval - (time.monotonic() - self._oldest))
+                    self._condition.wait(timeout)
+
+                keys = list(self._pending)[:self.batch_size]
+                batch = [self._pending.pop(key) for key in keys]
+                self._oldest = time.monotonic() if self._pending else None
+                self._flush_requested = bool(self._pending) and self._flush_requested
+
+            self._executor.submit(self._write_batch, batch)
+
+    def _write_batch(self, batch: List[Tuple[Dict, List[Future]]]):
+        """Upsert a batch, bisecting on failure to find the rejected rows"""
+        rows = [row for row, _ in batch]
+        try:
+            records = upsert_rows(self.supabase_client, rows, self.conflict_column)
+        except Exception as e:
+            for _, futures in batch:
+                for future in futures:
+                    future.retries += 1
+            if len(batch) == 1:
+                row, futures = batch[0]
+                with self._stats_lock:
+                    self.failed_rows.append(FailedRow(row, str(e)))
+                for future in futures:
+                    future.set_exception(RowWriteError(str(e)))
+                return
+            middle = len(batch) // 2
+            self._write_batch(batch[:middle])
+            self._write_batch(batch[middle:])
+            return
+
+        with self._stats_lock:
+            self.batches_sent += 1
+        stored = {record.get(self.conflict_column): record for record in records}
+        for row, futures in batch:
+            record = stored.get(row[self.conflict_column])
+            for future in futures:
+                if record is None:
+                    future.set_exception(RowWriteError("Row missing from upsert response"))
+                else:
+                    future.set_result(record)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Responsive derivative generation for the Wallpaper Publisher
+Pre-renders the widths and formats requested by src/lib/image-optimization.ts
+so the site can serve static objects instead of transcoding on cache misses
+"""
+
+import io
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from wallpaper_scan import transpose_box
+
+# Must match the defaults in ImageOptimizer.generateResponsiveUrls
+DERIVATIVE_WIDTHS = (400, 800, 1200, 1920)
+DERIVATIVE_FORMATS = ('avif', 'webp', 'jpeg')
+DERIVATIVE_QUALITY = 85
+
+FORMAT_EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+CONTENT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+@dataclass
+class Derivative:
+    """One encoded rendition of an original"""
+    width: int
+    height: int
+    format: str
+    data: bytes
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.format]
+
+
+def derivative_key(sha256: str, width: int, image_format: str) -> str:
+    """Object key for a derivative, stored under a prefix named after the original's hash"""
+    return f"{sha256}/w{width}.{FORMAT_EXTENSIONS[image_format]}"
+
+
+def supported_formats(formats: Iterable[str] = DERIVATIVE_FORMATS) -> List[str]:
+    """Formats this Pillow build can encode (AVIF needs Pillow 11.3+ or pillow-avif-plugin)"""
+    try:
+        import pillow_avif  # noqa: F401 - registers the AVIF plugin on older Pillow
+    except ImportError:
+        pass
+    extensions = Image.registered_extensions()
+    return [fmt for fmt in formats if f".{FORMAT_EXTENSIONS[fmt]}" in extensions]
+
+
+def derivatives_manifest(derivatives: Iterable[Derivative], url_for: Callable[[Derivative], str]) -> Dict:
+    """Shape stored in wallpapers.derivatives: {format: {width: url}}"""
+    manifest: Dict[str, Dict[str, str]] = {}
+    for derivative in derivatives:
+        manifest.setdefault(derivative.format, {})[str(derivative.width)] = url_for(derivative)
+    return manifest
+
+
+def _encode(task: Tuple[str, Tuple[int, int], bytes, str, int]) -> Derivative:
+    """Encode one rendition; runs in a worker process"""
+    mode, size, pixels, image_format, quality = task
+    image = Image.frombytes(mode, size, pixels)
+    buffer = io.BytesIO()
+    if image_format == 'jpeg':
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif image_format == 'webp':
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    else:
+        image.save(buffer, 'AVIF', quality=quality)
+    return Derivative(size[0], size[1], image_format, buffer.getvalue())
+
+
+def _ignore_interrupts():
+    """Leave Ctrl-C to the parent, which drains in-flight work instead of killing encodes"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class DerivativeGenerator:
+    """Renders derivatives on a process pool sized to the CPU count
+
+    The source is decoded and resized once in the calling process; every
+    (width, format) encode is a separate pool task, so a slow AVIF encode only
+    occupies one worker.
+    """
+
+    def __init__(self, widths: Iterable[int] = DERIVATIVE_WIDTHS,
+                 formats: Iterable[str] = DERIVATIVE_FORMATS,
+                 quality: int = DERIVATIVE_QUALITY, workers: Optional[int] = None):
+        self.widths = sorted(set(widths), reverse=True)
+        self.requested_formats = tuple(formats)
+        self._formats: Optional[List[str]] = None
+        self.quality = quality
+        self.workers = workers or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def formats(self) -> List[str]:
+        # Resolved on first use: probing codecs initialises every Pillow plugin
+        if self._formats is None:
+            self._formats = supported_formats(self.requested_formats)
+        return self._formats
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # Spawned rather than forked: the GUI process holds Tk state that must not be copied
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_ignore_interrupts)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _renditions(self, image_path) -> List[Image.Image]:
+        """Decode once and downscale to every target width no wider than the source"""
+        with Image.open(image_path) as image:
+            largest = self.widths[0]
+            if image.format == 'JPEG':
+                # Let libjpeg decode at a reduced scale when the source is far larger
+                width, height = transpose_box(image, image.size)
+                image.draft('RGB', transpose_box(image, (largest, max(1, height * largest // width))))
+            source = ImageOps.exif_transpose(image).convert('RGB')
+
+        renditions = []
+        current = source
+        for width in self.widths:
+            if width > source.width:
+                continue
+            height = max(1, round(source.height * width / source.width))
+            # Step down from the previous rendition, it is already close in size
+            current = current.resize((width, height), Image.Resampling.LANCZOS)
+            renditions.append(current)
+        return renditions
+
+    def generate(self, image_path) -> List[Derivative]:
+        """Render every supported format at every applicable width"""
+        tasks = []
+        for rendition in self._renditions(image_path):
+            pixels = rendition.tobytes()
+            for image_format in self.formats:
+                tasks.append((rendition.mode, rendition.size, pixels, image_format, self.quality))
+
+        futures = [self.pool.submit(_encode, task) for task in tasks]
+        return [future.result() for future in as_completed(futures)]
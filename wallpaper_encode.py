@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Quality-targeted re-encoding of originals for the Wallpaper Publisher
+Bisects the encoder quality for the smallest progressive JPEG or WebP whose
+luma stays within a target SSIM of the source, so bloated PNG screenshots and
+maximum-quality JPEGs stop costing storage and egress on every download
+"""
+
+import io
+import os
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from PIL import Image, ImageOps
+
+from wallpaper_imaging import FULL_DECODE_PIXEL_THRESHOLD, full_decode_slots
+
+if TYPE_CHECKING:
+    import numpy as np
+
+REENCODE_FORMATS = ('jpeg', 'webp')
+REENCODE_EXTENSIONS = {'jpeg': '.jpg', 'webp': '.webp'}
+REENCODE_CONTENT_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+# Mean SSIM on downsampled luma that a re-encode must reach
+DEFAULT_TARGET_SIMILARITY = 0.985
+MIN_QUALITY = 55
+MAX_QUALITY = 95
+# Luma is compared at most this large; downsampling further would hide the artefacts being measured
+SIMILARITY_DIMENSION = 2048
+SSIM_WINDOW = 8
+# Re-encodes saving less than this are not worth replacing the original for
+MIN_SAVINGS = 0.05
+
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+
+@dataclass
+class EncodeResult:
+    """A re-encoded original and how it compares with the source file"""
+    format: str
+    quality: int
+    similarity: float
+    data: bytes
+    original_size: int
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_size - self.size
+
+    @property
+    def savings(self) -> float:
+        return self.saved_bytes / self.original_size if self.original_size else 0.0
+
+    @property
+    def extension(self) -> str:
+        return REENCODE_EXTENSIONS[self.format]
+
+    @property
+    def content_type(self) -> str:
+        return REENCODE_CONTENT_TYPES[self.format]
+
+    def describe(self) -> str:
+        """Human readable summary, e.g. '12.3 MB -> 4.1 MB (67% smaller, JPEG q82, SSIM 0.987)'"""
+        return (f"{self.original_size / (1024 * 1024):.1f} MB -> {self.size / (1024 * 1024):.1f} MB "
+                f"({self.savings:.0%} smaller, {self.format.upper()} q{self.quality}, SSIM {self.similarity:.3f})")
+
+
+def luma(image: Image.Image, max_dimension: int = SIMILARITY_DIMENSION) -> 'np.ndarray':
+    """Box-downsampled luma plane as float32"""
+    # Imported on first use to keep it off the GUI's startup path
+    import numpy as np
+
+    plane = image.convert('L')
+    scale = max(plane.size) / max_dimension
+    if scale > 1:
+        size = (max(1, round(plane.width / scale)), max(1, round(plane.height / scale)))
+        plane = plane.resize(size, Image.Resampling.BOX)
+    return np.asarray(plane, dtype=np.float32)
+
+
+def _block_means(values: 'np.ndarray', window: int) -> 'np.ndarray':
+    """Mean of every non-overlapping window x window block (edges that do not fill a block are dropped)"""
+    rows, columns = values.shape[0] // window, values.shape[1] // window
+    blocks = values[:rows * window, :columns * window].reshape(rows, window, columns, window)
+    return blocks.mean(axis=(1, 3))
+
+
+def ssim(reference: 'np.ndarray', candidate: 'np.ndarray', window: int = SSIM_WINDOW) -> float:
+    """Mean structural similarity of two equally sized luma planes, over 8x8 blocks
+
+    Tiling instead of sliding the window scores each pixel once, at a
+    fraction of the cost of the sliding-window form.
+    """
+    window = min(window, *reference.shape)
+    mean_ref = _block_means(reference, window)
+    mean_cand = _block_means(candidate, window)
+    var_ref = _block_means(reference * reference, window) - mean_ref ** 2
+    var_cand = _block_means(candidate * candidate, window) - mean_cand ** 2
+    covariance = _block_means(reference * candidate, window) - mean_ref * mean_cand
+    numerator = (2 * mean_ref * mean_cand + _SSIM_C1) * (2 * covariance + _SSIM_C2)
+    denominator = (mean_ref ** 2 + mean_cand ** 2 + _SSIM_C1) * (var_ref + var_cand + _SSIM_C2)
+    return float((numerator / denominator).mean())
+
+
+def _has_transparency(image: Image.Image) -> bool:
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        return image.getchannel('A').getextrema()[0] < 255
+    return image.mode == 'P' and 'transparency' in image.info
+
+
+def _kept_profile(image: Image.Image, mode: str) -> Optional[bytes]:
+    """The source's ICC profile if it still describes the pixels after converting to mode
+
+    A CMYK, greyscale or palette profile does not fit the converted RGB values,
+    so it is dropped and the result is read as sRGB; RGB and RGBA share one.
+    """
+    if image.mode != mode and not {image.mode, mode} <= {'RGB', 'RGBA'}:
+        return None
+    return image.info.get('icc_profile')
+
+
+class Reencoder:
+    """Finds the lowest quality that keeps a re-encode visually equivalent to the source
+
+    Quality is bisected between min_quality and max_quality, so a typical
+    image costs about six encodes. The result is oriented by its EXIF tag,
+    keeps only the ICC profile (when its colour space survives the mode
+    conversion), and JPEGs are written progressive. encode returns None
+    when the original should be kept: animations, transparency headed for
+    JPEG, no quality reaching the target, or too little saved.
+    """
+
+    def __init__(self, image_format: str = 'jpeg', target: float = DEFAULT_TARGET_SIMILARITY,
+                 min_quality: int = MIN_QUALITY, max_quality: int = MAX_QUALITY,
+                 min_savings: float = MIN_SAVINGS):
+        if image_format not in REENCODE_FORMATS:
+            raise ValueError(f"Re-encode format must be one of {', '.join(REENCODE_FORMATS)}, got {image_format!r}")
+        if not 0 < target <= 1:
+            raise ValueError(f"Target similarity must be in (0, 1], got {target}")
+        self.format = image_format
+        self.target = target
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_savings = min_savings
+
+    def encode(self, image_path) -> Optional[EncodeResult]:
+        original_size = os.path.getsize(image_path)
+        with Image.open(image_path) as image:
+            if getattr(image, 'n_frames', 1) > 1:
+                return None
+            large = image.width * image.height > FULL_DECODE_PIXEL_THRESHOLD
+            # Large frames share the decode slots used elsewhere so workers cannot all hold one at once
+            with full_decode_slots if large else nullcontext():
+                source = ImageOps.exif_transpose(image)
+                if _has_transparency(source):
+                    if self.format == 'jpeg':
+                        return None
+                    mode = 'RGBA'
+                else:
+                    mode = 'RGB'
+                icc_profile = _kept_profile(image, mode)
+                return self._search(source.convert(mode), icc_profile, original_size)
+
+    def _search(self, source: Image.Image, icc_profile: Optional[bytes], original_size: int) -> Optional[EncodeResult]:
+        reference = luma(source)
+        best = self._try(source, reference, self.max_quality, icc_profile)
+        if best.similarity < self.target:
+            return None
+
+        low, high = self.min_quality, self.max_quality - 1
+        while low <= high:
+            quality = (low + high) // 2
+            candidate = self._try(source, reference, quality, icc_profile)
+            if candidate.similarity >= self.target:
+                best, high = candidate, quality - 1
+            else:
+                low = quality + 1
+
+        data = best.data
+        if self.format == 'jpeg':
+            # Searched without the lossless extras, which are only worth their cost once
+            data = self._encode(source, best.quality, icc_profile, final=True)
+        result = EncodeResult(self.format, best.quality, best.similarity, data, original_size)
+        return result if result.savings >= self.min_savings else None
+
+    def _try(self, source: Image.Image, reference: 'np.ndarray', quality: int,
+             icc_profile: Optional[bytes]) -> EncodeResult:
+        """Encode at one quality and score the decoded result against the reference luma"""
+        data = self._encode(source, quality, icc_profile)
+        with Image.open(io.BytesIO(data)) as decoded:
+            similarity = ssim(reference, luma(decoded))
+        return EncodeResult(self.format, quality, similarity, data, 0)
+
+    def _encode(self, source: Image.Image, quality: int, icc_profile: Optional[bytes],
+                final: bool = False) -> bytes:
+        buffer = io.BytesIO()
+        # Only the colour profile is carried over; EXIF, XMP and comments are dropped
+        extra = {'icc_profile': icc_profile} if icc_profile else {}
+        if self.format == 'jpeg':
+            # Progressive scans and optimised Huffman tables do not change the decoded pixels
+            source.save(buffer, 'JPEG', quality=quality, optimize=final, progressive=final, **extra)
+        else:
+            # WebP has no progressive mode
+            source.save(buffer, 'WEBP', quality=quality, method=4, **extra)
+        return buffer.getvalue()
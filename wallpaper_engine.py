@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Background job engine for the Wallpaper Publisher
+One asyncio loop on a dedicated thread runs every publish and AI job as a
+cancellable task; blocking SDK calls go to a bounded thread pool, and progress
+is reported as events on a queue that the UI (or a console) drains
+"""
+
+import asyncio
+import functools
+import itertools
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Event kinds, in the order a job emits them
+STARTED = 'started'
+STATUS = 'status'
+PROGRESS = 'progress'
+RESULT = 'result'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    """Raised inside a job, or from blocking work it started, once the job is cancelled"""
+
+
+class EngineBusy(Exception):
+    """Raised by submit when an exclusive job of the same name is still running"""
+
+
+@dataclass
+class EngineEvent:
+    """Something a job reports: a status line, progress, or how it finished"""
+    job_id: int
+    job_name: str
+    kind: str
+    message: str = ''
+    fraction: Optional[float] = None
+    result: Any = None
+
+
+class Job:
+    """Handle for a submitted job"""
+
+    def __init__(self, job_id: int, name: str, exclusive: bool):
+        self.id = job_id
+        self.name = name
+        self.exclusive = exclusive
+        self.future: Optional[Future] = None
+        self._cancelled = threading.Event()
+        self._cancel_callbacks: List[Callable[[], None]] = []
+        self._shielded = 0
+        self._reported = False
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel the task and tell blocking work it started to stop; safe from any thread
+
+        While the job is inside run_to_completion the task is left running and
+        only the flag is set, so the job stops at its next check instead.
+        """
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks = list(self._cancel_callbacks)
+            interrupt = self._shielded == 0
+        for callback in callbacks:
+            callback()
+        if interrupt and self.future is not None:
+            self.future.cancel()
+
+    @contextmanager
+    def _shield(self):
+        with self._lock:
+            self._shielded += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._shielded -= 1
+
+    def _claim_report(self) -> bool:
+        """True exactly once, for whichever path reports how the job finished"""
+        with self._lock:
+            first, self._reported = not self._reported, True
+        return first
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Run callback (from the cancelling thread) when the job is cancelled"""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def result(self, timeout: Optional[float] = None):
+        """Block until the job finishes and return its result"""
+        return self.future.result(timeout)
+
+
+class JobContext:
+    """What a job coroutine uses to report progress and run blocking work"""
+
+    def __init__(self, engine: 'Engine', job: Job):
+        self.engine = engine
+        self.job = job
+
+    def status(self, message: str):
+        self.engine.emit(self.job, STATUS, message)
+
+    def progress(self, fraction: float, message: str = ''):
+        """Report determinate progress; thread-safe, so executor callbacks may call it"""
+        self.engine.emit(self.job, PROGRESS, message, fraction=fraction)
+
+    def check_cancelled(self):
+        if self.job.cancelled:
+            raise JobCancelled()
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run a blocking call on the engine's thread pool without blocking the loop"""
+        self.check_cancelled()
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.engine.executor, functools.partial(func, *args, **kwargs))
+        self.check_cancelled()
+        return result
+
+    async def run_to_completion(self, func: Callable, *args, **kwargs):
+        """Like run, but once started the call is awaited even if the job is cancelled
+
+        For steps that must not be abandoned half way, such as the insert that
+        makes a publish visible; a cancel then takes effect at the next check.
+        """
+        self.check_cancelled()
+        loop = asyncio.get_running_loop()
+        with self.job._shield():
+            return await loop.run_in_executor(self.engine.executor, functools.partial(func, *args, **kwargs))
+
+
+class Engine:
+    """Owns the event loop thread, the blocking-call pool and the event queue
+
+    Jobs are coroutine functions taking a JobContext. Exclusive jobs of the
+    same name never overlap: submitting one while another runs raises
+    EngineBusy. Every job emits STARTED, then any STATUS/PROGRESS events,
+    then exactly one of RESULT, ERROR or CANCELLED.
+    """
+
+    def __init__(self, max_workers: int = 8, name: str = 'engine'):
+        self.name = name
+        self.events: 'queue.Queue[EngineEvent]' = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-io')
+        self.loop = asyncio.new_event_loop()
+        self._ids = itertools.count(1)
+        self._active: Dict[int, Job] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run_loop, name=f'{name}-loop', daemon=True)
+        self._closed = False
+
+    def start(self) -> 'Engine':
+        self._thread.start()
+        return self
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def emit(self, job: Job, kind: str, message: str = '', fraction: Optional[float] = None, result: Any = None):
+        self.events.put(EngineEvent(job.id, job.name, kind, message, fraction, result))
+
+    def running(self, name: Optional[str] = None) -> List[Job]:
+        """Jobs still in progress, optionally only those with the given name"""
+        with self._lock:
+            return [job for job in self._active.values() if name is None or job.name == name]
+
+    def submit(self, name: str, job_function: Callable[..., Awaitable[Any]], *args,
+               exclusive: bool = False, **kwargs) -> Job:
+        """Schedule job_function(context, *args, **kwargs) on the loop and return its handle"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            if exclusive and any(job.name == name for job in self._active.values()):
+                raise EngineBusy(f"A {name} job is already running")
+            job = Job(next(self._ids), name, exclusive)
+            self._active[job.id] = job
+        job.future = asyncio.run_coroutine_threadsafe(self._run_job(job, job_function, args, kwargs), self.loop)
+        job.future.add_done_callback(lambda future: self._finished(job))
+        return job
+
+    def _finished(self, job: Job):
+        with self._lock:
+            self._active.pop(job.id, None)
+        if job._claim_report():
+            # Cancelled before the task could report it (or before it ran at all)
+            self.emit(job, CANCELLED, "Cancelled")
+
+    async def _run_job(self, job: Job, job_function, args, kwargs):
+        self.emit(job, STARTED)
+        try:
+            result = await job_function(JobContext(self, job), *args, **kwargs)
+        except (asyncio.CancelledError, JobCancelled):
+            if job._claim_report():
+                self.emit(job, CANCELLED, "Cancelled")
+            raise asyncio.CancelledError()
+        except Exception as e:
+            if job._claim_report():
+                self.emit(job, ERROR, str(e))
+            raise
+        if job._claim_report():
+            self.emit(job, RESULT, result=result)
+        return result
+
+    def close(self, cancel: bool = True, wait: bool = True):
+        """Stop accepting jobs, optionally cancel running ones, and wait for blocking work to finish"""
+        with self._lock:
+            self._closed = True
+            jobs = list(self._active.values())
+        if cancel:
+            for job in jobs:
+                job.cancel()
+        # Blocking calls cannot be interrupted; cancelled ones stop at their next check
+        self.executor.shutdown(wait=wait, cancel_futures=cancel)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the services the Wallpaper Publisher talks to
+An in-process S3-compatible server for R2, a PostgREST endpoint for Supabase
+and a Gemini model with configurable latency, so the pipeline can be
+benchmarked and exercised without credentials or network access
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+DEFAULT_CATEGORIES = ("nature", "minimal", "abstract", "urban", "space", "art")
+
+
+class _LocalServer:
+    """ThreadingHTTPServer on an ephemeral localhost port, served from a daemon thread"""
+
+    handler_class = BaseHTTPRequestHandler
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        handler = type(self.handler_class.__name__, (self.handler_class,), {'service': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real services; every response sets Content-Length
+    protocol_version = 'HTTP/1.1'
+    service: _LocalServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            body = bytes(body)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def _send(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+def _decode_aws_chunked(raw: bytes) -> bytes:
+    """Strip the aws-chunked framing botocore uses for trailing checksums"""
+    body = bytearray()
+    position = 0
+    while True:
+        end = raw.index(b'\r\n', position)
+        size = int(raw[position:end].split(b';')[0], 16)
+        position = end + 2
+        if size == 0:
+            return bytes(body)
+        body += raw[position:position + size]
+        position += size + 2
+
+
+class _S3Object:
+    __slots__ = ('data', 'size', 'etag', 'metadata', 'content_type', 'cache_control', 'last_modified')
+
+    def __init__(self, data: bytes, metadata: Dict[str, str], content_type: str, cache_control: Optional[str],
+                 etag: Optional[str] = None):
+        self.data = data
+        self.size = len(data)
+        self.etag = etag or f'"{hashlib.md5(data).hexdigest()}"'
+        self.metadata = metadata
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.last_modified = datetime.now(timezone.utc)
+
+
+class _S3Handler(_Handler):
+    service: 'FakeS3Server'
+
+    def _route(self) -> Tuple[str, str, Dict[str, List[str]]]:
+        parsed = urlparse(self.path)
+        bucket, _, key = unquote(parsed.path).lstrip('/').partition('/')
+        return bucket, key, parse_qs(parsed.query, keep_blank_values=True)
+
+    def _xml(self, status: int, body: str):
+        self._send(status, f'<?xml version="1.0" encoding="UTF-8"?>\n{body}'.encode('utf-8'),
+                   {'Content-Type': 'application/xml'})
+
+    def _error(self, status: int, code: str, message: str):
+        self._xml(status, f"<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>")
+
+    def do_PUT(self):
+        self.service.count_request()
+        bucket, key, query = self._route()
+        body = self._read_body()
+        self.service.throttle(len(body))
+        if 'uploadId' in query:
+            etag = self.service.put_part(query['uploadId'][0], int(query['partNumber'][0]), body)
+            if etag is None:
+                return self._error(404, 'NoSuchUpload', query['uploadId'][0])
+            return self._send(200, headers={'ETag': etag})
+        if not key:
+            return self._send(200)  # CreateBucket
+        metadata = {name[len('x-amz-meta-'):]: value for name, value in self.headers.items()
+                    if name.lower().startswith('x-amz-meta-')}
+        stored = self.service.put_object(bucket, key, _S3Object(
+            body, metadata, self.headers.get('Content-Type', 'binary/octet-stream'),
+            self.headers.get('Cache-Control')))
+        self._send(200, headers={'ETag': stored.etag})
+
+    def do_POST(self):
+        self.service.count_request()
+        bucket, key, query = self._route()
+        body = self._read_body()
+        if 'uploads' in query:
+            upload_id = self.service.create_upload(bucket, key, {
+                name[len('x-amz-meta-'):]: value for name, value in self.headers.items()
+                if name.lower().startswith('x-amz-meta-')
+            }, self.headers.get('Content-Type', 'binary/octet-stream'), self.headers.get('Cache-Control'))
+            return self._xml(200, f'<InitiateMultipartUploadResult xmlns="{S3_NAMESPACE}"><Bucket>{escape(bucket)}'
+                                  f'</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>'
+                                  f'</InitiateMultipartUploadResult>')
+        if 'uploadId' in query:
+            stored = self.service.complete_upload(query['uploadId'][0])
+            if stored is None:
+                return self._error(404, 'NoSuchUpload', query['uploadId'][0])
+            return self._xml(200, f'<CompleteMultipartUploadResult xmlns="{S3_NAMESPACE}"><Bucket>{escape(bucket)}'
+                                  f'</Bucket><Key>{escape(key)}</Key><ETag>{escape(stored.etag)}</ETag>'
+                                  f'</CompleteMultipartUploadResult>')
+        if 'delete' in query:
+            keys = [element.text or '' for element in ElementTree.fromstring(body).iter()
+                    if element.tag.endswith('Key')]
+            for deleted in keys:
+                self.service.delete_object(bucket, deleted)
+            return self._xml(200, f'<DeleteResult xmlns="{S3_NAMESPACE}">' + ''.join(
+                f'<Deleted><Key>{escape(deleted)}</Key></Deleted>' for deleted in keys) + '</DeleteResult>')
+        self._error(400, 'InvalidRequest', 'Unsupported POST')
+
+    def do_HEAD(self):
+        self._get(head=True)
+
+    def do_GET(self):
+        self._get(head=False)
+
+    def _get(self, head: bool):
+        self.service.count_request()
+        bucket, key, query = self._route()
+        if not key:
+            return self._list(bucket, query)
+        stored = self.service.get_object(bucket, key)
+        if stored is None:
+            return self._error(404, 'NoSuchKey', key)
+
+        data, status = stored.data, 200
+        headers = {
+            'ETag': stored.etag,
+            'Content-Type': stored.content_type,
+            'Last-Modified': formatdate(stored.last_modified.timestamp(), usegmt=True),
+            'Accept-Ranges': 'bytes',
+        }
+        if stored.cache_control:
+            headers['Cache-Control'] = stored.cache_control
+        headers.update({f'x-amz-meta-{name}': value for name, value in stored.metadata.items()})
+
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes='):
+            start_text, _, end_text = byte_range[6:].partition('-')
+            start = int(start_text) if start_text else max(0, len(data) - int(end_text))
+            end = min(len(data) - 1, int(end_text)) if start_text and end_text else len(data) - 1
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+            data, status = data[start:end + 1], 206
+        if head:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data) if 'Content-Range' in headers else stored.size))
+            self.end_headers()
+            return
+        self.service.throttle(len(data))
+        self._send(status, data, headers)
+
+    def _list(self, bucket: str, query: Dict[str, List[str]]):
+        prefix = query.get('prefix', [''])[0]
+        max_keys = int(query.get('max-keys', ['1000'])[0])
+        after = query.get('continuation-token', query.get('start-after', ['']))[0]
+        delimiter = query.get('delimiter', [''])[0]
+        keys = self.service.list_keys(bucket, prefix, after)
+        # Keys with the delimiter after the prefix are rolled up into one CommonPrefixes entry each
+        page: List[Tuple[str, Optional[_S3Object]]] = []
+        truncated = False
+        for key, stored in keys:
+            cut = key.find(delimiter, len(prefix)) if delimiter else -1
+            if cut >= 0:
+                common = key[:cut + len(delimiter)]
+                if page and page[-1] == (common, None):
+                    continue
+                key, stored = common, None
+            if len(page) == max_keys:
+                truncated = True
+                break
+            page.append((key, stored))
+        contents = []
+        for key, stored in page:
+            if stored is None:
+                contents.append(f'<CommonPrefixes><Prefix>{escape(key)}</Prefix></CommonPrefixes>')
+                continue
+            contents.append(
+                f'<Contents><Key>{escape(key)}</Key>'
+                f'<LastModified>{stored.last_modified.strftime("%Y-%m-%dT%H:%M:%S.000Z")}</LastModified>'
+                f'<ETag>{escape(stored.etag)}</ETag><Size>{stored.size}</Size>'
+                f'<StorageClass>STANDARD</StorageClass></Contents>'
+            )
+        token = ''
+        if truncated:
+            # A rolled-up prefix resumes after every key beneath it
+            last, stored = page[-1]
+            resume = last if stored else last + chr(0x10FFFF)
+            token = f'<NextContinuationToken>{escape(resume)}</NextContinuationToken>'
+        self._xml(200, f'<ListBucketResult xmlns="{S3_NAMESPACE}"><Name>{escape(bucket)}</Name>'
+                       f'<Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>'
+                       f'<MaxKeys>{max_keys}</MaxKeys><IsTruncated>{str(truncated).lower()}</IsTruncated>'
+                       f'{token}{"".join(contents)}</ListBucketResult>')
+
+    def do_DELETE(self):
+        self.service.count_request()
+        bucket, key, query = self._route()
+        if 'uploadId' in query:
+            self.service.abort_upload(query['uploadId'][0])
+        else:
+            self.service.delete_object(bucket, key)
+        self._send(204)
+
+
+class FakeS3Server(_LocalServer):
+    """In-memory S3-compatible endpoint covering what the publisher uses
+
+    Single and multipart uploads, HEAD, ranged GET, paginated ListObjectsV2 (with Delimiter)
+    and batch delete. Clients must use path-style addressing. latency is
+    added to every request; bandwidth_mb_s, when set, paces request and
+    response bodies. With keep_data=False only sizes and metadata are kept,
+    so large benchmarks do not hold every upload in memory (reads then
+    return empty bodies).
+    """
+
+    handler_class = _S3Handler
+
+    def __init__(self, latency: float = 0.0, bandwidth_mb_s: Optional[float] = None, keep_data: bool = True):
+        super().__init__(latency)
+        self.bandwidth_mb_s = bandwidth_mb_s
+        self.keep_data = keep_data
+        self.bytes_received = 0
+        self.objects: Dict[Tuple[str, str], _S3Object] = {}
+        self._uploads: Dict[str, Tuple[str, str, Dict, str, Optional[str], Dict[int, Tuple[bytes, int, bytes]]]] = {}
+
+    def throttle(self, size: int):
+        with self._lock:
+            self.bytes_received += size
+        if self.bandwidth_mb_s:
+            time.sleep(size / (self.bandwidth_mb_s * 1024 * 1024))
+
+    def put_object(self, bucket: str, key: str, stored: _S3Object) -> _S3Object:
+        if not self.keep_data:
+            stored.data = b''
+        with self._lock:
+            self.objects[(bucket, key)] = stored
+        return stored
+
+    def get_object(self, bucket: str, key: str) -> Optional[_S3Object]:
+        with self._lock:
+            return self.objects.get((bucket, key))
+
+    def delete_object(self, bucket: str, key: str):
+        with self._lock:
+            self.objects.pop((bucket, key), None)
+
+    def list_keys(self, bucket: str, prefix: str, after: str) -> List[Tuple[str, _S3Object]]:
+        with self._lock:
+            return sorted((key, stored) for (name, key), stored in self.objects.items()
+                          if name == bucket and key.startswith(prefix) and key > after)
+
+    def create_upload(self, bucket: str, key: str, metadata: Dict, content_type: str,
+                      cache_control: Optional[str]) -> str:
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = (bucket, key, metadata, content_type, cache_control, {})
+        return upload_id
+
+    def put_part(self, upload_id: str, number: int, data: bytes) -> Optional[str]:
+        digest = hashlib.md5(data).digest()
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return None
+            upload[5][number] = (data if self.keep_data else b'', len(data), digest)
+        return f'"{digest.hex()}"'
+
+    def complete_upload(self, upload_id: str) -> Optional[_S3Object]:
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload is None:
+            return None
+        bucket, key, metadata, content_type, cache_control, parts = upload
+        ordered = [parts[number] for number in sorted(parts)]
+        digest = hashlib.md5(b''.join(part_digest for _, _, part_digest in ordered)).hexdigest()
+        stored = _S3Object(b''.join(data for data, _, _ in ordered), metadata, content_type, cache_control,
+                           f'"{digest}-{len(parts)}"')
+        stored.size = sum(size for _, size, _ in ordered)
+        return self.put_object(bucket, key, stored)
+
+    def abort_upload(self, upload_id: str):
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+
+
+class _PostgrestHandler(_Handler):
+    service: 'FakePostgrest'
+
+    def _route(self) -> Tuple[Optional[str], Dict[str, List[str]]]:
+        parsed = urlparse(self.path)
+        prefix = '/rest/v1/'
+        table = parsed.path[len(prefix):] if parsed.path.startswith(prefix) else None
+        return table, parse_qs(parsed.query, keep_blank_values=True)
+
+    def _json(self, status: int, payload, headers: Optional[Dict[str, str]] = None):
+        self._send(status, json.dumps(payload).encode('utf-8'),
+                   dict({'Content-Type': 'application/json'}, **(headers or {})))
+
+    def _wants_rows(self) -> bool:
+        return 'return=representation' in self.headers.get('Prefer', '')
+
+    def do_POST(self):
+        self.service.count_request()
+        table, query = self._route()
+        if table is None:
+            return self._json(404, {'message': 'Not found'})
+        payload = json.loads(self._read_body() or b'[]')
+        rows = payload if isinstance(payload, list) else [payload]
+        stored = self.service.insert(table, rows, query.get('on_conflict', [None])[0])
+        self._json(201, stored if self._wants_rows() else [])
+
+    def do_GET(self):
+        self.service.count_request()
+        table, query = self._route()
+        if table is None:
+            return self._json(404, {'message': 'Not found'})
+        rows = self.service.select(table, query)
+        offset = int(query.get('offset', ['0'])[0])
+        limit = query.get('limit', [None])[0]
+        byte_range = self.headers.get('Range', '')
+        if byte_range and '-' in byte_range:
+            start, _, end = byte_range.partition('-')
+            offset, limit = int(start), int(end) - int(start) + 1
+        total = len(rows)
+        rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+        end = offset + len(rows) - 1 if rows else offset
+        self._json(200, rows, {'Content-Range': f'{offset}-{end}/{total}'})
+
+    def do_PATCH(self):
+        self.service.count_request()
+        table, query = self._route()
+        if table is None:
+            return self._json(404, {'message': 'Not found'})
+        changes = json.loads(self._read_body() or b'{}')
+        updated = self.service.update(table, query, changes)
+        self._json(200, updated if self._wants_rows() else [])
+
+    def do_DELETE(self):
+        self.service.count_request()
+        table, query = self._route()
+        if table is None:
+            return self._json(404, {'message': 'Not found'})
+        deleted = self.service.delete(table, query)
+        self._json(200, deleted if self._wants_rows() else [])
+
+
+class FakePostgrest(_LocalServer):
+    """In-memory PostgREST endpoint that supabase-py can be pointed at
+
+    Supports inserts and upserts (on_conflict with merge-duplicates),
+    selects with eq/in filters, order, offset/limit or Range paging,
+    filtered updates and deletes. Rows get a UUID id like the real schema.
+    """
+
+    handler_class = _PostgrestHandler
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.tables: Dict[str, List[Dict]] = {}
+
+    def rows(self, table: str) -> List[Dict]:
+        with self._lock:
+            return [dict(row) for row in self.tables.get(table, [])]
+
+    def insert(self, table: str, rows: List[Dict], conflict: Optional[str]) -> List[Dict]:
+        """Insert rows, merging into existing rows with the same conflict column value"""
+        stored = []
+        with self._lock:
+            existing = self.tables.setdefault(table, [])
+            by_key = {row.get(conflict): row for row in existing if conflict and row.get(conflict)}
+            now = datetime.now(timezone.utc).isoformat()
+            for row in rows:
+                current = by_key.get(row.get(conflict)) if conflict else None
+                if current is not None:
+                    current.update(row, updated_at=now)
+                    stored.append(dict(current))
+                    continue
+                record = dict({'id': str(uuid.uuid4()), 'created_at': now, 'updated_at': now}, **row)
+                existing.append(record)
+                if conflict and record.get(conflict):
+                    by_key[record[conflict]] = record
+                stored.append(dict(record))
+        return stored
+
+    def select(self, table: str, query: Dict[str, List[str]]) -> List[Dict]:
+        rows = [row for row in self.rows(table) if _matches(row, query)]
+        order = query.get('order', [None])[0]
+        if order:
+            column, _, direction = order.partition('.')
+            rows.sort(key=lambda row: str(row.get(column, '')), reverse=direction.startswith('desc'))
+        columns = query.get('select', ['*'])[0]
+        if columns != '*':
+            names = [name.strip() for name in columns.split(',')]
+            rows = [{name: row.get(name) for name in names} for row in rows]
+        return rows
+
+    def update(self, table: str, query: Dict[str, List[str]], changes: Dict) -> List[Dict]:
+        updated = []
+        with self._lock:
+            for row in self.tables.get(table, []):
+                if _matches(row, query):
+                    row.update(changes)
+                    updated.append(dict(row))
+        return updated
+
+    def delete(self, table: str, query: Dict[str, List[str]]) -> List[Dict]:
+        with self._lock:
+            rows = self.tables.get(table, [])
+            deleted = [row for row in rows if _matches(row, query)]
+            self.tables[table] = [row for row in rows if not _matches(row, query)]
+        return deleted
+
+
+# Query parameters that are not column filters
+_RESERVED_PARAMS = {'select', 'order', 'offset', 'limit', 'on_conflict', 'columns'}
+
+
+def _matches(row: Dict, query: Dict[str, List[str]]) -> bool:
+    """Apply the eq./in./is. filters in a PostgREST query string"""
+    for column, conditions in query.items():
+        if column in _RESERVED_PARAMS:
+            continue
+        value = row.get(column)
+        for condition in conditions:
+            operator, _, operand = condition.partition('.')
+            if operator == 'eq' and str(value) != operand:
+                return False
+            if operator == 'neq' and str(value) == operand:
+                return False
+            if operator == 'in' and str(value) not in [part.strip('"') for part in operand.strip('()').split(',')]:
+                return False
+            if operator == 'is' and operand == 'null' and value is not None:
+                return False
+    return True
+
+
+class FakeGeminiError(Exception):
+    """Raised by FakeGeminiModel to simulate quota errors; carries an HTTP code like google.api_core"""
+
+    def __init__(self, code: int = 429):
+        super().__init__(f"{code} simulated error")
+        self.code = code
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Stand-in for GenerativeModel returning valid metadata after a configurable delay
+
+    Each call sleeps latency +/- jitter seconds; error_rate of calls raise a
+    retryable 429 instead, like an exhausted quota.
+    """
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 categories: Sequence[str] = DEFAULT_CATEGORIES, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.categories = list(categories)
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs) -> _FakeResponse:
+        with self._lock:
+            self.calls += 1
+            number = self.calls
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+            category = self._random.choice(self.categories)
+        time.sleep(delay)
+        if fail:
+            raise FakeGeminiError(429)
+        metadata = {
+            'title': f"Synthetic Wallpaper {number}",
+            'description': "A generated test image used for offline benchmarking.",
+            'category': category,
+            'tags': ["synthetic", "benchmark", category],
+        }
+        return _FakeResponse(f"```json\n{json.dumps(metadata)}\n```")
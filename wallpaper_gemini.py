@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Shared, rate-limited Gemini client for the Wallpaper Publisher
+Built once per API key; keeps request rate at the quota, caps requests in
+flight and retries throttling and server errors with jittered backoff
+"""
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+# HTTP status codes worth retrying: quota exhaustion and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+
+    def __init__(self, rate_per_second: float, capacity: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second must be positive")
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping as needed; returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            self._sleep(delay)
+            waited += delay
+
+
+@dataclass
+class GeminiStats:
+    """Counters for requests made through a GeminiClient"""
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    throttled_seconds: float = 0.0
+
+
+def status_code(error: Exception) -> Optional[int]:
+    """HTTP status carried by a google.api_core (or similar) exception, if any"""
+    code = getattr(error, 'code', None)
+    if callable(code):
+        # grpc errors expose code() returning a StatusCode
+        return None
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    return status_code(error) in RETRYABLE_STATUS_CODES
+
+
+class GeminiClient:
+    """Wraps a GenerativeModel with rate limiting, bounded concurrency and retries
+
+    Exposes generate_content() like the model itself, so it can be passed
+    wherever a model is expected.
+    """
+
+    def __init__(self, model, requests_per_minute: float = 10, max_in_flight: int = 4,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 burst: Optional[float] = None, sleep: Callable[[float], None] = time.sleep):
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = GeminiStats()
+        self._sleep = sleep
+        self._bucket = TokenBucket(requests_per_minute / 60.0, burst or 1.0, sleep=sleep)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._stats_lock = threading.Lock()
+        self._calls = threading.local()
+
+    @property
+    def last_retries(self) -> int:
+        """Retries made by the calling thread's most recent generate_content call"""
+        return getattr(self._calls, 'retries', 0)
+
+    def generate_content(self, contents, **kwargs):
+        """Call the model, waiting for quota and retrying retryable failures"""
+        attempt = 0
+        self._calls.retries = 0
+        while True:
+            waited = self._bucket.acquire()
+            with self._in_flight:
+                with self._stats_lock:
+                    self.stats.requests += 1
+                    self.stats.throttled_seconds += waited
+                try:
+                    return self.model.generate_content(contents, **kwargs)
+                except Exception as e:
+                    if not is_retryable(e) or attempt >= self.max_retries:
+                        with self._stats_lock:
+                            self.stats.failures += 1
+                        raise
+            # Back off outside the in-flight slot so other requests can proceed
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+            attempt += 1
+            self._calls.retries = attempt
+            with self._stats_lock:
+                self.stats.retries += 1
+            self._sleep(delay)
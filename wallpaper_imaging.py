@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Memory-bounded image decoding helpers for the Wallpaper Publisher
+Produces small re-encoded payloads for AI analysis without holding full
+8K frames in memory for every concurrent worker
+"""
+
+import io
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageOps
+
+from wallpaper_scan import transpose_box
+
+AI_MAX_DIMENSION = 1024
+AI_MAX_PAYLOAD_BYTES = 400 * 1024
+AI_JPEG_QUALITIES = (85, 75, 65, 55)
+
+# Formats whose decoders can skip straight to a reduced scale
+DRAFT_FORMATS = {'JPEG'}
+
+PALETTE_SIZE = 5
+PALETTE_SAMPLE_DIMENSION = 96
+PALETTE_ITERATIONS = 8
+# Clusters closer than this (RGB distance) are reported as one colour
+PALETTE_MERGE_DISTANCE = 40.0
+# Clusters covering less of the image than this are treated as noise
+PALETTE_MIN_SHARE = 0.02
+
+# Sources decoded at full size above this many pixels take a slot first
+FULL_DECODE_PIXEL_THRESHOLD = 12_000_000
+
+full_decode_slots = threading.BoundedSemaphore(int(os.getenv('WALLPAPER_MAX_FULL_DECODES', '2')))
+
+
+def open_reduced(path, max_size: Tuple[int, int]) -> Image.Image:
+    """Decode an image at roughly max_size, using the cheapest path the format allows
+
+    JPEGs are decoded through libjpeg's DCT scaling (draft mode), so an 8K file
+    never materialises at full resolution. Other formats must be decoded fully;
+    large ones wait for one of a few shared slots so concurrent workers cannot
+    all hold a full frame at once.
+    """
+    image = Image.open(path)
+    try:
+        # Both boxes apply to stored pixels, before the orientation is applied
+        box = transpose_box(image, max_size)
+        if image.format in DRAFT_FORMATS:
+            image.draft('RGB', box)
+            return _shrink(image, box)
+
+        if image.width * image.height <= FULL_DECODE_PIXEL_THRESHOLD:
+            return _shrink(image, box)
+
+        with full_decode_slots:
+            return _shrink(image, box)
+    finally:
+        image.close()
+
+
+def _shrink(image: Image.Image, max_size: Tuple[int, int]) -> Image.Image:
+    """Load, downscale to max_size in stored pixels, then orient and normalise the mode of the small copy
+
+    reducing_gap lets Pillow box-reduce before resampling, and doing the
+    orientation and mode conversion after the resize keeps those copies small.
+    """
+    image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    oriented = ImageOps.exif_transpose(image)
+    if oriented.mode not in ('RGB', 'L'):
+        oriented = oriented.convert('RGB')
+    return oriented
+
+
+def encode_capped_jpeg(image: Image.Image, max_bytes: int = AI_MAX_PAYLOAD_BYTES) -> bytes:
+    """JPEG-encode an image, stepping quality then size down until it fits max_bytes"""
+    while True:
+        for quality in AI_JPEG_QUALITIES:
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+        if max(image.size) <= 256:
+            return buffer.getvalue()
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)),
+                             Image.Resampling.LANCZOS)
+
+
+def ai_payload_from_image(image: Image.Image, max_bytes: int = AI_MAX_PAYLOAD_BYTES) -> Dict:
+    """Inline image part for Gemini built from an already reduced image"""
+    return {'mime_type': 'image/jpeg', 'data': encode_capped_jpeg(image, max_bytes)}
+
+
+def prepare_ai_payload(path, max_dimension: int = AI_MAX_DIMENSION,
+                       max_bytes: int = AI_MAX_PAYLOAD_BYTES) -> Dict:
+    """Inline image part for Gemini: a downscaled JPEG no larger than max_bytes"""
+    image = open_reduced(path, (max_dimension, max_dimension))
+    try:
+        return ai_payload_from_image(image, max_bytes)
+    finally:
+        image.close()
+
+
+def dominant_colors(image: Image.Image, count: int = PALETTE_SIZE,
+                    sample_dimension: int = PALETTE_SAMPLE_DIMENSION,
+                    iterations: int = PALETTE_ITERATIONS) -> List[str]:
+    """Dominant colours as '#rrggbb', most common first
+
+    Runs k-means on a small downsampled copy with every step vectorised in
+    NumPy. Seeds come from the most populated cells of a coarse 8x8x8 colour
+    histogram, so the result is deterministic and converges in a few passes.
+    """
+    # Imported on first use to keep it off the GUI's startup path
+    import numpy as np
+
+    sample = image.convert('RGB') if image.mode != 'RGB' else image
+    sample = sample.resize(_fit((sample.width, sample.height), sample_dimension), Image.Resampling.BOX)
+    pixels = np.asarray(sample, dtype=np.float32).reshape(-1, 3)
+
+    # Seed with the centroids of the busiest histogram cells
+    cells = (pixels // 32).astype(np.int32)
+    codes = cells[:, 0] * 64 + cells[:, 1] * 8 + cells[:, 2]
+    populations = np.bincount(codes, minlength=512)
+    seeds = np.argsort(populations)[::-1][:count]
+    seeds = seeds[populations[seeds] > 0]
+    sums = np.stack([np.bincount(codes, weights=pixels[:, channel], minlength=512) for channel in range(3)], axis=1)
+    centers = sums[seeds] / populations[seeds, None]
+
+    for _ in range(iterations):
+        distances = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        sizes = np.bincount(labels, minlength=len(centers))
+        totals = np.stack([np.bincount(labels, weights=pixels[:, channel], minlength=len(centers))
+                           for channel in range(3)], axis=1)
+        occupied = sizes > 0
+        updated = centers.copy()
+        updated[occupied] = totals[occupied] / sizes[occupied, None]
+        if np.allclose(updated, centers, atol=0.5):
+            break
+        centers = updated
+    else:
+        # Stopped at the cap: the sizes above belong to the centres before the last update
+        labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        sizes = np.bincount(labels, minlength=len(centers))
+
+    # Most populous first; drop specks and near-duplicates of a bigger cluster
+    order = np.argsort(sizes)[::-1]
+    order = order[sizes[order] >= max(1, PALETTE_MIN_SHARE * len(pixels))]
+    kept = []
+    for index in order:
+        if all(np.linalg.norm(centers[index] - centers[other]) >= PALETTE_MERGE_DISTANCE for other in kept):
+            kept.append(index)
+    colors = np.clip(np.rint(centers[kept]), 0, 255).astype(np.uint8)
+    return ['#%02x%02x%02x' % tuple(color) for color in colors]
+
+
+def _fit(size: Tuple[int, int], max_dimension: int) -> Tuple[int, int]:
+    """Scale a size down so its longer side is at most max_dimension"""
+    width, height = size
+    scale = min(1.0, max_dimension / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def extract_palette(path, count: int = PALETTE_SIZE) -> List[str]:
+    """Dominant colours of an image file, decoded at palette-sample size"""
+    image = open_reduced(path, (PALETTE_SAMPLE_DIMENSION, PALETTE_SAMPLE_DIMENSION))
+    try:
+        return dominant_colors(image, count)
+    finally:
+        image.close()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Content-hash index for the Wallpaper Publisher
+Maps SHA-256 digests of published files to their R2 object key and Supabase row,
+so publishing a file that is already live costs a local lookup instead of an upload
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Originals are stored as "<sha256><ext>" at the bucket root
+CONTENT_KEY_RE = re.compile(r'^(?P<sha256>[0-9a-f]{64})(?P<ext>\.[A-Za-z0-9]+)$')
+
+
+def hash_file(path, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """Stream a file through SHA-256 without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_key(sha256: str, extension: str) -> str:
+    """Object key for an original, derived from its content hash"""
+    return f"{sha256}{extension.lower()}"
+
+
+@dataclass
+class IndexEntry:
+    """What the index knows about one piece of content"""
+    sha256: str
+    object_key: str
+    public_url: Optional[str]
+    wallpaper_id: Optional[str]
+    size: Optional[int]
+
+    @property
+    def published(self) -> bool:
+        """True when the object is uploaded and has a wallpapers row"""
+        return bool(self.wallpaper_id)
+
+
+@dataclass
+class RebuildStats:
+    """Counters reported by ContentIndex.rebuild"""
+    objects: int = 0
+    indexed: int = 0
+    linked_rows: int = 0
+    skipped: int = 0
+
+
+class ContentIndex:
+    """Persistent SQLite map of content hashes to R2 keys and wallpaper rows"""
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                sha256 TEXT PRIMARY KEY,
+                object_key TEXT NOT NULL,
+                public_url TEXT,
+                wallpaper_id TEXT,
+                size INTEGER,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_objects_public_url ON objects(public_url);
+
+            -- Hash cache so unchanged local files are not re-read
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def hash_file(self, path) -> str:
+        """Content hash of a local file, reusing the cached digest if size and mtime match"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256 FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row:
+            return row[0]
+
+        sha256 = hash_file(path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, sha256)
+            )
+            self._conn.commit()
+        return sha256
+
+    def cached_hashes(self) -> Dict[str, Tuple[int, int, str]]:
+        """Every cached digest as path -> (size, mtime_ns, sha256), in one query"""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, sha256 FROM files").fetchall()
+        return {path: (size, mtime_ns, sha256) for path, size, mtime_ns, sha256 in rows}
+
+    def entries(self) -> Iterator[IndexEntry]:
+        """Every indexed object"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sha256, object_key, public_url, wallpaper_id, size FROM objects"
+            ).fetchall()
+        return (IndexEntry(*row) for row in rows)
+
+    def lookup(self, sha256: str) -> Optional[IndexEntry]:
+        """Return the indexed object for a content hash, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, object_key, public_url, wallpaper_id, size FROM objects WHERE sha256 = ?",
+                (sha256,)
+            ).fetchone()
+        return IndexEntry(*row) if row else None
+
+    def record_upload(self, sha256: str, object_key: str, public_url: str, size: Optional[int] = None):
+        """Remember that content now exists in the bucket"""
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO objects (sha256, object_key, public_url, size, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET
+                    object_key = excluded.object_key,
+                    public_url = excluded.public_url,
+                    size = COALESCE(excluded.size, objects.size),
+                    updated_at = excluded.updated_at
+            """, (sha256, object_key, public_url, size, _now()))
+            self._conn.commit()
+
+    def record_row(self, sha256: str, wallpaper_id: str):
+        """Link indexed content to its wallpapers row"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE objects SET wallpaper_id = ?, updated_at = ? WHERE sha256 = ?",
+                (str(wallpaper_id), _now(), sha256)
+            )
+            self._conn.commit()
+
+    def rebuild(self, r2_client, bucket_name: str, supabase_client, public_url_base: str,
+                head_workers: int = 16) -> RebuildStats:
+        """Repopulate the index from the bucket listing and the wallpapers table
+
+        Content-addressed keys carry their hash in the name. Other keys are
+        checked with a HEAD request for the sha256 metadata written at upload;
+        objects with neither (uploads that predate the index) are skipped.
+        """
+        stats = RebuildStats()
+        entries: Dict[str, IndexEntry] = {}
+        unnamed = []
+
+        for obj in iter_objects(r2_client, bucket_name):
+            if '/' in obj['Key']:
+                # Derivatives and other nested objects are not originals
+                continue
+            stats.objects += 1
+            match = CONTENT_KEY_RE.match(obj['Key'])
+            if match:
+                entries[match.group('sha256')] = IndexEntry(
+                    match.group('sha256'), obj['Key'], f"{public_url_base}/{obj['Key']}", None, obj['Size'])
+            else:
+                unnamed.append(obj)
+
+        def read_hash(obj):
+            head = r2_client.head_object(Bucket=bucket_name, Key=obj['Key'])
+            return obj, head.get('Metadata', {}).get('sha256')
+
+        with ThreadPoolExecutor(max_workers=head_workers) as pool:
+            for obj, sha256 in pool.map(read_hash, unnamed):
+                if sha256:
+                    entries[sha256] = IndexEntry(
+                        sha256, obj['Key'], f"{public_url_base}/{obj['Key']}", None, obj['Size'])
+                else:
+                    stats.skipped += 1
+
+        # Link rows by the public URL they were inserted with
+        by_url = {entry.public_url: entry for entry in entries.values()}
+        for row in iter_rows(supabase_client):
+            entry = by_url.get(row.get('image_url'))
+            if entry:
+                entry.wallpaper_id = str(row['id'])
+                stats.linked_rows += 1
+
+        now = _now()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM objects")
+                self._conn.executemany(
+                    "INSERT INTO objects (sha256, object_key, public_url, wallpaper_id, size, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(e.sha256, e.object_key, e.public_url, e.wallpaper_id, e.size, now) for e in entries.values()]
+                )
+        stats.indexed = len(entries)
+        return stats
+
+    def forget(self, sha256: str):
+        """Drop content that no longer exists in the bucket"""
+        with self._lock:
+            self._conn.execute("DELETE FROM objects WHERE sha256 = ?", (sha256,))
+            self._conn.commit()
+
+
+def iter_objects(r2_client, bucket_name: str, prefix: str = '') -> Iterator[Dict]:
+    """Yield every object in the bucket (or under a prefix) using paginated ListObjectsV2"""
+    paginator = r2_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        yield from page.get('Contents', [])
+
+
+def iter_rows(supabase_client, page_size: int = 1000, columns: str = 'id,image_url') -> Iterator[Dict]:
+    """Yield the given columns (id and image_url by default) for every wallpapers row, one page at a time"""
+    start = 0
+    while True:
+        result = (supabase_client.table('wallpapers')
+                  .select(columns)
+                  .order('id')
+                  .range(start, start + page_size - 1)
+                  .execute())
+        rows = result.data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        start += page_size
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Crash-safe publish journal for the Wallpaper Publisher
+Records how far each file got (hashed, analysed, uploaded, inserted) in a
+SQLite WAL database, so an interrupted ingest resumes only its unfinished
+work and objects orphaned by a crash can be found and linked or removed
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from wallpaper_index import CONTENT_KEY_RE, ContentIndex, iter_objects, iter_rows
+
+# Stages in the order a file passes through them
+STAGES = ('pending', 'hashed', 'analysed', 'uploaded', 'inserted')
+STAGE_RANK = {stage: rank for rank, stage in enumerate(STAGES)}
+
+# Columns stored as JSON text
+JSON_COLUMNS = ('metadata', 'color_palette', 'derivatives')
+
+# Objects younger than this may belong to a run that is still in progress
+ORPHAN_GRACE_PERIOD = timedelta(hours=1)
+
+
+@dataclass
+class JournalEntry:
+    """Everything recorded for one local file"""
+    path: str
+    size: int
+    mtime_ns: int
+    stage: str = 'pending'
+    sha256: Optional[str] = None
+    metadata: Optional[Dict] = None
+    color_palette: Optional[List[str]] = None
+    object_key: Optional[str] = None
+    public_url: Optional[str] = None
+    derivatives: Optional[Dict] = None
+    wallpaper_id: Optional[str] = None
+    error: Optional[str] = None
+
+    def reached(self, stage: str) -> bool:
+        return STAGE_RANK[self.stage] >= STAGE_RANK[stage]
+
+
+_ENTRY_COLUMNS = ('path', 'size', 'mtime_ns', 'stage', 'sha256', 'metadata', 'color_palette',
+                  'object_key', 'public_url', 'derivatives', 'wallpaper_id', 'error')
+
+
+class JobJournal:
+    """SQLite journal of per-file publish progress
+
+    WAL mode lets every stage worker append progress without blocking the
+    others, and each update is its own transaction, so whatever was recorded
+    before a crash survives it. Every step is idempotent (content-addressed
+    keys, upserts on content_hash), so redoing the one step that was in
+    flight when the process died is always safe.
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across process crashes in WAL mode; only power loss can drop the last commits
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                sha256 TEXT,
+                metadata TEXT,
+                color_palette TEXT,
+                object_key TEXT,
+                public_url TEXT,
+                derivatives TEXT,
+                wallpaper_id TEXT,
+                error TEXT,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_sha256 ON items(sha256);
+            CREATE INDEX IF NOT EXISTS idx_items_stage ON items(stage);
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def begin(self, path) -> JournalEntry:
+        """Return the journal entry for a file, starting over if it changed since it was recorded"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        existing = self.get(path)
+        if existing and existing.size == stat.st_size and existing.mtime_ns == stat.st_mtime_ns:
+            return existing
+
+        entry = JournalEntry(path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO items (path, size, mtime_ns, stage, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (path, entry.size, entry.mtime_ns, entry.stage, _now())
+            )
+            self._conn.commit()
+        return entry
+
+    def get(self, path) -> Optional[JournalEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM items WHERE path = ?", (os.path.abspath(path),)
+            ).fetchone()
+        return _entry_from_row(row) if row else None
+
+    def find(self, sha256: str) -> List[JournalEntry]:
+        """Every file recorded with this content, most advanced first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM items WHERE sha256 = ?", (sha256,)
+            ).fetchall()
+        entries = [_entry_from_row(row) for row in rows]
+        return sorted(entries, key=lambda entry: STAGE_RANK[entry.stage], reverse=True)
+
+    def advance(self, path, stage: str, **fields):
+        """Record that a file reached a stage, along with what that stage produced
+
+        The stage never moves backwards, so a late update from a slower worker
+        cannot undo later progress. Passing stage=None only updates fields.
+        """
+        path = os.path.abspath(path)
+        unknown = set(fields) - set(_ENTRY_COLUMNS[4:])
+        if unknown:
+            raise ValueError(f"Unknown journal fields: {', '.join(sorted(unknown))}")
+
+        values = {name: json.dumps(value) if name in JSON_COLUMNS and value is not None else value
+                  for name, value in fields.items()}
+        values.setdefault('error', None)
+        assignments = [f"{name} = ?" for name in values] + ["updated_at = ?"]
+        parameters = list(values.values()) + [_now()]
+
+        with self._lock:
+            if stage is not None:
+                row = self._conn.execute("SELECT stage FROM items WHERE path = ?", (path,)).fetchone()
+                if row and STAGE_RANK[stage] > STAGE_RANK[row[0]]:
+                    assignments.append("stage = ?")
+                    parameters.append(stage)
+            self._conn.execute(f"UPDATE items SET {', '.join(assignments)} WHERE path = ?",
+                               parameters + [path])
+            self._conn.commit()
+
+    def forget_upload(self, sha256: str):
+        """Move every file with this content back to 'hashed' after its objects were deleted
+
+        Advance never moves a stage backwards, so this is the one way down:
+        the stored key, URL and derivatives are cleared, and a later run
+        uploads the content again instead of inserting a row pointing at
+        deleted objects.
+        """
+        stages = [stage for stage in STAGES if STAGE_RANK[stage] > STAGE_RANK['hashed']]
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE items SET stage = 'hashed', object_key = NULL, public_url = NULL, derivatives = NULL, "
+                f"wallpaper_id = NULL, updated_at = ? WHERE sha256 = ? AND stage IN ({', '.join('?' * len(stages))})",
+                [_now(), sha256] + stages
+            )
+            self._conn.commit()
+
+    def record_error(self, path, error: str):
+        """Keep the stage reached so far and note why the file stopped"""
+        with self._lock:
+            self._conn.execute("UPDATE items SET error = ?, updated_at = ? WHERE path = ?",
+                               (error, _now(), os.path.abspath(path)))
+            self._conn.commit()
+
+    def unfinished(self) -> Iterator[JournalEntry]:
+        """Entries that have not reached the inserted stage"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM items WHERE stage != 'inserted' ORDER BY path"
+            ).fetchall()
+        for row in rows:
+            yield _entry_from_row(row)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of entries at each stage"""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, COUNT(*) FROM items GROUP BY stage").fetchall()
+        counts = {stage: 0 for stage in STAGES}
+        counts.update(dict(rows))
+        return counts
+
+
+def _entry_from_row(row) -> JournalEntry:
+    values = dict(zip(_ENTRY_COLUMNS, row))
+    for name in JSON_COLUMNS:
+        if values[name] is not None:
+            values[name] = json.loads(values[name])
+    return JournalEntry(**values)
+
+
+@dataclass
+class ReconcileStats:
+    """Counters reported by reconcile"""
+    objects: int = 0
+    orphans: int = 0
+    linked: int = 0
+    deleted: int = 0
+    kept: int = 0
+    too_recent: int = 0
+    journal_updated: int = 0
+    unlinked: List[str] = field(default_factory=list)
+
+
+def reconcile(journal: JobJournal, content_index: ContentIndex, r2_client, bucket_name: str,
+              supabase_client, public_url_base: str, insert_row: Callable[[JournalEntry], Dict],
+              delete_orphans: bool = False,
+              grace_period: timedelta = ORPHAN_GRACE_PERIOD) -> ReconcileStats:
+    """Find originals in the bucket with no wallpapers row and repair them
+
+    An orphan whose journal entry still holds its AI metadata is linked by
+    inserting its row through insert_row. The rest are deleted, derivatives
+    included, when delete_orphans is set, with their journal entries moved
+    back to 'hashed', and listed otherwise. Journal
+    entries stuck at 'uploaded' whose row does exist (the process died after
+    the insert but before recording it) are marked inserted.
+    """
+    stats = ReconcileStats()
+    cutoff = datetime.now(timezone.utc) - grace_period
+
+    objects = {}
+    for obj in iter_objects(r2_client, bucket_name):
+        match = CONTENT_KEY_RE.match(obj['Key'])
+        if match:
+            objects[match.group('sha256')] = obj
+    stats.objects = len(objects)
+
+    # Rows are matched by content_hash, or by the key in image_url for rows that predate it
+    rows: Dict[str, str] = {}
+    for row in iter_rows(supabase_client, columns='id,image_url,content_hash'):
+        sha256 = row.get('content_hash')
+        if not sha256:
+            match = CONTENT_KEY_RE.match((row.get('image_url') or '').rsplit('/', 1)[-1])
+            sha256 = match.group('sha256') if match else None
+        if sha256:
+            rows[sha256] = str(row['id'])
+
+    for entry in journal.unfinished():
+        if entry.sha256 in rows and entry.reached('uploaded'):
+            journal.advance(entry.path, 'inserted', wallpaper_id=rows[entry.sha256])
+            content_index.record_row(entry.sha256, rows[entry.sha256])
+            stats.journal_updated += 1
+
+    for sha256, obj in objects.items():
+        if sha256 in rows:
+            continue
+        stats.orphans += 1
+        if obj['LastModified'] > cutoff:
+            stats.too_recent += 1
+            continue
+
+        linkable = next((entry for entry in journal.find(sha256) if entry.metadata), None)
+        if linkable:
+            # The listing is authoritative even if the process died before recording the upload
+            linkable.object_key = obj['Key']
+            linkable.public_url = f"{public_url_base}/{obj['Key']}"
+            record = insert_row(linkable)
+            journal.advance(linkable.path, 'inserted', object_key=linkable.object_key,
+                            public_url=linkable.public_url, wallpaper_id=str(record['id']))
+            content_index.record_upload(sha256, linkable.object_key, linkable.public_url, obj['Size'])
+            content_index.record_row(sha256, record['id'])
+            stats.linked += 1
+        elif delete_orphans:
+            keys = [obj['Key']] + [child['Key'] for child in iter_objects(r2_client, bucket_name, f"{sha256}/")]
+            for start in range(0, len(keys), 1000):
+                r2_client.delete_objects(Bucket=bucket_name, Delete={
+                    'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True})
+            content_index.forget(sha256)
+            journal.forget_upload(sha256)
+            stats.deleted += 1
+        else:
+            stats.unlinked.append(obj['Key'])
+            stats.kept += 1
+    return stats
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing spans for the Wallpaper Publisher
+Each unit of work (decode, AI request, upload, DB insert) is recorded as a
+span carrying its duration, bytes moved and retries; spans can be streamed as
+JSON lines and summarised as percentiles or a Prometheus text-format file
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, IO, Iterator, List, Optional
+
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+@dataclass
+class Span:
+    """One timed unit of work; bytes and retries are filled in by the code being timed"""
+    stage: str
+    item: Optional[str] = None
+    started_at: float = 0.0
+    duration: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    ok: bool = True
+    error: Optional[str] = None
+
+
+@dataclass
+class StageMetrics:
+    """Aggregates for every span recorded under one stage name"""
+    durations: List[float] = field(default_factory=list)
+    bytes: int = 0
+    retries: int = 0
+    failures: int = 0
+
+    def quantile(self, q: float) -> float:
+        """Nearest-rank quantile of the recorded durations in seconds"""
+        if not self.durations:
+            return 0.0
+        ordered = sorted(self.durations)
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class SpanRecorder:
+    """Thread-safe collector of spans with optional JSON-lines streaming
+
+    Spans are written to the JSON-lines file as they finish, so a crashed run
+    still leaves a usable trace.
+    """
+
+    def __init__(self, jsonl_path: Optional[Path] = None):
+        self.jsonl_path = jsonl_path
+        self.stages: Dict[str, StageMetrics] = {}
+        self._lock = threading.Lock()
+        self._file: Optional[IO[str]] = None
+        if jsonl_path is not None:
+            jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(jsonl_path, 'a', encoding='utf-8', buffering=1)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @contextmanager
+    def span(self, stage: str, item=None, **values) -> Iterator[Span]:
+        """Time the enclosed block; an exception marks the span failed and is re-raised"""
+        span = Span(stage, str(item) if item is not None else None, time.time(), **values)
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.ok = False
+            span.error = str(e)
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            self.record(span)
+
+    def record(self, span: Span):
+        """Add a finished span"""
+        with self._lock:
+            metrics = self.stages.setdefault(span.stage, StageMetrics())
+            metrics.durations.append(span.duration)
+            metrics.bytes += span.bytes
+            metrics.retries += span.retries
+            metrics.failures += not span.ok
+            if self._file is not None:
+                self._file.write(json.dumps(asdict(span)) + "\n")
+
+    def add_retries(self, stage: str, retries: int):
+        """Count retries that cannot be tied to a single span (e.g. inside the S3 transfer threads)"""
+        with self._lock:
+            self.stages.setdefault(stage, StageMetrics()).retries += retries
+
+    def format_summary(self) -> str:
+        """Percentile table for the end-of-run report"""
+        lines = [
+            "Stage timings",
+            f"  {'Stage':<10}{'Count':>7}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+            f"{'Max (ms)':>10}{'MB':>9}{'Retries':>9}{'Failed':>8}",
+        ]
+        with self._lock:
+            for stage, metrics in self.stages.items():
+                p50, p95, p99 = (metrics.quantile(q) * 1000 for q in SUMMARY_QUANTILES)
+                longest = max(metrics.durations, default=0.0) * 1000
+                lines.append(
+                    f"  {stage:<10}{len(metrics.durations):>7}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}"
+                    f"{longest:>10.1f}{metrics.bytes / (1024 * 1024):>9.1f}{metrics.retries:>9}"
+                    f"{metrics.failures:>8}"
+                )
+        return "\n".join(lines)
+
+    def prometheus_text(self, prefix: str = 'wallpaper_publisher') -> str:
+        """Render the aggregates in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Time spent per item in each pipeline stage",
+            f"# TYPE {prefix}_stage_duration_seconds summary",
+        ]
+        with self._lock:
+            stages = list(self.stages.items())
+            for stage, metrics in stages:
+                for q in SUMMARY_QUANTILES:
+                    lines.append(f'{prefix}_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} '
+                                 f'{metrics.quantile(q):.6f}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {sum(metrics.durations):.6f}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {len(metrics.durations)}')
+
+            for name, help_text, attribute in (
+                ('stage_bytes_total', "Bytes read or sent by each stage", 'bytes'),
+                ('stage_retries_total', "Retried requests in each stage", 'retries'),
+                ('stage_failures_total', "Items that failed in each stage", 'failures'),
+            ):
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for stage, metrics in stages:
+                    lines.append(f'{prefix}_{name}{{stage="{stage}"}} {getattr(metrics, attribute)}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path):
+        """Write the metrics file atomically, as node_exporter's textfile collector expects"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temporary.write_text(self.prometheus_text(), encoding='utf-8')
+        os.replace(temporary, path)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Bounded-concurrency pipeline used by the Wallpaper Publisher headless modes
+Each stage owns a worker pool and a bounded input queue, so a slow stage applies
+backpressure to the stages in front of it instead of buffering the whole batch
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional
+
+# Marker placed on a stage queue to tell one worker to exit
+_STOP = object()
+
+
+@dataclass
+class StageStats:
+    """Counters collected for a single pipeline stage"""
+    name: str
+    workers: int
+    processed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def average_ms(self) -> float:
+        handled = self.processed + self.skipped + self.failed
+        return (self.busy_seconds / handled) * 1000 if handled else 0.0
+
+
+@dataclass
+class PipelineFailure:
+    """An item that was dropped because one of its stages raised"""
+    item: Any
+    stage: str
+    error: str
+
+
+@dataclass
+class PipelineResult:
+    """Outcome of a pipeline run"""
+    completed: List[Any] = field(default_factory=list)
+    skipped: List[Any] = field(default_factory=list)
+    failures: List[PipelineFailure] = field(default_factory=list)
+    stages: List[StageStats] = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+class Stage:
+    """A named pipeline step run by a pool of worker threads
+
+    The stage function receives an item and returns the item to hand to the
+    next stage. Returning None drops the item as skipped (e.g. already done);
+    raising drops it as failed.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1, queue_size: int = 8):
+        if workers < 1:
+            raise ValueError(f"Stage '{name}' needs at least one worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = queue_size
+
+
+class Pipeline:
+    """Runs items through a chain of stages with bounded queues between them"""
+
+    def __init__(self, stages: List[Stage], on_progress: Optional[Callable[[PipelineResult], None]] = None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.on_progress = on_progress
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop feeding new items; items already in flight are drained"""
+        self._cancelled.set()
+
+    def run(self, items: Iterable[Any]) -> PipelineResult:
+        """Push every item through all stages and block until the pipeline drains"""
+        result = PipelineResult(stages=[StageStats(s.name, s.workers) for s in self.stages])
+        queues = [queue.Queue(maxsize=max(1, s.queue_size)) for s in self.stages]
+        threads: List[List[threading.Thread]] = []
+
+        for index, stage in enumerate(self.stages):
+            output = queues[index + 1] if index + 1 < len(queues) else None
+            stage_threads = []
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(stage, result.stages[index], queues[index], output, result),
+                    name=f"{stage.name}-{worker}",
+                    daemon=True,
+                )
+                thread.start()
+                stage_threads.append(thread)
+            threads.append(stage_threads)
+
+        start = time.perf_counter()
+        try:
+            # put() blocks when the first queue is full, which is the backpressure
+            for item in items:
+                if self._cancelled.is_set():
+                    break
+                queues[0].put(item)
+        finally:
+            # Shut stages down front to back so every queued item is drained
+            for index, stage_threads in enumerate(threads):
+                for _ in stage_threads:
+                    queues[index].put(_STOP)
+                for thread in stage_threads:
+                    thread.join()
+            result.elapsed = time.perf_counter() - start
+
+        return result
+
+    def _worker(self, stage: Stage, stats: StageStats, inbox: queue.Queue,
+                outbox: Optional[queue.Queue], result: PipelineResult):
+        """Pull items from the stage queue until told to stop"""
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                return
+
+            started = time.perf_counter()
+            try:
+                output = stage.func(item)
+            except Exception as e:
+                with self._lock:
+                    stats.failed += 1
+                    stats.busy_seconds += time.perf_counter() - started
+                    result.failures.append(PipelineFailure(item, stage.name, str(e)))
+                    self._report(result)
+                continue
+
+            with self._lock:
+                stats.busy_seconds += time.perf_counter() - started
+                if output is None:
+                    stats.skipped += 1
+                    result.skipped.append(item)
+                    self._report(result)
+                    continue
+                stats.processed += 1
+                if outbox is None:
+                    result.completed.append(output)
+                    self._report(result)
+
+            if outbox is not None:
+                outbox.put(output)
+
+    def _report(self, result: PipelineResult):
+        """Invoke the progress callback; called with the pipeline lock held"""
+        if self.on_progress:
+            self.on_progress(result)
+
+
+def format_summary(result: PipelineResult, total_bytes: int = 0, label: str = "items") -> str:
+    """Render a throughput summary for a finished pipeline run"""
+    elapsed = max(result.elapsed, 1e-9)
+    done = len(result.completed)
+    total = done + len(result.skipped) + len(result.failures)
+    lines = [
+        "Pipeline summary",
+        f"  {label.capitalize()}: {done} completed, {len(result.skipped)} skipped, "
+        f"{len(result.failures)} failed (of {total})",
+        f"  Wall time: {result.elapsed:.2f}s  |  {done / elapsed:.2f} {label}/s"
+        f"  |  {total_bytes / elapsed / (1024 * 1024):.2f} MB/s",
+        f"  {'Stage':<12}{'Workers':>8}{'Done':>8}{'Skipped':>8}{'Failed':>8}"
+        f"{'Busy (s)':>10}{'Avg (ms)':>10}{'Util':>7}",
+    ]
+    for stats in result.stages:
+        utilisation = stats.busy_seconds / (elapsed * stats.workers)
+        lines.append(
+            f"  {stats.name:<12}{stats.workers:>8}{stats.processed:>8}{stats.skipped:>8}{stats.failed:>8}"
+            f"{stats.busy_seconds:>10.2f}{stats.average_ms:>10.1f}{utilisation:>7.0%}"
+        )
+    for failure in result.failures:
+        lines.append(f"  ! {failure.stage}: {failure.item} - {failure.error}")
+    return "\n".join(lines)
+
@@ -5,33 +5,548 @@ Integrates with Supabase database and Cloudflare R2 storage
 Uses Google Gemini AI for automatic metadata generation
 """
 
+import time
+
+# Recorded before anything heavy is imported, for the startup budget check
+PROCESS_START = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
 import sys
+import argparse
+import importlib
+import importlib.util
+import queue
 from pathlib import Path
 import threading
-from typing import Optional, Dict, List
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Dict, List, Iterable, Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import io
 import json
 from datetime import datetime
 import uuid
 
-# Third-party imports
-try:
-    from dotenv import load_dotenv
-    from supabase import create_client, Client
-    import boto3
-    from botocore.exceptions import ClientError
-    from PIL import Image, ImageTk
-    import google.generativeai as genai
-    import requests
-except ImportError as e:
-    print(f"Missing required package: {e}")
+# Third-party packages. Only the light ones are imported here; supabase, boto3,
+# google.generativeai and PIL.ImageTk load on first use or during the background
+# service warm-up, so the window appears without waiting for them.
+REQUIRED_PACKAGES = {
+    'dotenv': 'python-dotenv',
+    'supabase': 'supabase',
+    'boto3': 'boto3',
+    'PIL': 'Pillow',
+    'numpy': 'numpy',
+    'google.generativeai': 'google-generativeai',
+}
+
+_missing_packages = [name for module, name in REQUIRED_PACKAGES.items()
+                     if importlib.util.find_spec(module) is None]
+if _missing_packages:
+    print(f"Missing required package: {', '.join(_missing_packages)}")
     print("Please install requirements: pip install -r wallpaper_publisher_requirements.txt")
     sys.exit(1)
 
+from dotenv import load_dotenv
+from PIL import Image
+
+from wallpaper_pipeline import Pipeline, Stage, format_summary
+from wallpaper_transfer import UploadProgress, transfer_config_from_env
+from wallpaper_clients import ServiceClients, configure_gemini, r2_client_config, supabase_client_options
+from wallpaper_index import ContentIndex, content_key, iter_rows
+from wallpaper_cache import MetadataCache, ThumbnailCache, metadata_cache_key
+from wallpaper_imaging import (
+    AI_MAX_DIMENSION, ai_payload_from_image, dominant_colors,
+    extract_palette, open_reduced, prepare_ai_payload
+)
+from wallpaper_gemini import GeminiClient
+from wallpaper_db import CONFLICT_COLUMN, WallpaperWriter, upsert_rows
+from wallpaper_derivatives import Derivative, DerivativeGenerator, derivative_key, derivatives_manifest
+from wallpaper_journal import JobJournal, JournalEntry, reconcile
+from wallpaper_metrics import SpanRecorder
+from wallpaper_encode import DEFAULT_TARGET_SIMILARITY, REENCODE_FORMATS, EncodeResult, Reencoder
+from wallpaper_backfill import DEFAULT_BACKFILL_WORKERS, ROW_COLUMNS, BackfillStats, backfill, update_row
+from wallpaper_sync import DEFAULT_SYNC_WORKERS, LocalFile, SyncPlan, plan_sync
+from wallpaper_scan import (
+    DEFAULT_SCAN_WORKERS, ScanRecord, below_minimum, parse_min_resolution, read_header, read_manifest, scan,
+    write_manifest
+)
+from wallpaper_classify import (
+    DEFAULT_CONFIDENCE, CategoryModel, Prediction, file_features, metadata_from_prediction, train_from_rows
+)
+from wallpaper_similarity import (
+    DEFAULT_MAX_DISTANCE, HASH_DECODE_DIMENSION, NearDuplicate, SimilarityIndex, format_hash, perceptual_hash,
+    perceptual_hash_file, rebuild_from_rows
+)
+from wallpaper_watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS, FolderWatcher
+from wallpaper_engine import (
+    CANCELLED, ERROR, PROGRESS, RESULT, STARTED, STATUS, Engine, EngineBusy, EngineEvent, JobContext
+)
+
+REQUIRED_ENV_VARS = [
+    'NEXT_PUBLIC_SUPABASE_URL',
+    'NEXT_PUBLIC_SUPABASE_ANON_KEY',
+    'R2_ACCOUNT_ID',
+    'R2_ACCESS_KEY_ID',
+    'R2_SECRET_ACCESS_KEY',
+    'R2_BUCKET_NAME'
+]
+
+CATEGORIES = ["nature", "minimal", "abstract", "urban", "space", "art"]
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff'}
+
+GEMINI_MODEL_NAME = 'gemini-2.0-flash-exp'
+
+# Largest preview shown in the window
+PREVIEW_BOX = (300, 200)
+
+# Folder neighbours thumbnailed in the background after a selection
+PREVIEW_PREFETCH_LIMIT = 100
+
+# How often the UI drains engine events
+ENGINE_POLL_MS = 50
+# Jobs that run quietly: no spinner, and the Cancel button leaves them alone
+BACKGROUND_JOBS = ('connect', 'suggest')
+
+# Connections opened before the first publish: one per derivative upload, and one for the row insert
+GUI_R2_CONNECTIONS = 8
+GUI_SUPABASE_CONNECTIONS = 1
+
+METADATA_PROMPT = """
+            Analyze this wallpaper image and generate metadata for a wallpaper website. 
+            Provide your response in JSON format with the following fields:
+            
+            {
+                "title": "SEO-optimized title (max 60 characters)",
+                "description": "Detailed description for SEO (max 160 characters)", 
+                "category": "one of: nature, minimal, abstract, urban, space, art",
+                "tags": ["tag1", "tag2", "tag3", "tag4", "tag5"]
+            }
+            
+            Make the title catchy and SEO-friendly. Include relevant keywords in the description.
+            Choose the most appropriate category. Provide 3-5 relevant tags.
+            """
+
+
+def state_dir() -> Path:
+    """Directory for the publisher's local caches and indexes"""
+    return Path(os.getenv('WALLPAPER_PUBLISHER_STATE_DIR', '.wallpaper_publisher'))
+
+
+def open_content_index() -> ContentIndex:
+    """Open the local content-hash dedupe index"""
+    return ContentIndex(state_dir() / 'content_index.sqlite3')
+
+
+def open_metadata_cache() -> MetadataCache:
+    """Open the on-disk Gemini metadata cache, sized from the environment"""
+    max_mb = int(os.getenv('WALLPAPER_METADATA_CACHE_MB', '64'))
+    ttl_days = float(os.getenv('WALLPAPER_METADATA_CACHE_TTL_DAYS', '30'))
+    return MetadataCache(state_dir() / 'metadata_cache.sqlite3',
+                         max_bytes=max_mb * 1024 * 1024, ttl_seconds=ttl_days * 24 * 60 * 60)
+
+
+def similarity_index_path() -> Path:
+    return state_dir() / 'similarity_index.npz'
+
+
+def open_similarity_index(max_distance: int = DEFAULT_MAX_DISTANCE) -> SimilarityIndex:
+    """Load the perceptual-hash index of published wallpapers, built by --rebuild-similarity-index"""
+    return SimilarityIndex.load(similarity_index_path(), max_distance)
+
+
+def category_model_path() -> Path:
+    return state_dir() / 'category_model.npz'
+
+
+def open_job_journal() -> JobJournal:
+    """Open the crash-safe journal of headless publish progress"""
+    return JobJournal(state_dir() / 'journal.sqlite3')
+
+
+def metadata_key(content_hash: str) -> str:
+    """Metadata cache key for an image under the current prompt and model"""
+    return metadata_cache_key(content_hash, METADATA_PROMPT, GEMINI_MODEL_NAME)
+
+
+def load_environment_file(env_path: Path = Path(".env.local")) -> List[str]:
+    """Load .env.local and return the names of any missing required variables"""
+    if not env_path.exists():
+        raise FileNotFoundError(f"{env_path} file not found!")
+    load_dotenv(env_path)
+    return [var for var in REQUIRED_ENV_VARS if not os.getenv(var)]
+
+
+def create_supabase_client():
+    """Create the Supabase client from environment configuration, on a pooled HTTP client"""
+    from supabase import create_client
+    
+    supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
+    supabase_key = os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY')
+    return create_client(supabase_url, supabase_key, options=supabase_client_options())
+
+
+def _parse_timestamp(value):
+    """S3 timestamps are ISO 8601; botocore's general parser costs more than the rest of a listing entry"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        from botocore.utils import parse_timestamp
+        return parse_timestamp(value)
+
+
+def create_r2_client():
+    """Create the Cloudflare R2 (S3-compatible) client from environment configuration"""
+    import boto3
+    import botocore.session
+
+    session = botocore.session.get_session()
+    session.get_component('response_parser_factory').set_parser_defaults(timestamp_parser=_parse_timestamp)
+    return boto3.session.Session(botocore_session=session).client(
+        's3',
+        endpoint_url=f"https://{os.getenv('R2_ACCOUNT_ID')}.r2.cloudflarestorage.com",
+        aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
+        region_name='auto',
+        config=r2_client_config()
+    )
+
+
+def create_gemini_model(api_key: str):
+    """Configure Gemini and return the metadata model"""
+    import google.generativeai as genai
+    
+    configure_gemini(api_key)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+def create_gemini_client(api_key: str, requests_per_minute: Optional[float] = None,
+                         max_in_flight: Optional[int] = None,
+                         model_factory: Callable[[str], Any] = create_gemini_model) -> GeminiClient:
+    """Build the shared rate-limited Gemini client (GEMINI_RPM, GEMINI_MAX_IN_FLIGHT)"""
+    return GeminiClient(
+        model_factory(api_key),
+        requests_per_minute=requests_per_minute or float(os.getenv('GEMINI_RPM', '10')),
+        max_in_flight=max_in_flight or int(os.getenv('GEMINI_MAX_IN_FLIGHT', '4'))
+    )
+
+
+@dataclass
+class Services:
+    """Factories for the external service clients
+
+    The defaults build the real Supabase, R2 and Gemini clients from the
+    environment; pass replacements to run against local stand-ins such as
+    those in wallpaper_fakes.
+    """
+    supabase: Callable[[], Any] = create_supabase_client
+    r2: Callable[[], Any] = create_r2_client
+    gemini_model: Callable[[str], Any] = create_gemini_model
+
+
+def parse_metadata_response(response_text: str) -> Dict:
+    """Parse the JSON metadata returned by Gemini, stripping markdown fences"""
+    response_text = response_text.strip()
+    if response_text.startswith('```json'):
+        response_text = response_text[7:-3]
+    elif response_text.startswith('```'):
+        response_text = response_text[3:-3]
+    return json.loads(response_text)
+
+
+def generate_image_metadata(model, image) -> Dict:
+    """Ask Gemini for title, description, category and tags for an image
+
+    image is any part Gemini accepts; callers pass the compact payload from
+    prepare_ai_payload rather than a full-resolution PIL image.
+    """
+    response = model.generate_content([METADATA_PROMPT, image])
+    return parse_metadata_response(response.text)
+
+
+def object_key_for(image_path: str, content_hash: Optional[str] = None, extension: Optional[str] = None) -> str:
+    """R2 key for an original: content-addressed when the hash is known"""
+    file_extension = extension or Path(image_path).suffix
+    if content_hash:
+        return content_key(content_hash, file_extension)
+    return f"{uuid.uuid4()}{file_extension}"
+
+
+def public_url_for(object_key: str) -> str:
+    """Public URL of an R2 object"""
+    return f"{os.getenv('R2_PUBLIC_URL')}/{object_key}"
+
+
+def upload_wallpaper(r2_client, image_path: str, progress: Optional[UploadProgress] = None,
+                     transfer_config=None, content_hash: Optional[str] = None,
+                     encoded: Optional[EncodeResult] = None) -> str:
+    """Upload an image, or its re-encoded replacement, to R2 and return its public URL"""
+    file_extension = encoded.extension if encoded else Path(image_path).suffix
+    unique_filename = object_key_for(image_path, content_hash, file_extension)
+
+    bucket_name = os.getenv('R2_BUCKET_NAME')
+    extra_args = {'ContentType': encoded.content_type if encoded else f'image/{file_extension[1:]}'}
+    if content_hash:
+        # Lets --rebuild-index recover the hash of objects regardless of key
+        extra_args['Metadata'] = {'sha256': content_hash}
+
+    if encoded:
+        r2_client.upload_fileobj(
+            io.BytesIO(encoded.data),
+            bucket_name,
+            unique_filename,
+            ExtraArgs=extra_args,
+            Config=transfer_config or transfer_config_from_env(),
+            Callback=progress
+        )
+    else:
+        # upload_file streams each part straight from disk, so parts go out in parallel
+        # without buffering the whole file the way upload_fileobj does
+        r2_client.upload_file(
+            image_path,
+            bucket_name,
+            unique_filename,
+            ExtraArgs=extra_args,
+            Config=transfer_config or transfer_config_from_env(),
+            Callback=progress
+        )
+
+    # Construct public URL
+    return public_url_for(unique_filename)
+
+
+def upload_derivatives(r2_client, content_hash: str, derivatives: List[Derivative]) -> Dict:
+    """Upload derivatives next to their original and return the {format: {width: url}} manifest"""
+    bucket_name = os.getenv('R2_BUCKET_NAME')
+
+    def put(derivative: Derivative) -> Derivative:
+        r2_client.put_object(
+            Bucket=bucket_name,
+            Key=derivative_key(content_hash, derivative.width, derivative.format),
+            Body=derivative.data,
+            ContentType=derivative.content_type,
+            # Keys change whenever the content does, so renditions never go stale
+            CacheControl='public, max-age=31536000, immutable'
+        )
+        return derivative
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        uploaded = list(pool.map(put, derivatives))
+
+    return derivatives_manifest(
+        uploaded, lambda d: public_url_for(derivative_key(content_hash, d.width, d.format)))
+
+
+def build_wallpaper_data(title: str, description: str, category: str, tags: List[str], public_url: str,
+                         **columns) -> Dict:
+    """Build the row inserted into the wallpapers table; extra columns are included when set"""
+    wallpaper_data = {
+        'title': title,
+        'description': description,
+        'category': category,
+        'tags': tags,
+        'image_url': public_url
+    }
+    wallpaper_data.update({name: value for name, value in columns.items() if value is not None})
+    return wallpaper_data
+
+
+def row_from_metadata(metadata: Dict, public_url: str, **columns) -> Dict:
+    """Build a wallpapers row from AI metadata as returned by generate_image_metadata"""
+    return build_wallpaper_data(
+        str(metadata['title']).strip(),
+        str(metadata.get('description', '')).strip(),
+        metadata['category'],
+        [str(tag).strip() for tag in metadata.get('tags', []) if str(tag).strip()],
+        public_url,
+        **columns
+    )
+
+
+def insert_wallpaper(supabase_client, wallpaper_data: Dict) -> Dict:
+    """Insert a wallpaper row into Supabase and return the stored record
+
+    Rows carrying a content hash are upserted on it, so a retried publish
+    updates the existing row instead of adding a duplicate.
+    """
+    if wallpaper_data.get(CONFLICT_COLUMN):
+        return upsert_rows(supabase_client, [wallpaper_data])[0]
+    result = supabase_client.table('wallpapers').insert(wallpaper_data).execute()
+    if not result.data:
+        raise Exception("Failed to insert into database")
+    return result.data[0]
+
+
+@dataclass
+class PublishRequest:
+    """A file and the metadata confirmed for it in the form"""
+    image_path: str
+    title: str
+    description: str
+    category: str
+    tags: List[str]
+    reencode: bool = False
+    allow_near_duplicate: bool = False
+
+
+class PublisherJobs:
+    """Connect, AI metadata and publish steps as engine jobs
+
+    Every blocking call goes through the job context, so it runs on the
+    engine's bounded pool and the job can be cancelled between steps.
+    """
+
+    def __init__(self, clients: ServiceClients, content_index: ContentIndex, metadata_cache: MetadataCache,
+                 derivative_generator: DerivativeGenerator):
+        self.clients = clients
+        self.content_index = content_index
+        self.metadata_cache = metadata_cache
+        self.derivative_generator = derivative_generator
+        self.reencoder = Reencoder()
+        self.similarity_index: Optional[SimilarityIndex] = None
+        self.category_model: Optional[CategoryModel] = None
+        self._category_model_loaded = False
+        self.supabase_client = None
+        self.r2_client = None
+        self.gemini_client = None
+        self._gemini_client_key = None
+        self._gemini_client_lock = threading.Lock()
+
+    def get_gemini_client(self, api_key: str) -> GeminiClient:
+        """Return the shared Gemini client, rebuilding it only when the API key changes"""
+        with self._gemini_client_lock:
+            if self.gemini_client is None or self._gemini_client_key != api_key:
+                self.gemini_client = create_gemini_client(api_key, model_factory=self.clients.gemini_model)
+                self._gemini_client_key = api_key
+            return self.gemini_client
+
+    async def connect(self, context: JobContext, api_key: Optional[str] = None):
+        """Import the service SDKs, build the shared clients and open their connections"""
+        supabase_client = await context.run(self.clients.supabase)
+        r2_client = await context.run(self.clients.r2)
+        if self.clients.services.gemini_model is create_gemini_model:
+            # Warm the Gemini SDK import so the first AI request does not pay for it
+            await context.run(importlib.import_module, 'google.generativeai')
+        # The first publish then starts on open connections; failures surface on first real use
+        await context.run(self.clients.prewarm, os.getenv('R2_BUCKET_NAME'), GUI_R2_CONNECTIONS,
+                          GUI_SUPABASE_CONNECTIONS, api_key or None)
+        self.supabase_client = supabase_client
+        self.r2_client = r2_client
+        if self.similarity_index is None:
+            self.similarity_index = await context.run(open_similarity_index)
+
+    async def generate_metadata(self, context: JobContext, image_path: str, api_key: str,
+                                force: bool = False):
+        """Return (metadata, from_cache) for an image, reusing an earlier answer unless forced"""
+        content_hash = await context.run(self.content_index.hash_file, image_path)
+        cache_key = metadata_key(content_hash)
+        metadata = None if force else await context.run(self.metadata_cache.get, cache_key)
+        if metadata is not None:
+            return metadata, True
+
+        context.status("Generating metadata with AI...")
+        # Downscaled, size-capped JPEG instead of the full-resolution original
+        payload = await context.run(prepare_ai_payload, image_path)
+        metadata = await context.run(generate_image_metadata, self.get_gemini_client(api_key), payload)
+        await context.run(self.metadata_cache.put, cache_key, metadata)
+        return metadata, False
+
+    async def suggest_category(self, context: JobContext, image_path: str) -> Optional[Prediction]:
+        """Category and base tags from the local classifier, or None when it is unsure or untrained"""
+        if not self._category_model_loaded:
+            self.category_model = await context.run(CategoryModel.load, category_model_path())
+            self._category_model_loaded = True
+        if self.category_model is None:
+            return None
+        features = await context.run(file_features, image_path)
+        prediction = self.category_model.predict(features)
+        return prediction if prediction.confident(DEFAULT_CONFIDENCE) else None
+
+    async def publish(self, context: JobContext, request: PublishRequest) -> Dict:
+        """Upload, render derivatives and insert the row
+
+        Returns {'public_url', 'duplicate', 'reencoded', 'near_duplicate'}.
+        An image perceptually close to a published one is not uploaded unless
+        the request allows it; near_duplicate then names the match.
+        """
+        image_path = request.image_path
+        context.status("Checking for duplicates...")
+        # Skip work for content that is already in the bucket
+        content_hash = await context.run(self.content_index.hash_file, image_path)
+        existing = self.content_index.lookup(content_hash)
+        if existing and existing.published:
+            return {'public_url': existing.public_url, 'duplicate': True, 'reencoded': None, 'near_duplicate': None}
+
+        # Header-only read for the resolution and device_type columns
+        header = await context.run(read_header, image_path)
+        phash = await context.run(perceptual_hash_file, image_path)
+        if self.similarity_index is not None and not request.allow_near_duplicate and not existing:
+            match = self.similarity_index.nearest(phash, content_hash=content_hash)
+            if match:
+                return {'public_url': None, 'duplicate': False, 'reencoded': None, 'near_duplicate': match}
+        encoded = None
+        stored_size = existing.size if existing else None
+        if existing:
+            # Uploaded by an earlier attempt that never reached the database
+            public_url = existing.public_url
+        else:
+            if request.reencode:
+                context.status("Re-encoding original...")
+                encoded = await context.run(self.reencoder.encode, image_path)
+            stored_size = encoded.size if encoded else os.path.getsize(image_path)
+
+            def on_update(progress: UploadProgress):
+                # Raising from the transfer callback aborts the multipart upload
+                context.check_cancelled()
+                context.progress(progress.fraction, f"Uploading to R2... {progress.describe()}")
+
+            context.progress(0.0, "Uploading to R2... 0%")
+            public_url = await context.run(upload_wallpaper, self.r2_client, image_path,
+                                           UploadProgress(stored_size, on_update=on_update),
+                                           content_hash=content_hash, encoded=encoded)
+            self.content_index.record_upload(
+                content_hash, object_key_for(image_path, content_hash, encoded and encoded.extension),
+                public_url, stored_size)
+
+        # Pre-render the responsive sizes the site requests while the palette is extracted
+        context.status("Generating responsive images...")
+        derivatives, color_palette = await asyncio.gather(
+            context.run(self.derivative_generator.generate, image_path),
+            context.run(extract_palette, image_path)
+        )
+        derivatives_map = await context.run(upload_derivatives, self.r2_client, content_hash, derivatives)
+
+        context.status("Saving to database...")
+        wallpaper_data = build_wallpaper_data(
+            request.title,
+            request.description,
+            request.category,
+            request.tags,
+            public_url,
+            content_hash=content_hash,
+            color_palette=color_palette,
+            derivatives=derivatives_map,
+            resolution=header.resolution,
+            device_type=header.device_type,
+            file_size=stored_size or header.size,
+            perceptual_hash=format_hash(phash)
+        )
+        # Once the insert has started the publish is allowed to finish
+        record = await context.run_to_completion(insert_wallpaper, self.supabase_client, wallpaper_data)
+        self.content_index.record_row(content_hash, record['id'])
+        if self.similarity_index is not None:
+            self.similarity_index.add(phash, str(record['id']), public_url)
+            await context.run_to_completion(self.similarity_index.save, similarity_index_path())
+        return {'public_url': public_url, 'duplicate': False, 'reencoded': encoded and encoded.describe(),
+                'near_duplicate': None}
+
+
 class WallpaperPublisher:
-    def __init__(self):
+    def __init__(self, services: Optional[Services] = None):
+        self.services = services or Services()
+        self.clients = ServiceClients(self.services)
         self.root = tk.Tk()
         self.root.title("Wallpaper Publisher")
         self.root.geometry("900x700")
@@ -40,10 +555,23 @@ class WallpaperPublisher:
         # Load environment variables
         self.load_environment()
         
-        # Initialize clients
-        self.supabase_client = None
-        self.r2_client = None
-        self.gemini_model = None
+        # Service clients are connected in the background, see initialize_services
+        self.services_ready = False
+        self.content_index = open_content_index()
+        self.metadata_cache = open_metadata_cache()
+        self.thumbnail_cache = ThumbnailCache(state_dir() / 'thumbnails')
+        self.derivative_generator = DerivativeGenerator()
+        
+        # Publish and AI work runs on the engine's loop; the UI only submits jobs and reads events
+        self.engine = Engine(max_workers=8, name='publisher').start()
+        self.jobs = PublisherJobs(self.clients, self.content_index, self.metadata_cache,
+                                  self.derivative_generator)
+        self._job_handlers = {}
+        
+        # Previews decode off the Tk thread; neighbours are prefetched one at a time
+        self._preview_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='preview')
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self._prefetch_futures = []
         
         # Application state
         self.selected_image_path = None
@@ -53,32 +581,25 @@ class WallpaperPublisher:
         # Setup UI
         self.setup_ui()
         
-        # Initialize services
+        # Initialize services without blocking the first paint
         self.initialize_services()
 
         # Check initial ready state
         self.check_ready_state()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(ENGINE_POLL_MS, self._poll_engine_events)
+        self.startup_seconds = None
+        self.root.after_idle(self._record_startup)
     
     def load_environment(self):
         """Load environment variables from .env.local file"""
-        env_path = Path(".env.local")
-        if env_path.exists():
-            load_dotenv(env_path)
-        else:
-            messagebox.showerror("Error", ".env.local file not found!")
+        try:
+            missing_vars = load_environment_file()
+        except FileNotFoundError as e:
+            messagebox.showerror("Error", str(e))
             sys.exit(1)
         
         # Validate required environment variables
-        required_vars = [
-            'NEXT_PUBLIC_SUPABASE_URL',
-            'NEXT_PUBLIC_SUPABASE_ANON_KEY',
-            'R2_ACCOUNT_ID',
-            'R2_ACCESS_KEY_ID',
-            'R2_SECRET_ACCESS_KEY',
-            'R2_BUCKET_NAME'
-        ]
-
-        missing_vars = [var for var in required_vars if not os.getenv(var)]
         if missing_vars:
             messagebox.showerror("Error", f"Missing environment variables: {', '.join(missing_vars)}")
             sys.exit(1)
@@ -127,6 +648,11 @@ class WallpaperPublisher:
         self.gemini_key_entry = ttk.Entry(ai_button_frame, width=30, show="*")
         self.gemini_key_entry.pack(side=tk.LEFT, padx=(0, 10))
         self.gemini_key_entry.bind('<KeyRelease>', self.on_api_key_change)
+        
+        # Bypass the metadata cache and ask the model again
+        self.force_regenerate_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(ai_button_frame, text="Ignore cache",
+                        variable=self.force_regenerate_var).pack(side=tk.LEFT)
 
         # Pre-populate Gemini API key if available in environment
         if hasattr(self, 'gemini_api_key') and self.gemini_api_key:
@@ -152,7 +678,7 @@ class WallpaperPublisher:
         ttk.Label(left_column, text="Category:").pack(anchor=tk.W)
         self.category_var = tk.StringVar()
         self.category_combo = ttk.Combobox(left_column, textvariable=self.category_var, 
-                                         values=["nature", "minimal", "abstract", "urban", "space", "art"])
+                                         values=CATEGORIES)
         self.category_combo.pack(fill=tk.X, pady=(0, 10))
         
         # Tags field
@@ -183,30 +709,98 @@ class WallpaperPublisher:
                                     command=self.publish_wallpaper, state=tk.DISABLED)
         self.publish_btn.pack(side=tk.RIGHT, padx=(10, 0))
         
+        self.cancel_btn = ttk.Button(button_frame, text="Cancel", command=self.cancel_jobs, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.RIGHT, padx=(10, 0))
+        
         ttk.Button(button_frame, text="Clear All", command=self.clear_all).pack(side=tk.RIGHT)
+        
+        # Upload a smaller, visually equivalent JPEG instead of the original bytes
+        self.reencode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(button_frame, text="Re-encode original (smaller file, same look)",
+                        variable=self.reencode_var).pack(side=tk.LEFT)
     
     def initialize_services(self):
-        """Initialize Supabase and R2 clients"""
+        """Connect to Supabase and R2 without blocking the first paint"""
+        self.update_status("Connecting to services...", "orange")
+        self.submit_job('connect', self.jobs.connect, self.gemini_key_entry.get().strip(),
+                        on_result=self._services_connected, on_error=self._services_failed)
+    
+    def _services_connected(self, _result=None):
+        """Enable publishing once the clients are ready"""
+        self.services_ready = True
+        self.update_status("Services initialized successfully", "green")
+        self.check_ready_state()
+    
+    def _services_failed(self, error_message: str):
+        """Report a failed background initialisation"""
+        self.update_status(f"Failed to initialize services: {error_message}", "red")
+        messagebox.showerror("Initialization Error", f"Failed to initialize services: {error_message}")
+    
+    def submit_job(self, name: str, job_function, *args, on_result=None, on_error=None, exclusive: bool = False):
+        """Run a job on the engine; its outcome is delivered to the handlers on the Tk thread"""
+        job = self.engine.submit(name, job_function, *args, exclusive=exclusive)
+        self._job_handlers[job.id] = (on_result, on_error)
+        return job
+    
+    def _poll_engine_events(self):
+        """Drain engine events on the Tk thread"""
         try:
-            # Initialize Supabase client
-            supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-            supabase_key = os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY')
-            self.supabase_client = create_client(supabase_url, supabase_key)
-            
-            # Initialize R2 client
-            self.r2_client = boto3.client(
-                's3',
-                endpoint_url=f"https://{os.getenv('R2_ACCOUNT_ID')}.r2.cloudflarestorage.com",
-                aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
-                aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
-                region_name='auto'
-            )
-            
-            self.update_status("Services initialized successfully", "green")
-            
-        except Exception as e:
-            self.update_status(f"Failed to initialize services: {str(e)}", "red")
-            messagebox.showerror("Initialization Error", f"Failed to initialize services: {str(e)}")
+            while True:
+                self._handle_engine_event(self.engine.events.get_nowait())
+        except queue.Empty:
+            pass
+        self.root.after(ENGINE_POLL_MS, self._poll_engine_events)
+    
+    def _handle_engine_event(self, event: EngineEvent):
+        """Reflect one job event in the progress bar, status line and handlers"""
+        if event.kind == STARTED:
+            if event.job_name not in BACKGROUND_JOBS:
+                self.progress_bar.start()
+        elif event.kind == STATUS:
+            self.update_status(event.message, "blue")
+        elif event.kind == PROGRESS:
+            self._show_progress(event.fraction, event.message)
+        else:
+            on_result, on_error = self._job_handlers.pop(event.job_id, (None, None))
+            self._reset_progress()
+            if event.kind == RESULT and on_result:
+                on_result(event.result)
+            elif event.kind == ERROR and on_error:
+                on_error(event.message)
+            elif event.kind == CANCELLED:
+                self.update_status(f"{event.job_name.capitalize()} cancelled", "orange")
+            self.check_ready_state()
+    
+    def _show_progress(self, fraction: float, message: str):
+        """Byte-accurate progress for the upload step"""
+        if str(self.progress_bar.cget('mode')) != 'determinate':
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', maximum=100)
+        self.progress_bar.config(value=fraction * 100)
+        self.update_status(message, "blue")
+    
+    def _reset_progress(self):
+        """Back to the spinner while other jobs still run, otherwise idle"""
+        self.progress_bar.stop()
+        self.progress_bar.config(mode='indeterminate', value=0)
+        if any(job.name not in BACKGROUND_JOBS for job in self.engine.running()):
+            self.progress_bar.start()
+    
+    def cancel_jobs(self):
+        """Cancel the running AI and publish jobs"""
+        for job in self.engine.running():
+            if job.name not in BACKGROUND_JOBS:
+                job.cancel()
+        self.update_status("Cancelling...", "orange")
+    
+    def on_close(self):
+        """Cancel outstanding work and close the window without waiting for it"""
+        self.engine.close(cancel=True, wait=False)
+        self.root.destroy()
+    
+    def _record_startup(self):
+        """Note how long it took for the window to become responsive"""
+        self.startup_seconds = time.perf_counter() - PROCESS_START
     
     def on_api_key_change(self, event=None):
         """Handle API key entry changes"""
@@ -235,27 +829,88 @@ class WallpaperPublisher:
             self.image_path_label.config(text=os.path.basename(file_path), foreground="black")
             self.show_preview()
             self.check_ready_state()
+            self._prefetch_folder(file_path)
+            self._suggest_category(file_path)
+    
+    def _suggest_category(self, image_path: str):
+        """Prefill category and tags from the local classifier, without an AI request"""
+        self.submit_job('suggest', self.jobs.suggest_category, image_path,
+                        on_result=lambda prediction: self._apply_suggestion(image_path, prediction),
+                        on_error=lambda error_message: None)
+
+    def _apply_suggestion(self, image_path: str, prediction: Optional[Prediction]):
+        """Fill empty category and tag fields, unless the selection or the form has moved on"""
+        if prediction is None or image_path != self.selected_image_path or self.category_var.get().strip():
+            return
+        self.category_var.set(prediction.category)
+        if not self.tags_entry.get().strip():
+            self.tags_entry.insert(0, ', '.join(prediction.tags))
+        self.update_status(f"Category suggested locally: {prediction.describe()}. "
+                           "Generate with AI for a title and description", "green")
+        self.check_ready_state()
+
+    def load_thumbnail(self, image_path: str) -> Image.Image:
+        """Preview-sized image from the thumbnail cache, decoding at reduced size on a miss"""
+        image = self.thumbnail_cache.get(image_path, PREVIEW_BOX)
+        if image is None:
+            image = open_reduced(image_path, PREVIEW_BOX)
+            self.thumbnail_cache.put(image_path, PREVIEW_BOX, image)
+        return image
     
     def show_preview(self):
         """Display image preview"""
         if not self.selected_image_path:
             return
         
+        image_path = self.selected_image_path
+        self.preview_label.config(image="", text="Loading preview...")
+        self._preview_executor.submit(self._preview_thread, image_path)
+    
+    def _preview_thread(self, image_path: str):
+        """Build the preview thumbnail in a worker thread"""
         try:
-            # Open and resize image for preview
-            image = Image.open(self.selected_image_path)
-            
-            # Calculate preview size (max 300x200)
-            max_width, max_height = 300, 200
-            image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            
-            # Convert to PhotoImage
-            self.preview_image = ImageTk.PhotoImage(image)
-            self.preview_label.config(image=self.preview_image, text="")
-            
+            image = self.load_thumbnail(image_path)
+            self.root.after(0, lambda: self._set_preview(image_path, image))
         except Exception as e:
-            self.preview_label.config(image="", text=f"Preview error: {str(e)}")
-            messagebox.showerror("Preview Error", f"Could not preview image: {str(e)}")
+            error_message = str(e)
+            self.root.after(0, lambda: self._preview_error(image_path, error_message))
+    
+    def _set_preview(self, image_path: str, image: Image.Image):
+        """Show a finished thumbnail unless the selection has moved on"""
+        if image_path != self.selected_image_path:
+            return
+        from PIL import ImageTk
+        
+        # Convert to PhotoImage (must happen on the Tk thread)
+        self.preview_image = ImageTk.PhotoImage(image)
+        self.preview_label.config(image=self.preview_image, text="")
+    
+    def _preview_error(self, image_path: str, error_message: str):
+        """Handle preview failures for the current selection"""
+        if image_path != self.selected_image_path:
+            return
+        self.preview_label.config(image="", text=f"Preview error: {error_message}")
+        messagebox.showerror("Preview Error", f"Could not preview image: {error_message}")
+    
+    def _prefetch_folder(self, image_path: str):
+        """Warm the thumbnail cache for the other images next to the selection"""
+        folder = Path(image_path).parent
+        try:
+            neighbours = [str(path) for path in iter_image_files(folder) if str(path) != image_path]
+        except OSError:
+            return
+        # Drop prefetches queued for a previous folder
+        for future in self._prefetch_futures:
+            future.cancel()
+        self._prefetch_futures = [self._prefetch_executor.submit(self._prefetch_thumbnail, neighbour)
+                                  for neighbour in neighbours[:PREVIEW_PREFETCH_LIMIT]]
+    
+    def _prefetch_thumbnail(self, image_path: str):
+        try:
+            self.load_thumbnail(image_path)
+        except Exception:
+            # Unreadable neighbours only matter if the user selects them
+            pass
     
     def check_ready_state(self):
         """Check if all requirements are met for publishing"""
@@ -266,13 +921,18 @@ class WallpaperPublisher:
         else:
             self.generate_btn.config(state=tk.DISABLED)
         
-        # Check if ready to publish
-        if (self.selected_image_path and 
+        # Check if ready to publish; a second publish never overlaps the first
+        if (self.services_ready and
+            self.selected_image_path and 
             self.title_entry.get().strip() and 
-            self.category_var.get().strip()):
+            self.category_var.get().strip() and
+            not self.engine.running('publish')):
             self.publish_btn.config(state=tk.NORMAL)
         else:
             self.publish_btn.config(state=tk.DISABLED)
+        
+        cancellable = any(job.name not in BACKGROUND_JOBS for job in self.engine.running())
+        self.cancel_btn.config(state=tk.NORMAL if cancellable else tk.DISABLED)
     
     def update_status(self, message: str, color: str = "black"):
         """Update status label"""
@@ -290,59 +950,17 @@ class WallpaperPublisher:
             messagebox.showerror("Error", "Please enter your Gemini API key")
             return
         
-        # Run AI generation in a separate thread
-        threading.Thread(target=self._generate_metadata_thread, args=(api_key,), daemon=True).start()
-    
-    def _generate_metadata_thread(self, api_key: str):
-        """Generate metadata in a separate thread"""
+        force = self.force_regenerate_var.get()
         try:
-            self.root.after(0, lambda: self.progress_bar.start())
-            self.root.after(0, lambda: self.update_status("Generating metadata with AI...", "blue"))
-            
-            # Configure Gemini
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-2.0-flash-exp')
-            
-            # Prepare the image
-            image = Image.open(self.selected_image_path)
-            
-            # Create prompt for metadata generation
-            prompt = """
-            Analyze this wallpaper image and generate metadata for a wallpaper website. 
-            Provide your response in JSON format with the following fields:
-            
-            {
-                "title": "SEO-optimized title (max 60 characters)",
-                "description": "Detailed description for SEO (max 160 characters)", 
-                "category": "one of: nature, minimal, abstract, urban, space, art",
-                "tags": ["tag1", "tag2", "tag3", "tag4", "tag5"]
-            }
-            
-            Make the title catchy and SEO-friendly. Include relevant keywords in the description.
-            Choose the most appropriate category. Provide 3-5 relevant tags.
-            """
-            
-            # Generate content
-            response = model.generate_content([prompt, image])
-            
-            # Parse JSON response
-            response_text = response.text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text[7:-3]
-            elif response_text.startswith('```'):
-                response_text = response_text[3:-3]
-            
-            metadata = json.loads(response_text)
-            
-            # Update UI in main thread
-            self.root.after(0, lambda: self._update_metadata_ui(metadata))
-            
-        except Exception as e:
-            self.root.after(0, lambda: self._handle_ai_error(str(e)))
-        finally:
-            self.root.after(0, lambda: self.progress_bar.stop())
+            self.submit_job('generate', self.jobs.generate_metadata, self.selected_image_path, api_key, force,
+                            on_result=lambda result: self._update_metadata_ui(*result),
+                            on_error=self._handle_ai_error, exclusive=True)
+        except EngineBusy:
+            self.update_status("Metadata generation is already running", "orange")
+            return
+        self.check_ready_state()
     
-    def _update_metadata_ui(self, metadata: Dict):
+    def _update_metadata_ui(self, metadata: Dict, from_cache: bool = False):
         """Update UI with generated metadata"""
         try:
             self.title_entry.delete(0, tk.END)
@@ -358,7 +976,10 @@ class WallpaperPublisher:
             self.description_text.insert(1.0, metadata.get('description', ''))
             
             self.generated_metadata = metadata
-            self.update_status("Metadata generated successfully!", "green")
+            if from_cache:
+                self.update_status("Metadata loaded from cache (tick 'Ignore cache' to regenerate)", "green")
+            else:
+                self.update_status("Metadata generated successfully!", "green")
             self.check_ready_state()
             
         except Exception as e:
@@ -369,13 +990,27 @@ class WallpaperPublisher:
         self.update_status(f"AI generation failed: {error_message}", "red")
         messagebox.showerror("AI Error", f"Failed to generate metadata: {error_message}")
     
-    def publish_wallpaper(self):
+    def publish_wallpaper(self, allow_near_duplicate: bool = False):
         """Publish wallpaper to R2 and Supabase"""
         if not self.validate_form():
             return
         
-        # Run publishing in a separate thread
-        threading.Thread(target=self._publish_wallpaper_thread, daemon=True).start()
+        request = PublishRequest(
+            self.selected_image_path,
+            self.title_entry.get().strip(),
+            self.description_text.get(1.0, tk.END).strip(),
+            self.category_var.get().strip(),
+            [tag.strip() for tag in self.tags_entry.get().split(',') if tag.strip()],
+            reencode=self.reencode_var.get(),
+            allow_near_duplicate=allow_near_duplicate
+        )
+        try:
+            self.submit_job('publish', self.jobs.publish, request,
+                            on_result=self._publish_finished, on_error=self._publish_error, exclusive=True)
+        except EngineBusy:
+            messagebox.showinfo("Publishing", "A wallpaper is already being published")
+            return
+        self.check_ready_state()
     
     def validate_form(self) -> bool:
         """Validate form data before publishing"""
@@ -393,62 +1028,36 @@ class WallpaperPublisher:
         
         return True
     
-    def _publish_wallpaper_thread(self):
-        """Publish wallpaper in a separate thread"""
-        try:
-            self.root.after(0, lambda: self.progress_bar.start())
-            self.root.after(0, lambda: self.update_status("Uploading to R2...", "blue"))
-            
-            # Generate unique filename
-            file_extension = Path(self.selected_image_path).suffix
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            
-            # Upload to R2
-            bucket_name = os.getenv('R2_BUCKET_NAME')
-            
-            with open(self.selected_image_path, 'rb') as file:
-                self.r2_client.upload_fileobj(
-                    file,
-                    bucket_name,
-                    unique_filename,
-                    ExtraArgs={'ContentType': f'image/{file_extension[1:]}'}
-                )
-            
-            # Construct public URL
-            public_url = f"{os.getenv('R2_PUBLIC_URL')}/{unique_filename}"
-            
-            self.root.after(0, lambda: self.update_status("Saving to database...", "blue"))
-            
-            # Prepare data for Supabase
-            tags = [tag.strip() for tag in self.tags_entry.get().split(',') if tag.strip()]
-            
-            wallpaper_data = {
-                'title': self.title_entry.get().strip(),
-                'description': self.description_text.get(1.0, tk.END).strip(),
-                'category': self.category_var.get().strip(),
-                'tags': tags,
-                'image_url': public_url
-            }
-            
-            # Insert into Supabase
-            result = self.supabase_client.table('wallpapers').insert(wallpaper_data).execute()
-            
-            if result.data:
-                self.root.after(0, lambda: self._publish_success(public_url))
-            else:
-                raise Exception("Failed to insert into database")
-                
-        except Exception as e:
-            self.root.after(0, lambda: self._publish_error(str(e)))
-        finally:
-            self.root.after(0, lambda: self.progress_bar.stop())
+    def _publish_finished(self, result: Dict):
+        """Route a finished publish job to the matching message"""
+        if result['duplicate']:
+            self._publish_duplicate(result['public_url'])
+        elif result['near_duplicate']:
+            self._confirm_near_duplicate(result['near_duplicate'])
+        else:
+            self._publish_success(result['public_url'], result['reencoded'])
     
-    def _publish_success(self, public_url: str):
+    def _publish_success(self, public_url: str, reencoded: Optional[str] = None):
         """Handle successful publishing"""
         self.update_status("Wallpaper published successfully!", "green")
-        messagebox.showinfo("Success", f"Wallpaper published successfully!\nURL: {public_url}")
+        details = f"\nRe-encoded: {reencoded}" if reencoded else ""
+        messagebox.showinfo("Success", f"Wallpaper published successfully!\nURL: {public_url}{details}")
         self.clear_all()
     
+    def _publish_duplicate(self, public_url: str):
+        """Handle a file whose content is already published"""
+        self.update_status("Already published - nothing uploaded", "green")
+        messagebox.showinfo("Already Published", f"This image is already published.\nURL: {public_url}")
+    
+    def _confirm_near_duplicate(self, match: NearDuplicate):
+        """Ask before publishing an image that looks like one already on the site"""
+        self.update_status("Looks like a published wallpaper - nothing uploaded", "orange")
+        if messagebox.askyesno(
+                "Possible Duplicate",
+                f"This image looks like a wallpaper that is already published:\n{match.describe()}\n\n"
+                "Publish it anyway?"):
+            self.publish_wallpaper(allow_near_duplicate=True)
+
     def _publish_error(self, error_message: str):
         """Handle publishing errors"""
         self.update_status(f"Publishing failed: {error_message}", "red")
@@ -473,8 +1082,837 @@ class WallpaperPublisher:
     
     def run(self):
         """Start the application"""
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.engine.close(cancel=True, wait=False)
 
-if __name__ == "__main__":
-    app = WallpaperPublisher()
+
+@dataclass
+class BatchItem:
+    """A single image moving through the headless publishing pipeline"""
+    path: Path
+    size: int
+    sha256: Optional[str] = None
+    ai_payload: Optional[Dict] = None
+    color_palette: Optional[List[str]] = None
+    metadata: Optional[Dict] = None
+    public_url: Optional[str] = None
+    derivatives: Optional[Dict] = None
+    encoded: Optional[EncodeResult] = None
+    header: Optional[ScanRecord] = None
+    stored_size: Optional[int] = None
+    perceptual_hash: Optional[int] = None
+    record: Optional[Dict] = None
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+
+def iter_image_files(directory: Path, recursive: bool = False) -> Iterator[Path]:
+    """Yield supported image files in a directory in a stable order"""
+    candidates = directory.rglob('*') if recursive else directory.iterdir()
+    for path in sorted(candidates):
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+            yield path
+
+
+class BatchPublisher:
+    """Headless publisher that runs decode, AI metadata, upload and insert as pipeline stages
+
+    Each stage records its result in the job journal, so a run that is
+    interrupted picks up every file at the stage after the last one it finished.
+    """
+
+    def __init__(self, supabase_client, r2_client, gemini_client: GeminiClient, content_index: ContentIndex,
+                 metadata_cache: MetadataCache, journal: JobJournal, args: argparse.Namespace):
+        self.supabase_client = supabase_client
+        self.r2_client = r2_client
+        self.gemini_client = gemini_client
+        self.content_index = content_index
+        self.metadata_cache = metadata_cache
+        self.journal = journal
+        self.args = args
+        self.transfer_config = transfer_config_from_env()
+        self.derivative_generator = None if args.no_derivatives else DerivativeGenerator(
+            workers=args.derive_workers)
+        self.reencoder = Reencoder(args.reencode, args.reencode_target) if args.reencode else None
+        # (file name, original bytes, stored bytes, description) for every original replaced by a re-encode
+        self.reencoded: List[Tuple[str, int, int, str]] = []
+        # Header scan results from --scan, reused while the file is unchanged
+        self.manifest: Dict[str, ScanRecord] = read_manifest(args.manifest) if args.manifest else {}
+        self.min_resolution = parse_min_resolution(args.min_resolution) if args.min_resolution else None
+        self.similarity = None if args.near_duplicates == 'off' else open_similarity_index(
+            args.near_duplicate_distance)
+        # (file name, closest published match) for every image that looks like one already published
+        self.near_duplicates: List[Tuple[str, NearDuplicate]] = []
+        self.classifier = CategoryModel.load(category_model_path()) if args.local_classifier else None
+        if args.local_classifier and self.classifier is None:
+            print("No local classifier has been trained yet (--train-classifier); every image goes to Gemini")
+        self.classified_locally = 0
+        self.writer: Optional[WallpaperWriter] = None
+        self.spans = SpanRecorder(args.metrics_jsonl)
+        self._total = 0
+        self._pipeline: Optional[Pipeline] = None
+        self._cancelled = threading.Event()
+        # Retries happen inside boto3's transfer threads, so they are counted per response
+        events = getattr(getattr(r2_client, 'meta', None), 'events', None)
+        if events is not None:
+            events.register('after-call.s3', self._count_r2_retries)
+
+    def cancel(self):
+        """Stop taking new images; the ones already in flight are finished and journalled"""
+        self._cancelled.set()
+        if self._pipeline is not None:
+            self._pipeline.cancel()
+
+    def _count_r2_retries(self, parsed=None, **kwargs):
+        retries = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        if retries:
+            self.spans.add_retries('upload', retries)
+
+    def build_pipeline(self) -> Pipeline:
+        """Create the stage chain with the configured worker pools"""
+        queue_size = self.args.queue_size
+        stages = [
+            Stage('hash', self.hash, self.args.decode_workers, queue_size),
+            Stage('decode', self.decode, self.args.decode_workers, queue_size),
+            Stage('analyze', self.analyze, self.args.ai_workers, queue_size),
+        ]
+        if self.reencoder:
+            stages.append(Stage('encode', self.encode, self.args.encode_workers, queue_size))
+        stages += [
+            Stage('upload', self.upload, self.args.upload_workers, queue_size),
+        ]
+        if self.derivative_generator:
+            # One thread per pool process keeps every encoder busy
+            stages.append(Stage('derive', self.derive, self.derivative_generator.workers, queue_size))
+        # Each insert worker waits for its row's batch, so filling the next batches while
+        # db_workers earlier ones are being flushed takes a batch of threads per flush worker
+        stages.append(Stage('insert', self.insert, self.args.db_batch_size * self.args.db_workers, queue_size))
+        return Pipeline(stages, on_progress=self._print_progress)
+
+    def hash(self, item: BatchItem) -> Optional[BatchItem]:
+        """Check the header, hash the file and skip it if that content is already published"""
+        item.header = self._read_header(item.path)
+        if item.header.error:
+            raise ValueError(f"Unreadable image: {item.header.error}")
+        if item.header.rejected:
+            raise ValueError(item.header.rejected)
+
+        if item.sha256 is None:
+            item.sha256 = self.content_index.hash_file(item.path)
+        existing = self.content_index.lookup(item.sha256)
+        if existing and existing.published:
+            self.journal.advance(item.path, 'inserted', sha256=item.sha256, wallpaper_id=existing.wallpaper_id)
+            return None
+        if existing:
+            item.stored_size = existing.size
+        if existing and not item.public_url:
+            item.public_url = existing.public_url
+        if item.metadata is None and not self.args.regenerate_metadata:
+            item.metadata = self.metadata_cache.get(metadata_key(item.sha256))
+        self.journal.advance(item.path, 'hashed', sha256=item.sha256)
+        return item
+
+    def _read_header(self, path: Path) -> ScanRecord:
+        """The manifest's record while the file is unchanged, otherwise a fresh header read"""
+        record = self.manifest.get(os.path.abspath(path))
+        if record is None or not record.matches(os.stat(path)):
+            return read_header(path, self.min_resolution)
+        if self.min_resolution and record.width:
+            # The manifest may have been written with a different minimum, or none
+            record.rejected = below_minimum(record.width, record.height, self.min_resolution)
+        return record
+
+    def decode(self, item: BatchItem) -> Optional[BatchItem]:
+        """Decode once at reduced size for the AI payload, colour palette and perceptual hash
+
+        Corrupt files fail here, before any network work. Files resumed from
+        the journal with metadata already known are decoded at hash size.
+        An image close to a published one is reported, or skipped with
+        --near-duplicates skip.
+        """
+        # Cached metadata means the model never needs the pixels, only the palette and hash do
+        needs_payload = item.metadata is None
+        dimension = AI_MAX_DIMENSION if needs_payload else HASH_DECODE_DIMENSION
+        with self.spans.span('decode', item, bytes=item.size):
+            image = open_reduced(item.path, (dimension, dimension))
+            try:
+                if needs_payload and self.classifier is not None:
+                    prediction = self.classifier.predict_image(image)
+                    # Confident images skip Gemini entirely; the rest are escalated as usual
+                    if prediction.confident(self.args.classifier_confidence):
+                        item.metadata = metadata_from_prediction(prediction, item.path.name)
+                        self.classified_locally += 1
+                        needs_payload = False
+                if needs_payload:
+                    item.ai_payload = ai_payload_from_image(image)
+                if item.color_palette is None:
+                    item.color_palette = dominant_colors(image)
+                # Always hashed from a decode at HASH_DECODE_DIMENSION, so the hash never depends on the path
+                item.perceptual_hash = (perceptual_hash(image) if dimension == HASH_DECODE_DIMENSION
+                                        else perceptual_hash_file(item.path))
+            finally:
+                image.close()
+
+        # Uploaded by an earlier run means it was already checked then
+        if self.similarity is not None and not item.public_url:
+            match = self.similarity.nearest(item.perceptual_hash, content_hash=item.sha256)
+            if match:
+                self.near_duplicates.append((item.path.name, match))
+                if self.args.near_duplicates == 'skip':
+                    item.ai_payload = None
+                    return None
+        return item
+
+    def analyze(self, item: BatchItem) -> BatchItem:
+        """Generate metadata with the same Gemini call the UI uses, unless it was cached"""
+        if item.metadata is None:
+            item.metadata = self._generate_metadata(item)
+        self.journal.advance(item.path, 'analysed', metadata=item.metadata, color_palette=item.color_palette)
+        return item
+
+    def _generate_metadata(self, item: BatchItem) -> Dict:
+        try:
+            with self.spans.span('ai', item, bytes=len(item.ai_payload['data'])) as span:
+                try:
+                    metadata = generate_image_metadata(self.gemini_client, item.ai_payload)
+                finally:
+                    span.retries = self.gemini_client.last_retries
+        finally:
+            # Release the payload as soon as the model has seen it
+            item.ai_payload = None
+
+        if not str(metadata.get('title', '')).strip():
+            raise ValueError("AI response has no title")
+        if metadata.get('category') not in CATEGORIES:
+            raise ValueError(f"AI response has unknown category: {metadata.get('category')!r}")
+        self.metadata_cache.put(metadata_key(item.sha256), metadata)
+        return metadata
+
+    def encode(self, item: BatchItem) -> BatchItem:
+        """Search for a smaller, visually equivalent encode of the original; kept in memory until uploaded"""
+        if item.public_url:
+            return item
+        with self.spans.span('encode', item, bytes=item.size):
+            item.encoded = self.reencoder.encode(item.path)
+        if item.encoded:
+            self.reencoded.append((item.path.name, item.encoded.original_size, item.encoded.size,
+                                   item.encoded.describe()))
+        return item
+
+    def upload(self, item: BatchItem) -> BatchItem:
+        """Upload the original file, or its re-encode, to R2 unless an earlier run already did"""
+        if not item.public_url:
+            encoded, item.encoded = item.encoded, None
+            object_key = object_key_for(str(item.path), item.sha256, encoded and encoded.extension)
+            item.stored_size = encoded.size if encoded else item.size
+            with self.spans.span('upload', item, bytes=item.stored_size):
+                item.public_url = upload_wallpaper(self.r2_client, str(item.path),
+                                                   transfer_config=self.transfer_config, content_hash=item.sha256,
+                                                   encoded=encoded)
+            self.content_index.record_upload(item.sha256, object_key, item.public_url, item.stored_size)
+        else:
+            # Resumed: the key is whatever the earlier run stored, re-encoded or not
+            object_key = item.public_url.rsplit('/', 1)[-1]
+        self.journal.advance(item.path, 'uploaded', object_key=object_key, public_url=item.public_url)
+        return item
+
+    def derive(self, item: BatchItem) -> BatchItem:
+        """Render and upload the responsive derivatives"""
+        if item.derivatives is not None:
+            return item
+        with self.spans.span('derive', item) as span:
+            derivatives = self.derivative_generator.generate(item.path)
+            span.bytes = sum(len(derivative.data) for derivative in derivatives)
+            item.derivatives = upload_derivatives(self.r2_client, item.sha256, derivatives)
+        self.journal.advance(item.path, None, derivatives=item.derivatives)
+        return item
+
+    def insert(self, item: BatchItem) -> BatchItem:
+        """Insert the wallpaper row into Supabase"""
+        wallpaper_data = row_from_metadata(
+            item.metadata,
+            item.public_url,
+            content_hash=item.sha256,
+            color_palette=item.color_palette,
+            derivatives=item.derivatives,
+            resolution=item.header.resolution,
+            device_type=item.header.device_type,
+            file_size=item.stored_size or item.header.size,
+            perceptual_hash=format_hash(item.perceptual_hash)
+        )
+        # Blocks until the row's batch is stored; the stage runs one worker per batch slot per flush worker
+        with self.spans.span('insert', item, bytes=len(json.dumps(wallpaper_data))) as span:
+            future = self.writer.submit(wallpaper_data)
+            try:
+                item.record = future.result()
+            finally:
+                span.retries = future.retries
+        self.content_index.record_row(item.sha256, item.record['id'])
+        self.journal.advance(item.path, 'inserted', wallpaper_id=str(item.record['id']))
+        if self.similarity is not None:
+            # Later images in the same run are checked against this one too
+            self.similarity.add(item.perceptual_hash, str(item.record['id']), item.public_url)
+        return item
+
+    def _item_from_journal(self, path: Path, entry: JournalEntry) -> BatchItem:
+        """Rebuild a pipeline item from whatever an earlier run recorded"""
+        return BatchItem(
+            path,
+            entry.size,
+            sha256=entry.sha256,
+            color_palette=entry.color_palette,
+            metadata=None if self.args.regenerate_metadata else entry.metadata,
+            public_url=entry.public_url,
+            derivatives=entry.derivatives
+        )
+
+    def run(self, directory: Path) -> int:
+        """Publish every image in a directory and print a throughput summary"""
+        paths = list(iter_image_files(directory, self.args.recursive))
+        if not paths:
+            print(f"No images found in {directory}")
+            return 0
+
+        items = []
+        finished = resumed = 0
+        for path in paths:
+            entry = self.journal.begin(path)
+            if entry.reached('inserted'):
+                finished += 1
+                continue
+            resumed += entry.reached('hashed')
+            items.append(self._item_from_journal(path, entry))
+
+        if finished or resumed:
+            print(f"Resuming: {finished} images finished by an earlier run, {resumed} partly done")
+        if not items:
+            print(f"Nothing left to publish in {directory}")
+            return 0
+        self._total = len(items)
+        print(f"Publishing {len(items)} images from {directory}")
+        return self._run_pipeline(items)
+
+    def sync(self, plan: SyncPlan) -> int:
+        """Publish the delta of a sync: new content is uploaded and inserted, stored content only inserted"""
+        items = []
+        for local in plan.upload:
+            # Whatever the index remembers, the listing shows the bucket has no copy
+            self.content_index.forget(local.sha256)
+            items.append(self._sync_item(local, reuse_derivatives=False))
+        for local, stored in plan.insert:
+            # Stored but without a row, so the hash stage must not treat it as published
+            self.content_index.forget(local.sha256)
+            self.content_index.record_upload(local.sha256, stored.key, public_url_for(stored.key), stored.size)
+            items.append(self._sync_item(local, reuse_derivatives=True))
+        self._total = len(items)
+        print(f"Syncing {len(plan.upload)} images to upload and {len(plan.insert)} to insert")
+        return self._run_pipeline(items)
+
+    def _sync_item(self, local: LocalFile, reuse_derivatives: bool) -> BatchItem:
+        """A pipeline item for a sync; metadata and derivatives an earlier run recorded for the content are reused
+
+        Derivatives are only reused for content whose original is still
+        stored; an original missing from the bucket means its derivatives
+        may be gone too, so they are rendered and uploaded again.
+        """
+        entry = self.journal.begin(local.path)
+        item = BatchItem(Path(local.path), local.size, sha256=local.sha256)
+        if entry.sha256 == local.sha256:
+            item.color_palette = entry.color_palette
+            if reuse_derivatives:
+                item.derivatives = entry.derivatives
+            if not self.args.regenerate_metadata:
+                item.metadata = entry.metadata
+        return item
+
+    def watch(self, watcher: FolderWatcher) -> int:
+        """Publish images as they land in the watched directory until the watcher is stopped"""
+        watcher.start()
+        print(f"Watching {watcher.directory} ({watcher.backend}); files are published "
+              f"{watcher.settle_seconds:g}s after they stop changing. Press Ctrl-C to stop")
+        return self._run_pipeline(self._watched_items(watcher))
+
+    def _watched_items(self, watcher: FolderWatcher) -> Iterator[BatchItem]:
+        """Turn settled files into pipeline items; the pipeline's bounded queues pace this generator"""
+        for path in watcher:
+            try:
+                entry = self.journal.begin(path)
+            except OSError as e:
+                # Removed or renamed between settling and being picked up
+                print(f"\n  ! {path}: {e}")
+                continue
+            if not entry.reached('inserted'):
+                yield self._item_from_journal(path, entry)
+
+    def _run_pipeline(self, items: Iterable[BatchItem]) -> int:
+        """Push items through the stages, then print the run summary"""
+        if self.similarity is not None and not len(self.similarity):
+            print("The near-duplicate index is empty; run --rebuild-similarity-index to check new images "
+                  "against wallpapers already published")
+        self.writer = WallpaperWriter(self.supabase_client, batch_size=self.args.db_batch_size,
+                                      flush_interval=self.args.db_flush_interval, workers=self.args.db_workers)
+        self._pipeline = self.build_pipeline()
+        if self._cancelled.is_set():
+            self._pipeline.cancel()
+        try:
+            result = self._pipeline.run(items)
+        finally:
+            self.writer.close()
+            if self.derivative_generator:
+                self.derivative_generator.close()
+            if self.similarity is not None:
+                self.similarity.save(similarity_index_path())
+
+            self.spans.close()
+
+        for failure in result.failures:
+            self.journal.record_error(failure.item.path, f"{failure.stage}: {failure.error}")
+
+        print()
+        print(format_summary(result, sum(item.size for item in result.completed), label="images"))
+        stats = self.gemini_client.stats
+        print(f"  Supabase: {self.writer.batches_sent} batched upserts, {len(self.writer.failed_rows)} rows rejected")
+        for failed in self.writer.failed_rows:
+            print(f"    ! {failed.row.get('image_url')}: {failed.error}")
+        print(f"  Gemini: {stats.requests} requests, {stats.retries} retries, {stats.failures} failed, "
+              f"{stats.throttled_seconds:.1f}s waiting for quota")
+        if self.classifier is not None:
+            print(f"  Local classifier: {self.classified_locally} images categorised without Gemini "
+                  f"(confidence >= {self.args.classifier_confidence:.0%})")
+        if self.reencoder:
+            print(self._format_reencode_summary(len(result.completed)))
+        if self.near_duplicates:
+            print(self._format_near_duplicate_summary())
+        print(self.spans.format_summary())
+        if self.args.metrics_jsonl:
+            print(f"  Spans written to {self.args.metrics_jsonl}")
+        if self.args.metrics_prom:
+            self.spans.write_prometheus(self.args.metrics_prom)
+            print(f"  Prometheus metrics written to {self.args.metrics_prom}")
+        return 1 if result.failures else 0
+
+    def _format_reencode_summary(self, published: int) -> str:
+        """Savings from re-encoding, overall and per image"""
+        original = sum(entry[1] for entry in self.reencoded)
+        stored = sum(entry[2] for entry in self.reencoded)
+        saved = (original - stored) / original if original else 0.0
+        lines = [f"  Re-encode: {len(self.reencoded)} of {published} originals replaced, "
+                 f"{original / (1024 * 1024):.1f} MB -> {stored / (1024 * 1024):.1f} MB ({saved:.0%} smaller); "
+                 "the rest were uploaded unchanged"]
+        for name, _, _, description in self.reencoded:
+            lines.append(f"    {name}: {description}")
+        return "\n".join(lines)
+
+    def _format_near_duplicate_summary(self) -> str:
+        action = 'skipped' if self.args.near_duplicates == 'skip' else 'published anyway'
+        lines = [f"  Near-duplicates: {len(self.near_duplicates)} images look like published wallpapers ({action})"]
+        for name, match in self.near_duplicates:
+            lines.append(f"    {name}: {match.describe()}")
+        return "\n".join(lines)
+
+    def _print_progress(self, result):
+        finished = len(result.completed) + len(result.skipped) + len(result.failures)
+        # Watch mode has no total
+        total = f"/{self._total}" if self._total else ''
+        print(f"\r  {finished}{total} done, {len(result.skipped)} already published, "
+              f"{len(result.failures)} failed", end='', flush=True)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """Command line options for the GUI and headless modes"""
+    cpu_count = os.cpu_count() or 2
+    parser = argparse.ArgumentParser(description="Wallpaper Publisher")
+    parser.add_argument('--batch', metavar='DIR', type=Path,
+                        help="publish every image in DIR without opening the GUI")
+    parser.add_argument('--watch', metavar='DIR', type=Path,
+                        help="keep running and publish images as they are added to DIR")
+    parser.add_argument('--sync', metavar='DIR', type=Path,
+                        help="mirror DIR to the bucket and wallpapers table, publishing only what is missing")
+    parser.add_argument('--sync-workers', type=int, default=DEFAULT_SYNC_WORKERS,
+                        help="parallel bucket listings, row pages and file hashes while comparing for --sync")
+    parser.add_argument('--scan', metavar='DIR', type=Path,
+                        help="read the header of every image in DIR and write a manifest, without publishing")
+    parser.add_argument('--manifest', metavar='PATH', type=Path, default=None,
+                        help="manifest written by --scan (default .wallpaper_publisher/manifest.jsonl), "
+                             "or read by --batch and --watch")
+    parser.add_argument('--min-resolution', metavar='WxH', default=None,
+                        help="reject images smaller than this in either orientation, e.g. 1920x1080")
+    parser.add_argument('--scan-workers', type=int, default=DEFAULT_SCAN_WORKERS,
+                        help="threads reading image headers")
+    parser.add_argument('--settle-seconds', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="watch mode: how long a file must stop changing before it is published")
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="watch mode: seconds between scans when polling")
+    parser.add_argument('--force-polling', action='store_true',
+                        help="watch mode: scan instead of using inotify (for network shares)")
+    parser.add_argument('--startup-check', action='store_true',
+                        help="open the window, print how long it took to become responsive, and exit")
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help="repopulate the local dedupe index from the R2 bucket and wallpapers table")
+    parser.add_argument('--rebuild-similarity-index', action='store_true',
+                        help="rebuild the near-duplicate index from the wallpapers table")
+    parser.add_argument('--near-duplicates', choices=('warn', 'skip', 'off'), default='warn',
+                        help="what to do with images that look like a published wallpaper (default warn)")
+    parser.add_argument('--near-duplicate-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="perceptual hash bits (of 64) that may differ for two images to count as the same")
+    parser.add_argument('--train-classifier', action='store_true',
+                        help="train the local category classifier from the published wallpapers")
+    parser.add_argument('--local-classifier', action='store_true',
+                        help="categorise and tag images locally when confident, and ask Gemini only for the rest")
+    parser.add_argument('--classifier-confidence', type=float, default=DEFAULT_CONFIDENCE,
+                        help="share of the neighbours' vote needed to skip Gemini (default 0.8)")
+    parser.add_argument('--backfill', action='store_true',
+                        help="fill resolution, device_type, file_size and color_palette on rows published without them")
+    parser.add_argument('--backfill-workers', type=int, default=DEFAULT_BACKFILL_WORKERS,
+                        help="concurrent R2 reads while backfilling")
+    parser.add_argument('--backfill-palettes-from-originals', action='store_true',
+                        help="with --backfill, download whole originals for rows without a derivative to take "
+                             "colours from")
+    parser.add_argument('--reconcile', action='store_true',
+                        help="link or report R2 originals left without a wallpapers row by an interrupted run")
+    parser.add_argument('--delete-orphans', action='store_true',
+                        help="with --reconcile, delete orphaned objects that cannot be linked")
+    parser.add_argument('--recursive', action='store_true', help="include images in subdirectories")
+    parser.add_argument('--gemini-key', default=None, help="Gemini API key (defaults to GEMINI_API_KEY)")
+    parser.add_argument('--regenerate-metadata', action='store_true',
+                        help="ignore cached AI metadata and ask Gemini again")
+    parser.add_argument('--decode-workers', type=int, default=min(4, cpu_count), help="image decode workers")
+    parser.add_argument('--ai-workers', type=int, default=4, help="concurrent Gemini requests")
+    parser.add_argument('--gemini-rpm', type=float, default=None,
+                        help="Gemini requests-per-minute quota (defaults to GEMINI_RPM or 10)")
+    parser.add_argument('--upload-workers', type=int, default=4, help="concurrent R2 uploads")
+    parser.add_argument('--db-workers', type=int, default=2, help="concurrent Supabase batch upserts")
+    parser.add_argument('--db-batch-size', type=int, default=50, help="rows per Supabase upsert")
+    parser.add_argument('--db-flush-interval', type=float, default=1.0,
+                        help="seconds a partial batch waits before it is sent")
+    parser.add_argument('--derive-workers', type=int, default=cpu_count,
+                        help="processes encoding responsive derivatives")
+    parser.add_argument('--no-derivatives', action='store_true',
+                        help="upload originals only, without pre-rendered WebP/AVIF/JPEG sizes")
+    parser.add_argument('--reencode', nargs='?', const='jpeg', choices=REENCODE_FORMATS, default=None,
+                        help="replace originals with the smallest visually equivalent progressive JPEG "
+                             "(default) or WebP")
+    parser.add_argument('--reencode-target', type=float, default=DEFAULT_TARGET_SIMILARITY,
+                        help="SSIM on downsampled luma a re-encode must reach")
+    parser.add_argument('--encode-workers', type=int, default=max(1, cpu_count // 2),
+                        help="threads searching re-encode quality")
+    parser.add_argument('--queue-size', type=int, default=8, help="items buffered between stages")
+    parser.add_argument('--metrics-jsonl', metavar='PATH', type=Path, default=None,
+                        help="append one JSON line per timed stage span to PATH")
+    parser.add_argument('--metrics-prom', metavar='PATH', type=Path, default=None,
+                        help="write stage percentiles and counters to PATH in Prometheus text format")
+    parser.add_argument('--no-prewarm', action='store_true',
+                        help="skip opening R2, Supabase and Gemini connections before the work starts")
+    parser.add_argument('--pool-stats', action='store_true',
+                        help="print connections opened and requests served per service pool at the end")
+    return parser
+
+
+def load_headless_environment() -> bool:
+    """Load .env.local for a command line mode, printing any problem"""
+    try:
+        missing_vars = load_environment_file()
+    except FileNotFoundError as e:
+        print(str(e))
+        return False
+    if missing_vars:
+        print(f"Missing environment variables: {', '.join(missing_vars)}")
+        return False
+    return True
+
+
+def run_rebuild_index(clients: ServiceClients) -> int:
+    """Entry point for --rebuild-index"""
+    if not load_headless_environment():
+        return 2
+
+    index = open_content_index()
+    try:
+        print(f"Rebuilding {index.db_path} from bucket {os.getenv('R2_BUCKET_NAME')}...")
+        stats = index.rebuild(clients.r2(), os.getenv('R2_BUCKET_NAME'),
+                              clients.supabase(), os.getenv('R2_PUBLIC_URL'))
+    finally:
+        index.close()
+
+    print(f"Indexed {stats.indexed} of {stats.objects} objects, {stats.linked_rows} linked to wallpapers rows")
+    if stats.skipped:
+        print(f"Skipped {stats.skipped} objects with no recorded content hash (uploaded before the index)")
+    return 0
+
+
+def run_rebuild_similarity_index(args: argparse.Namespace, clients: ServiceClients) -> int:
+    """Entry point for --rebuild-similarity-index"""
+    if not load_headless_environment():
+        return 2
+
+    path = similarity_index_path()
+    print(f"Rebuilding {path} from the wallpapers table...")
+    rows = iter_rows(clients.supabase(), columns='id,image_url,perceptual_hash,derivatives')
+    index, stats = rebuild_from_rows(rows, SimilarityIndex.load(path), max_distance=args.near_duplicate_distance)
+    index.save(path)
+
+    print(f"Indexed {len(index)} of {stats.rows} rows in {stats.seconds:.1f}s: {stats.from_column} from "
+          f"perceptual_hash, {stats.reused} unchanged since the last rebuild, {stats.fetched} hashed from their images")
+    if stats.failed:
+        print(f"Could not fetch {stats.failed} images; they are left out of the index")
+    return 0
+
+
+def run_train_classifier(args: argparse.Namespace, clients: ServiceClients) -> int:
+    """Entry point for --train-classifier"""
+    if not load_headless_environment():
+        return 2
+
+    path = category_model_path()
+    print(f"Training {path} from the wallpapers table...")
+    rows = iter_rows(clients.supabase(), columns='id,image_url,category,tags,derivatives')
+    model, stats = train_from_rows(rows, CATEGORIES, CategoryModel.load(path))
+    model.save(path)
+
+    print(f"Trained on {len(model)} of {stats.rows} rows in {stats.seconds:.1f}s: {stats.reused} unchanged since "
+          f"the last run, {stats.fetched} described from their images, {stats.skipped} without a known category")
+    if stats.failed:
+        print(f"Could not fetch {stats.failed} images; they are left out of the model")
+    coverage, accuracy = model.evaluate(args.classifier_confidence)
+    print(f"Leave-one-out at confidence {args.classifier_confidence:.0%}: {coverage:.0%} of images would be "
+          f"categorised locally, {accuracy:.0%} of those correctly")
+    return 0
+
+
+def run_backfill(args: argparse.Namespace, clients: ServiceClients) -> int:
+    """Entry point for --backfill"""
+    if not load_headless_environment():
+        return 2
+
+    prewarm_clients(args, clients, args.backfill_workers, args.db_workers)
+    supabase_client = clients.supabase()
+    # Updates are upserts on the primary key, batched like inserts
+    writer = WallpaperWriter(supabase_client, args.db_batch_size, args.db_flush_interval, args.db_workers,
+                             conflict_column='id')
+    stats = BackfillStats()
+    print(f"Backfilling the wallpapers table from bucket {os.getenv('R2_BUCKET_NAME')} "
+          f"with {args.backfill_workers} threads...")
+    try:
+        results = backfill(iter_rows(supabase_client, columns=ROW_COLUMNS), clients.r2(),
+                           os.getenv('R2_BUCKET_NAME'), os.getenv('R2_PUBLIC_URL'), args.backfill_workers,
+                           args.backfill_palettes_from_originals, stats)
+        for result in results:
+            if result.error:
+                print(f"  ! {result.row['image_url']}: {result.error}")
+            elif result.changed:
+                writer.submit(update_row(result.row, result))
+    finally:
+        writer.close()
+
+    print(stats.format_summary())
+    if stats.without_palette:
+        print(f"  {stats.without_palette} rows have no derivative to take colours from; "
+              f"--backfill-palettes-from-originals downloads their originals instead")
+    for failed in writer.failed_rows:
+        print(f"  ! Could not update {failed.row['image_url']}: {failed.error}")
+    return 1 if writer.failed_rows else 0
+
+
+def run_reconcile(args: argparse.Namespace, clients: ServiceClients) -> int:
+    """Entry point for --reconcile"""
+    if not load_headless_environment():
+        return 2
+
+    supabase_client = clients.supabase()
+
+    def insert_row(entry: JournalEntry) -> Dict:
+        # The local file may be gone by now; the header columns are only filled while it exists
+        header = read_header(entry.path)
+        columns = {} if header.error else {'resolution': header.resolution, 'device_type': header.device_type}
+        return insert_wallpaper(supabase_client, row_from_metadata(
+            entry.metadata, entry.public_url, content_hash=entry.sha256,
+            color_palette=entry.color_palette, derivatives=entry.derivatives, **columns))
+
+    journal = open_job_journal()
+    content_index = open_content_index()
+    try:
+        print(f"Reconciling bucket {os.getenv('R2_BUCKET_NAME')} with the wallpapers table...")
+        stats = reconcile(journal, content_index, clients.r2(), os.getenv('R2_BUCKET_NAME'),
+                          supabase_client, os.getenv('R2_PUBLIC_URL'), insert_row,
+                          delete_orphans=args.delete_orphans)
+    finally:
+        journal.close()
+        content_index.close()
+
+    print(f"Checked {stats.objects} originals: {stats.orphans} without a wallpapers row")
+    print(f"  Linked {stats.linked} from journaled metadata, deleted {stats.deleted}, "
+          f"left {stats.too_recent} uploaded within the last hour")
+    if stats.journal_updated:
+        print(f"  Marked {stats.journal_updated} journal entries inserted (row existed, not recorded)")
+    if stats.unlinked:
+        print(f"  {len(stats.unlinked)} orphans have no journaled metadata; rerun with --delete-orphans to remove:")
+        for key in stats.unlinked:
+            print(f"    {key}")
+    return 0
+
+
+def run_scan(args: argparse.Namespace) -> int:
+    """Entry point for --scan"""
+    if not args.scan.is_dir():
+        print(f"Not a directory: {args.scan}")
+        return 2
+    min_resolution = parse_min_resolution(args.min_resolution) if args.min_resolution else None
+    manifest_path = args.manifest or state_dir() / 'manifest.jsonl'
+
+    print(f"Scanning {args.scan} with {args.scan_workers} threads...")
+    records = scan(iter_image_files(args.scan, args.recursive), min_resolution, args.scan_workers)
+    stats = write_manifest(records, manifest_path)
+    print(stats.format_summary())
+    print(f"Manifest written to {manifest_path}; pass --manifest {manifest_path} to --batch to use it")
+    return 0
+
+
+def run_batch(args: argparse.Namespace, clients: ServiceClients) -> int:
+    """Entry point for --batch and --watch"""
+    directory = args.watch or args.batch
+    if not directory.is_dir():
+        print(f"Not a directory: {directory}")
+        return 2
+
+    if not load_headless_environment():
+        return 2
+
+    async def publish_directory(context: JobContext, publisher: BatchPublisher):
+        if args.watch:
+            watcher = FolderWatcher(args.watch, IMAGE_EXTENSIONS, args.recursive, args.settle_seconds,
+                                    args.poll_interval, args.force_polling)
+            context.job.on_cancel(watcher.stop)
+            return await context.run_to_completion(publisher.watch, watcher)
+        # Cancelling drains the pipeline, so the run is always awaited to its summary
+        return await context.run_to_completion(publisher.run, args.batch)
+
+    content_index = open_content_index()
+    try:
+        return run_publisher(args, clients, content_index, publish_directory)
+    finally:
+        content_index.close()
+
+
+def run_sync(args: argparse.Namespace, clients: ServiceClients) -> int:
+    """Entry point for --sync"""
+    if not args.sync.is_dir():
+        print(f"Not a directory: {args.sync}")
+        return 2
+
+    if not load_headless_environment():
+        return 2
+
+    content_index = open_content_index()
+    try:
+        # Gemini is only warmed once there is something to publish
+        prewarm_clients(args, clients, args.sync_workers, args.sync_workers)
+        print(f"Comparing {args.sync} with bucket {os.getenv('R2_BUCKET_NAME')} and the wallpapers table...")
+        plan = plan_sync(args.sync, IMAGE_EXTENSIONS, content_index, clients.r2(), os.getenv('R2_BUCKET_NAME'),
+                         clients.supabase(), os.getenv('R2_PUBLIC_URL'), args.recursive, args.sync_workers)
+        print(plan.format_summary())
+        if not plan.delta:
+            print("Nothing to publish")
+            return 0
+
+        async def publish_delta(context: JobContext, publisher: BatchPublisher):
+            return await context.run_to_completion(publisher.sync, plan)
+
+        return run_publisher(args, clients, content_index, publish_delta)
+    finally:
+        content_index.close()
+
+
+def prewarm_clients(args: argparse.Namespace, clients: ServiceClients, r2_connections: int,
+                    supabase_connections: int, api_key: Optional[str] = None):
+    """Open connections before a headless command starts its work, unless --no-prewarm"""
+    if args.no_prewarm:
+        return
+    report = clients.prewarm(os.getenv('R2_BUCKET_NAME'), r2_connections, supabase_connections, api_key)
+    print(report.format_summary())
+
+
+def run_publisher(args: argparse.Namespace, clients: ServiceClients, content_index: ContentIndex, publish) -> int:
+    """Run publish(context, publisher) as a job; Ctrl-C stops it after the images already in flight"""
+    api_key = (args.gemini_key or os.getenv('GEMINI_API_KEY', '')).strip('"').strip()
+    if not api_key:
+        print("A Gemini API key is required to publish (--gemini-key or GEMINI_API_KEY)")
+        return 2
+    prewarm_clients(args, clients, args.upload_workers, args.db_workers, api_key)
+
+    metadata_cache = open_metadata_cache()
+    journal = open_job_journal()
+    publisher = BatchPublisher(
+        clients.supabase(),
+        clients.r2(),
+        create_gemini_client(api_key, args.gemini_rpm, args.ai_workers, clients.gemini_model),
+        content_index,
+        metadata_cache,
+        journal,
+        args
+    )
+
+    async def publish_job(context: JobContext):
+        context.job.on_cancel(publisher.cancel)
+        return await publish(context, publisher)
+
+    engine = Engine(max_workers=1, name='batch').start()
+    try:
+        job = engine.submit('batch', publish_job)
+        try:
+            return job.result()
+        except KeyboardInterrupt:
+            print("\nStopping after the images already in flight...")
+            job.cancel()
+            return job.result()
+    finally:
+        engine.close()
+        metadata_cache.close()
+        journal.close()
+
+
+def run_command(args: argparse.Namespace, clients: ServiceClients) -> Optional[int]:
+    """Run the headless command args select; None when the GUI should open instead"""
+    if args.rebuild_index:
+        return run_rebuild_index(clients)
+    if args.rebuild_similarity_index:
+        return run_rebuild_similarity_index(args, clients)
+    if args.train_classifier:
+        return run_train_classifier(args, clients)
+    if args.backfill:
+        return run_backfill(args, clients)
+    if args.reconcile:
+        return run_reconcile(args, clients)
+    if args.scan:
+        return run_scan(args)
+    if args.sync:
+        return run_sync(args, clients)
+    if args.batch or args.watch:
+        return run_batch(args, clients)
+    return None
+
+
+def main(argv: Optional[List[str]] = None, services: Optional[Services] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    services = services or Services()
+    clients = ServiceClients(services)
+    status = run_command(args, clients)
+    if status is not None:
+        if args.pool_stats:
+            print(clients.format_pool_stats() or "No connections were opened")
+        return status
+
+    app = WallpaperPublisher(services)
+    if args.startup_check:
+        def report_startup():
+            # Runs after _record_startup, which __init__ queued first
+            print(json.dumps({'startup_seconds': app.startup_seconds}), flush=True)
+            app.root.destroy()
+        app.root.after_idle(report_startup)
     app.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
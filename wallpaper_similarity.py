@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash near-duplicate index for the Wallpaper Publisher
+The same artwork at another resolution or compression level has a different
+SHA-256 but nearly the same 64-bit DCT hash (pHash), so images within a small
+Hamming distance of a published one are caught before they are uploaded
+"""
+
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from wallpaper_clients import http_client
+from wallpaper_imaging import open_reduced
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# pHash: the top-left 8x8 DCT coefficients of a 32x32 luma thumbnail
+HASH_BITS = 64
+DCT_SIZE = 32
+DCT_KEEP = 8
+# Images are decoded at about this size before hashing; JPEGs skip most of the decode
+HASH_DECODE_DIMENSION = 256
+
+# Bits that may differ for two images to count as the same artwork
+DEFAULT_MAX_DISTANCE = 8
+
+# Multi-index hashing: the hash is split into CHUNKS 16-bit substrings, one sorted table each
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+# Entries added since the tables were built are scanned directly until there are this many
+MERGE_THRESHOLD = 1024
+
+# Derivative formats Pillow can always decode, smallest first when rebuilding from rows
+REBUILD_FORMATS = ('jpeg', 'webp')
+DEFAULT_FETCH_WORKERS = 16
+FETCH_TIMEOUT_SECONDS = 30
+
+_dct_matrix = None
+_popcount_table = None
+_probe_masks: Dict[int, 'np.ndarray'] = {}
+
+
+def format_hash(value: int) -> str:
+    """Hash as the 16 hex digits stored in wallpapers.perceptual_hash"""
+    return f"{value:016x}"
+
+
+def parse_hash(text: str) -> int:
+    return int(text, 16)
+
+
+def _dct() -> 'np.ndarray':
+    """Orthonormal DCT-II matrix, so a 2D DCT is two matrix products"""
+    global _dct_matrix
+    if _dct_matrix is None:
+        # Imported on first use to keep it off the GUI's startup path
+        import numpy as np
+
+        n = np.arange(DCT_SIZE)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * DCT_SIZE)) * np.sqrt(2 / DCT_SIZE)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrix = matrix.astype(np.float32)
+    return _dct_matrix
+
+
+def hash_samples(samples: 'np.ndarray') -> 'np.ndarray':
+    """pHashes of a stack of 32x32 luma samples, shape (n, 32, 32), as uint64
+
+    Every step works on the whole stack: one batched DCT, one median per
+    row, and the 64 comparison bits packed into a big-endian word.
+    """
+    import numpy as np
+
+    matrix = _dct()
+    coefficients = matrix @ samples.astype(np.float32) @ matrix.T
+    low = coefficients[:, :DCT_KEEP, :DCT_KEEP].reshape(len(samples), -1)
+    # The DC term only reflects overall brightness, so it is left out of the median
+    medians = np.median(low[:, 1:], axis=1)
+    bits = np.packbits(low > medians[:, None], axis=1)
+    return bits.view('>u8').ravel().astype(np.uint64)
+
+
+def hash_sample(image: Image.Image) -> 'np.ndarray':
+    """32x32 float luma sample of an image, ready for hash_samples"""
+    import numpy as np
+
+    sample = image.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.Resampling.LANCZOS)
+    return np.asarray(sample, dtype=np.float32)
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """pHash of an already decoded (and ideally already reduced) image"""
+    return int(hash_samples(hash_sample(image)[None])[0])
+
+
+def perceptual_hash_file(path) -> int:
+    """pHash of an image file, decoded at reduced size"""
+    image = open_reduced(path, (HASH_DECODE_DIMENSION, HASH_DECODE_DIMENSION))
+    try:
+        return perceptual_hash(image)
+    finally:
+        image.close()
+
+
+def _popcount(values: 'np.ndarray') -> 'np.ndarray':
+    """Set bits of each uint64, via a byte lookup table (NumPy 1.x has no bitwise_count)"""
+    global _popcount_table
+    import numpy as np
+
+    if _popcount_table is None:
+        _popcount_table = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+    return _popcount_table[values.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.uint32)
+
+
+def _masks_within(radius: int) -> 'np.ndarray':
+    """Every 16-bit value with at most radius bits set: the probes around one chunk value"""
+    import numpy as np
+
+    if radius not in _probe_masks:
+        values = np.arange(1 << CHUNK_BITS, dtype=np.uint64)
+        _probe_masks[radius] = values[_popcount(values) <= radius].astype(np.uint16)
+    return _probe_masks[radius]
+
+
+@dataclass
+class NearDuplicate:
+    """A published wallpaper that an image is perceptually close to"""
+    wallpaper_id: Optional[str]
+    image_url: str
+    distance: int
+
+    def describe(self) -> str:
+        return f"{self.image_url} ({self.distance} of {HASH_BITS} bits differ)"
+
+    def is_content(self, content_hash: str) -> bool:
+        """True when the match is stored under this content's own key (<sha256><ext>)"""
+        return self.image_url.rsplit('/', 1)[-1].startswith(content_hash)
+
+
+@dataclass
+class SimilarityRebuildStats:
+    """Counters reported by rebuild_from_rows"""
+    rows: int = 0
+    from_column: int = 0
+    reused: int = 0
+    fetched: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+
+class SimilarityIndex:
+    """In-memory pHash index with sub-millisecond radius lookups
+
+    Multi-index hashing: each hash is cut into four 16-bit chunks and every
+    chunk position keeps the entries sorted by that chunk, with a table of
+    where each of the 65536 chunk values starts. Two hashes within distance d
+    agree to within d // 4 bits on at least one chunk, so a query reads the
+    few buckets around its own chunks and checks only those candidates,
+    instead of scanning the whole catalogue. Hashes added after the tables
+    were built sit in a short list that is scanned directly and merged in
+    once it reaches MERGE_THRESHOLD.
+    """
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        import numpy as np
+
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._ids: List[Optional[str]] = []
+        self._urls: List[str] = []
+        # Entry positions ordered by each chunk in turn, and where each chunk value's bucket starts
+        self._order = np.zeros(0, dtype=np.int32)
+        self._bucket_starts: Optional['np.ndarray'] = None
+        self._recent: List[Tuple[int, Optional[str], str]] = []
+
+    def __len__(self) -> int:
+        return len(self._hashes) + len(self._recent)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Tuple[int, Optional[str], str]],
+                     max_distance: int = DEFAULT_MAX_DISTANCE) -> 'SimilarityIndex':
+        """Build from (hash, wallpaper_id, image_url) tuples"""
+        index = cls(max_distance)
+        index._recent = list(entries)
+        index._merge()
+        return index
+
+    def add(self, value: int, wallpaper_id: Optional[str], image_url: str):
+        with self._lock:
+            self._recent.append((int(value), wallpaper_id, image_url))
+            if len(self._recent) >= MERGE_THRESHOLD:
+                self._merge()
+
+    def _merge(self):
+        """Fold the recent entries into the sorted chunk tables"""
+        import numpy as np
+
+        if self._recent:
+            self._hashes = np.concatenate([self._hashes,
+                                           np.array([value for value, _, _ in self._recent], dtype=np.uint64)])
+            self._ids += [wallpaper_id for _, wallpaper_id, _ in self._recent]
+            self._urls += [url for _, _, url in self._recent]
+            self._recent = []
+        count = len(self._hashes)
+        orders = []
+        starts = np.empty((CHUNKS, (1 << CHUNK_BITS) + 1), dtype=np.int64)
+        for chunk in range(CHUNKS):
+            values = ((self._hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+            orders.append(np.argsort(values, kind='stable').astype(np.int32))
+            starts[chunk, 0] = chunk * count
+            np.cumsum(np.bincount(values, minlength=1 << CHUNK_BITS), out=starts[chunk, 1:])
+            starts[chunk, 1:] += chunk * count
+        self._order = np.concatenate(orders) if orders else self._order
+        self._bucket_starts = starts if count else None
+
+    def matches(self, value: int, max_distance: Optional[int] = None) -> List[NearDuplicate]:
+        """Every entry within max_distance bits of value, closest first"""
+        import numpy as np
+
+        max_distance = self.max_distance if max_distance is None else max_distance
+        query = np.uint64(value)
+        with self._lock:
+            found = []
+            if self._bucket_starts is not None:
+                candidates = self._candidates(int(value), max_distance // CHUNKS)
+                distances = _popcount(self._hashes[candidates] ^ query)
+                close = distances <= max_distance
+                # An entry close on several chunks is a candidate more than once
+                found = [NearDuplicate(self._ids[position], self._urls[position], int(distance))
+                         for position, distance in dict(zip(candidates[close].tolist(),
+                                                            distances[close].tolist())).items()]
+            for recent, wallpaper_id, url in self._recent:
+                distance = bin(recent ^ int(value)).count('1')
+                if distance <= max_distance:
+                    found.append(NearDuplicate(wallpaper_id, url, distance))
+        return sorted(found, key=lambda match: match.distance)
+
+    def nearest(self, value: int, max_distance: Optional[int] = None,
+                content_hash: Optional[str] = None) -> Optional[NearDuplicate]:
+        """Closest entry within max_distance; the entry of content_hash's own earlier upload is not a match"""
+        for match in self.matches(value, max_distance):
+            if content_hash is None or not match.is_content(content_hash):
+                return match
+        return None
+
+    def _candidates(self, value: int, radius: int) -> 'np.ndarray':
+        """Positions sharing at least one chunk, to within radius bits, with value; may repeat"""
+        import numpy as np
+
+        chunks = np.array([(value >> (chunk * CHUNK_BITS)) & 0xFFFF for chunk in range(CHUNKS)], dtype=np.int64)
+        # Every chunk value within radius bits of the query's, for all chunk positions at once
+        probes = (chunks[:, None] ^ _masks_within(radius)[None, :].astype(np.int64))
+        rows = np.arange(CHUNKS)[:, None]
+        starts = self._bucket_starts[rows, probes].ravel()
+        counts = self._bucket_starts[rows, probes + 1].ravel() - starts
+        hit = counts > 0
+        starts, counts = starts[hit], counts[hit]
+        # Expand each [start, start + count) range without a Python loop
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self._order[np.repeat(starts, counts) + offsets]
+
+    def entries(self) -> Dict[str, Tuple[int, str]]:
+        """wallpaper_id -> (hash, image_url) for every entry with a row"""
+        with self._lock:
+            pairs = [(int(value), wallpaper_id, url)
+                     for value, wallpaper_id, url in zip(self._hashes, self._ids, self._urls)] + self._recent
+        return {wallpaper_id: (value, url) for value, wallpaper_id, url in pairs if wallpaper_id}
+
+    def save(self, path: Path):
+        """Write the index as a compressed .npz, replacing the file once complete"""
+        import numpy as np
+
+        with self._lock:
+            self._merge()
+            hashes, ids, urls = self._hashes.copy(), list(self._ids), list(self._urls)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{path.name}.tmp.npz")
+        np.savez_compressed(temporary, hashes=hashes,
+                            ids=np.array([wallpaper_id or '' for wallpaper_id in ids], dtype=str),
+                            urls=np.array(urls, dtype=str))
+        temporary.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, max_distance: int = DEFAULT_MAX_DISTANCE) -> 'SimilarityIndex':
+        """Read an index written by save; a missing file gives an empty index"""
+        import numpy as np
+
+        if not path.exists():
+            return cls(max_distance)
+        with np.load(path) as data:
+            return cls.from_entries(zip(data['hashes'].tolist(), [wallpaper_id or None for wallpaper_id in
+                                                                  data['ids'].tolist()], data['urls'].tolist()),
+                                    max_distance)
+
+
+def smallest_image_url(row: Dict) -> str:
+    """The smallest decodable derivative of a row, falling back to the original"""
+    derivatives = row.get('derivatives') or {}
+    for image_format in REBUILD_FORMATS:
+        sizes = derivatives.get(image_format) or {}
+        if sizes:
+            return sizes[min(sizes, key=int)]
+    return row['image_url']
+
+
+def fetch_image(url: str, max_dimension: int) -> Image.Image:
+    """Download an image over the shared keep-alive pool and decode it at roughly max_dimension"""
+    response = http_client().get(url, timeout=FETCH_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    with Image.open(io.BytesIO(response.content)) as image:
+        image.draft('RGB', (max_dimension, max_dimension))
+        image.thumbnail((max_dimension, max_dimension))
+        return image.convert('RGB')
+
+
+def _fetch_hash(url: str) -> int:
+    return perceptual_hash(fetch_image(url, HASH_DECODE_DIMENSION))
+
+
+def rebuild_from_rows(rows: Iterable[Dict], previous: Optional[SimilarityIndex] = None,
+                      fetch_workers: int = DEFAULT_FETCH_WORKERS, fetch=_fetch_hash,
+                      max_distance: int = DEFAULT_MAX_DISTANCE) -> Tuple[SimilarityIndex, SimilarityRebuildStats]:
+    """Build an index from wallpapers rows (id, image_url, perceptual_hash, derivatives)
+
+    Rows carrying perceptual_hash are used as they are, and rows already in
+    previous with the same image_url are reused. The rest are hashed from
+    their smallest derivative, fetched on a thread pool.
+    """
+    started = time.perf_counter()
+    stats = SimilarityRebuildStats()
+    known = previous.entries() if previous else {}
+    entries = []
+    missing = []
+    for row in rows:
+        stats.rows += 1
+        wallpaper_id = str(row['id'])
+        if row.get('perceptual_hash'):
+            entries.append((parse_hash(row['perceptual_hash']), wallpaper_id, row['image_url']))
+            stats.from_column += 1
+        elif known.get(wallpaper_id, (None, None))[1] == row['image_url']:
+            entries.append((known[wallpaper_id][0], wallpaper_id, row['image_url']))
+            stats.reused += 1
+        else:
+            missing.append(row)
+
+    def hash_row(row: Dict) -> Tuple[Dict, Optional[int]]:
+        try:
+            return row, fetch(smallest_image_url(row))
+        except Exception as e:
+            print(f"  ! {row['image_url']}: {e}")
+            return row, None
+
+    with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix='phash') as executor:
+        for row, value in executor.map(hash_row, missing):
+            if value is None:
+                stats.failed += 1
+            else:
+                entries.append((value, str(row['id']), row['image_url']))
+                stats.fetched += 1
+
+    stats.seconds = time.perf_counter() - started
+    return SimilarityIndex.from_entries(entries, max_distance), stats
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Incremental directory-to-bucket sync for the Wallpaper Publisher
+Diffs a local master folder against a parallel listing of the R2 bucket and
+the wallpapers table, so a sync only hashes files that changed since the last
+run and only uploads or inserts the images that are actually missing
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from wallpaper_backfill import object_key_for_url
+from wallpaper_index import CONTENT_KEY_RE, ContentIndex, iter_rows
+
+DEFAULT_SYNC_WORKERS = 16
+# The listing is split into ranges that end at these keys and listed in parallel;
+# content keys start with a hex digit, so each range holds about a sixteenth of them
+LIST_BOUNDARIES = tuple('123456789abcdef')
+# Bucket-only originals and broken rows listed individually in the summary
+MAX_LISTED = 20
+
+
+@dataclass
+class LocalFile:
+    """An image in the synced folder, by absolute path"""
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: Optional[str] = None
+
+
+@dataclass
+class StoredObject:
+    """An original at the bucket root"""
+    key: str
+    size: int
+
+
+@dataclass
+class SyncPlan:
+    """What differs between the folder, the bucket and the wallpapers table"""
+    files: int = 0
+    hashed: int = 0
+    objects: int = 0
+    rows: int = 0
+    in_sync: int = 0
+    # Content the bucket does not have: uploaded and inserted
+    upload: List[LocalFile] = field(default_factory=list)
+    # Content already stored but without a row: inserted only
+    insert: List[Tuple[LocalFile, StoredObject]] = field(default_factory=list)
+    # Files with the same content as another file in the folder
+    copies: List[LocalFile] = field(default_factory=list)
+    # Originals no local file has, and originals whose content hash is unknown
+    bucket_only: List[str] = field(default_factory=list)
+    unmatched: List[str] = field(default_factory=list)
+    # Rows pointing at an object that is not in the bucket
+    missing_objects: List[Dict] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def delta(self) -> int:
+        return len(self.upload) + len(self.insert)
+
+    def format_summary(self) -> str:
+        lines = [
+            f"Compared {self.files} files with {self.objects} originals and {self.rows} rows in {self.seconds:.1f}s "
+            f"({self.hashed} files hashed, the rest unchanged since they were last hashed)",
+            f"  {self.in_sync} in sync, {len(self.upload)} to upload, {len(self.insert)} stored without a row "
+            f"to insert, {len(self.copies)} copies of another file skipped",
+        ]
+        if self.bucket_only:
+            lines.append(f"  {len(self.bucket_only)} originals in the bucket are not in the folder:")
+            lines += _listed(self.bucket_only)
+        if self.unmatched:
+            lines.append(f"  {len(self.unmatched)} originals have no known content hash and were not compared "
+                         f"(--rebuild-index recovers hashes recorded at upload)")
+        if self.missing_objects:
+            lines.append(f"  {len(self.missing_objects)} rows point at an object that is not in the bucket:")
+            lines += _listed(row['image_url'] for row in self.missing_objects)
+        return "\n".join(lines)
+
+
+def _listed(names: Iterable[str]) -> List[str]:
+    names = list(names)
+    lines = [f"    {name}" for name in names[:MAX_LISTED]]
+    if len(names) > MAX_LISTED:
+        lines.append(f"    ... and {len(names) - MAX_LISTED} more")
+    return lines
+
+
+def walk_images(directory: Path, extensions: Iterable[str], recursive: bool = False) -> Iterator[LocalFile]:
+    """Yield every image under directory with its size and mtime, from one stat per file"""
+    extensions = {extension.lower() for extension in extensions}
+    pending = [os.path.abspath(directory)]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                    stat = entry.stat()
+                    yield LocalFile(entry.path, stat.st_size, stat.st_mtime_ns)
+
+
+def _list_range(r2_client, bucket_name: str, after: Optional[str], end: Optional[str]) -> List[StoredObject]:
+    """Root-level objects with after < key <= end; nested derivatives are rolled up by the delimiter"""
+    paginator = r2_client.get_paginator('list_objects_v2')
+    options = {'Bucket': bucket_name, 'Delimiter': '/'}
+    if after:
+        options['StartAfter'] = after
+    objects = []
+    for page in paginator.paginate(**options):
+        for obj in page.get('Contents', []):
+            if end is not None and obj['Key'] > end:
+                return objects
+            objects.append(StoredObject(obj['Key'], obj['Size']))
+        prefixes = [prefix['Prefix'] for prefix in page.get('CommonPrefixes', [])]
+        if end is not None and prefixes and prefixes[-1] > end:
+            return objects
+    return objects
+
+
+def list_originals(r2_client, bucket_name: str, workers: int = DEFAULT_SYNC_WORKERS) -> List[StoredObject]:
+    """Every original at the bucket root, from paginated ListObjectsV2 calls over key ranges in parallel
+
+    A single listing is a chain of continuation tokens, so it can only go one
+    page at a time. Splitting the key space with StartAfter gives one
+    independent chain per range.
+    """
+    bounds = list(zip((None,) + LIST_BOUNDARIES, LIST_BOUNDARIES + (None,)))
+    with ThreadPoolExecutor(max_workers=min(workers, len(bounds)), thread_name_prefix='list') as executor:
+        ranges = executor.map(lambda bound: _list_range(r2_client, bucket_name, *bound), bounds)
+        return [obj for objects in ranges for obj in objects]
+
+
+def list_rows(supabase_client, columns: str, workers: int = DEFAULT_SYNC_WORKERS,
+              page_size: int = 1000) -> List[Dict]:
+    """Every wallpapers row; the first page reports the row count, then the other pages are fetched in parallel"""
+    def page(start: int):
+        return (supabase_client.table('wallpapers')
+                .select(columns, count='exact')
+                .order('id')
+                .range(start, start + page_size - 1)
+                .execute())
+
+    first = page(0)
+    rows = list(first.data or [])
+    if first.count is None:
+        return list(iter_rows(supabase_client, page_size, columns))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rows') as executor:
+        for result in executor.map(page, range(page_size, first.count, page_size)):
+            rows.extend(result.data or [])
+    return rows
+
+
+def plan_sync(directory: Path, extensions: Iterable[str], content_index: ContentIndex, r2_client,
+              bucket_name: str, supabase_client, public_url_base: str, recursive: bool = False,
+              workers: int = DEFAULT_SYNC_WORKERS) -> SyncPlan:
+    """Compare a folder with the bucket and the wallpapers table without transferring any object
+
+    The content index's hash cache is the local manifest: a file whose size
+    and mtime match its cached entry keeps its hash, and only the rest are
+    read. Both listings run while the folder is walked and hashed.
+    """
+    started = time.perf_counter()
+    plan = SyncPlan()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='sync-list') as listings:
+        objects_future = listings.submit(list_originals, r2_client, bucket_name, workers)
+        rows_future = listings.submit(list_rows, supabase_client, 'id,image_url,content_hash', workers)
+
+        files = sorted(walk_images(directory, extensions, recursive), key=lambda local: local.path)
+        cached = content_index.cached_hashes()
+        stale = []
+        for local in files:
+            size, mtime_ns, sha256 = cached.get(local.path, (None, None, None))
+            if size == local.size and mtime_ns == local.mtime_ns:
+                local.sha256 = sha256
+            else:
+                stale.append(local)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync-hash') as hashing:
+            for local, sha256 in zip(stale, hashing.map(content_index.hash_file, [local.path for local in stale])):
+                local.sha256 = sha256
+        objects = objects_future.result()
+        rows = rows_future.result()
+    plan.files, plan.hashed, plan.objects, plan.rows = len(files), len(stale), len(objects), len(rows)
+
+    # Content keys carry their hash; other keys are matched through what the content index recorded
+    stored: Dict[str, StoredObject] = {}
+    legacy: Dict[str, StoredObject] = {}
+    for obj in objects:
+        match = CONTENT_KEY_RE.match(obj.key)
+        if match:
+            stored[match.group('sha256')] = obj
+        else:
+            legacy[obj.key] = obj
+    hash_for_key = {obj.key: sha256 for sha256, obj in stored.items()}
+    for entry in content_index.entries():
+        if entry.object_key in legacy:
+            stored.setdefault(entry.sha256, legacy.pop(entry.object_key))
+            hash_for_key[entry.object_key] = entry.sha256
+    plan.unmatched = sorted(legacy)
+
+    # Rows are matched by content_hash, or by the key in image_url for rows that predate it
+    published = set()
+    for row in rows:
+        key = object_key_for_url(row.get('image_url'), public_url_base)
+        sha256 = row.get('content_hash') or hash_for_key.get(key)
+        if sha256:
+            published.add(sha256)
+        if key is not None and key not in hash_for_key and key not in legacy:
+            plan.missing_objects.append(row)
+
+    local_hashes = set()
+    for local in files:
+        if local.sha256 in local_hashes:
+            plan.copies.append(local)
+            continue
+        local_hashes.add(local.sha256)
+        obj = stored.get(local.sha256)
+        if obj is None:
+            plan.upload.append(local)
+        elif local.sha256 not in published:
+            plan.insert.append((local, obj))
+        else:
+            plan.in_sync += 1
+    plan.bucket_only = sorted(obj.key for sha256, obj in stored.items() if sha256 not in local_hashes)
+    plan.seconds = time.perf_counter() - started
+    return plan
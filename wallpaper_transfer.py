@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+R2 transfer tuning and upload progress tracking for the Wallpaper Publisher
+Large originals are sent as parallel multipart uploads streamed from disk
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+MB = 1024 * 1024
+
+# R2 (like S3) rejects multipart parts smaller than 5 MB, except the last one
+MIN_PART_SIZE = 5 * MB
+
+
+def env_int(name: str, default: int) -> int:
+    """Read a positive integer from the environment, falling back to a default"""
+    value = os.getenv(name, '').strip('"').strip()
+    if not value:
+        return default
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+    if parsed < 1:
+        raise ValueError(f"{name} must be at least 1, got {parsed}")
+    return parsed
+
+
+def upload_concurrency() -> int:
+    """Number of parts uploaded in parallel for a single object"""
+    return env_int('R2_UPLOAD_CONCURRENCY', 10)
+
+
+def transfer_config_from_env():
+    """Build the multipart transfer settings from R2_* environment variables
+
+    R2_MULTIPART_THRESHOLD_MB  files at least this large use multipart (default 16)
+    R2_MULTIPART_CHUNK_MB      size of each part (default 16, minimum 5)
+    R2_UPLOAD_CONCURRENCY      parts in flight per object (default 10)
+    """
+    # boto3 is slow to import, so it is loaded only once an upload is configured
+    from boto3.s3.transfer import TransferConfig
+
+    threshold = env_int('R2_MULTIPART_THRESHOLD_MB', 16) * MB
+    chunk_size = max(MIN_PART_SIZE, env_int('R2_MULTIPART_CHUNK_MB', 16) * MB)
+    return TransferConfig(
+        multipart_threshold=threshold,
+        multipart_chunksize=chunk_size,
+        max_concurrency=upload_concurrency(),
+        use_threads=True,
+    )
+
+
+class UploadProgress:
+    """Thread-safe boto3 transfer callback that tracks bytes sent and throughput
+
+    boto3 invokes the callback from its part-upload threads with the number of
+    bytes just sent; on_update is called at most every `interval` seconds, and
+    always once the final byte has been reported.
+    """
+
+    def __init__(self, total_bytes: int,
+                 on_update: Optional[Callable[['UploadProgress'], None]] = None,
+                 interval: float = 0.1, window: float = 2.0):
+        self.total_bytes = total_bytes
+        self.on_update = on_update
+        self.interval = interval
+        self.window = window
+        self.bytes_sent = 0
+        self.started = time.monotonic()
+        self._samples = deque([(self.started, 0)])
+        self._last_update = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int):
+        with self._lock:
+            now = time.monotonic()
+            self.bytes_sent += bytes_amount
+            self._samples.append((now, self.bytes_sent))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+                self._samples.popleft()
+
+            finished = self.bytes_sent >= self.total_bytes
+            if not finished and now - self._last_update < self.interval:
+                return
+            self._last_update = now
+
+        if self.on_update:
+            self.on_update(self)
+
+    @property
+    def fraction(self) -> float:
+        if self.total_bytes <= 0:
+            return 1.0
+        return min(1.0, self.bytes_sent / self.total_bytes)
+
+    @property
+    def rate_mb_s(self) -> float:
+        """Throughput over the recent sampling window in MB/s"""
+        with self._lock:
+            (start_time, start_bytes), (end_time, end_bytes) = self._samples[0], self._samples[-1]
+        elapsed = end_time - start_time
+        return (end_bytes - start_bytes) / elapsed / MB if elapsed > 0 else 0.0
+
+    @property
+    def average_mb_s(self) -> float:
+        """Throughput since the upload started in MB/s"""
+        elapsed = time.monotonic() - self.started
+        return self.bytes_sent / elapsed / MB if elapsed > 0 else 0.0
+
+    def describe(self) -> str:
+        """Human readable progress, e.g. '45% (36.0 of 80.0 MB, 24.3 MB/s)'"""
+        return (f"{self.fraction:.0%} ({self.bytes_sent / MB:.1f} of "
+                f"{self.total_bytes / MB:.1f} MB, {self.rate_mb_s:.1f} MB/s)")
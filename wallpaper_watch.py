@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Watch-folder source for the Wallpaper Publisher daemon mode
+Yields image files dropped into a directory once they have stopped changing,
+using inotify on Linux and periodic directory scans everywhere else
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+# inotify event bits, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# A file is published once its size and mtime have not changed for this long
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+# (size, mtime_ns) of a file as last seen
+Signature = Tuple[int, int]
+
+
+class _Inotify:
+    """Minimal ctypes binding for the Linux inotify API"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, Path] = {}
+
+    def close(self):
+        os.close(self.fd)
+
+    def add(self, directory: Path):
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"Cannot watch {directory}: {os.strerror(code)}")
+        self.directories[wd] = directory
+
+    def read(self, timeout: float) -> Optional[Iterator[Tuple[Path, int]]]:
+        """(path, mask) pairs that arrived within timeout; None if the kernel queue overflowed"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return iter(())
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return iter(())
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is not None:
+                events.append((directory / os.fsdecode(name) if name else directory, mask))
+        return iter(events)
+
+
+class FolderWatcher:
+    """Iterates over the images in a directory as they finish arriving
+
+    Files already in the directory are yielded first, then new or rewritten
+    files once their size and modification time have held still for
+    settle_seconds, so a file that is still being copied in is never picked up
+    half written. Iteration blocks until stop() is called from another thread.
+
+    inotify is used where available. Network shares do not report writes made
+    by other machines through inotify, so force_polling switches to scanning
+    the directory every poll_interval seconds.
+    """
+
+    def __init__(self, directory: Path, extensions: Iterable[str], recursive: bool = False,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 force_polling: bool = False):
+        self.directory = Path(directory)
+        self.extensions = {extension.lower() for extension in extensions}
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self.backend = 'polling'
+        self._stopped = threading.Event()
+        # Files seen changing, with when they last changed
+        self._pending: Dict[Path, Tuple[Signature, float]] = {}
+        # Files already yielded, so an unchanged file is not yielded twice
+        self._emitted: Dict[Path, Signature] = {}
+        self._inotify: Optional[_Inotify] = None
+        self._started = False
+
+    def stop(self):
+        """End the iteration at the next wake-up; safe to call from any thread"""
+        self._stopped.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def start(self) -> 'FolderWatcher':
+        """Choose inotify or polling and add the watches; iterating starts the watcher if needed"""
+        if not self._started:
+            self._open_inotify()
+            self._started = True
+        return self
+
+    def __iter__(self) -> Iterator[Path]:
+        self.start()
+        try:
+            # Files that were already complete before the watch started are not waited on
+            self._scan(settled_before=time.time() - self.settle_seconds)
+            next_scan = time.monotonic() + self.poll_interval
+            while not self._stopped.is_set():
+                yield from self._settled()
+                timeout = self._next_timeout()
+                if self._inotify is not None:
+                    events = self._inotify.read(timeout)
+                    if events is None:
+                        # Events were lost; a full scan finds whatever they were about
+                        self._scan()
+                    else:
+                        for path, mask in events:
+                            self._handle_event(path, mask)
+                else:
+                    self._stopped.wait(timeout)
+                    if time.monotonic() >= next_scan:
+                        self._scan()
+                        next_scan = time.monotonic() + self.poll_interval
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            self._started = False
+
+    def _open_inotify(self):
+        self.backend = 'polling'
+        if self.force_polling or not sys.platform.startswith('linux'):
+            return
+        try:
+            self._inotify = _Inotify()
+            for directory in self._directories():
+                self._inotify.add(directory)
+        except (OSError, AttributeError) as e:
+            # Not Linux, no inotify in the kernel, or the per-user watch limit (ENOSPC) is reached
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            reason = 'the inotify watch limit is reached' if getattr(e, 'errno', None) == errno.ENOSPC else str(e)
+            print(f"inotify unavailable ({reason}); polling every {self.poll_interval:g}s instead")
+            return
+        self.backend = 'inotify'
+
+    def _directories(self) -> Iterator[Path]:
+        yield self.directory
+        if self.recursive:
+            for root, directories, _ in os.walk(self.directory):
+                directories[:] = sorted(name for name in directories if not name.startswith('.'))
+                for name in directories:
+                    yield Path(root, name)
+
+    def _is_candidate(self, path: Path) -> bool:
+        # Hidden names cover the temporary files rsync and most editors write before renaming
+        return not path.name.startswith('.') and path.suffix.lower() in self.extensions
+
+    def _handle_event(self, path: Path, mask: int):
+        if mask & IN_ISDIR:
+            if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and not path.name.startswith('.'):
+                # Watch the new directory before scanning it, so nothing written in between is missed
+                try:
+                    self._inotify.add(path)
+                except OSError as e:
+                    print(f"Cannot watch {path}: {e}")
+                self._scan(path)
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._pending.pop(path, None)
+            self._emitted.pop(path, None)
+        elif self._is_candidate(path):
+            self._observe(path)
+
+    def _scan(self, directory: Optional[Path] = None, settled_before: Optional[float] = None):
+        """Stat every candidate; files gone since the last scan are forgotten"""
+        directory = directory or self.directory
+        seen: Set[Path] = set()
+        for root, directories, files in os.walk(directory):
+            directories[:] = [name for name in directories if not name.startswith('.')] if self.recursive else []
+            for name in files:
+                path = Path(root, name)
+                if self._is_candidate(path):
+                    seen.add(path)
+                    self._observe(path, settled_before)
+        if directory == self.directory:
+            for path in [path for path in self._pending if path not in seen]:
+                del self._pending[path]
+            for path in [path for path in self._emitted if path not in seen]:
+                del self._emitted[path]
+
+    def _observe(self, path: Path, settled_before: Optional[float] = None):
+        """Note a file's current size and mtime, restarting its quiet period if they changed"""
+        try:
+            stat = path.stat()
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if self._emitted.get(path) == signature:
+            return
+        pending = self._pending.get(path)
+        if pending and pending[0] == signature:
+            return
+        changed_at = time.monotonic()
+        if settled_before is not None and stat.st_mtime < settled_before:
+            changed_at -= self.settle_seconds
+        self._pending[path] = (signature, changed_at)
+
+    def _settled(self) -> Iterator[Path]:
+        """Yield pending files whose quiet period has passed, oldest first"""
+        now = time.monotonic()
+        due = sorted((changed_at, path) for path, (_, changed_at) in self._pending.items()
+                     if now - changed_at >= self.settle_seconds)
+        for _, path in due:
+            signature, _ = self._pending.pop(path)
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                # Still being written; wait for it to go quiet again
+                self._pending[path] = (current, time.monotonic())
+            else:
+                # Empty files are remembered too, and only reconsidered once they change
+                self._emitted[path] = current
+                if stat.st_size > 0:
+                    yield path
+
+    def _next_timeout(self) -> float:
+        """Sleep until the next pending file could settle, waking at least every poll_interval"""
+        if not self._pending:
+            return self.poll_interval
+        earliest = min(changed_at for _, changed_at in self._pending.values())
+        remaining = earliest + self.settle_seconds - time.monotonic()
+        return max(0.05, min(self.poll_interval, remaining))